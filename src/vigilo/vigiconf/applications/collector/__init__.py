@@ -19,5 +19,6 @@ class Collector(Application):
     start_command = None
     stop_command = None
     generator = generator.CollectorGen
+    defaults = {"bundle_shards": 0}
     group = "collect"
 
@@ -4,25 +4,47 @@
 
 """Generator for the Collector"""
 
-import os
-
 from vigilo.vigiconf import conf
-from vigilo.vigiconf.lib.generators import FileGenerator
+from vigilo.vigiconf.lib.generators import BundleGenerator
+from vigilo.vigiconf.lib.capacity import snmp_requests, oids_per_pdu
+
+
+def _oid_key(oid):
+    """Clé de tri numérique d'un OID (les OID voisins sont regroupés)."""
+    try:
+        return (0, tuple(int(i) for i in oid.strip(".").split(".")))
+    except ValueError:
+        return (1, oid)
 
+def snmp_request_plan(host):
+    """
+    Prépare les requêtes SNMP à effectuer à chaque cycle de collecte
+    pour un hôte : les OID partagés par plusieurs jobs ne sont interrogés
+    qu'une seule fois et les requêtes GET sont regroupées par PDU de
+    C{snmpOIDsPerPDU} OID.
+    @param host: configuration de l'hôte (entrée de C{conf.hostsConf}).
+    @type  host: C{dict}
+    @return: OID de chaque PDU GET et OID à parcourir (WALK).
+    @rtype: C{tuple} de deux C{list}
+    """
+    gets, walks = snmp_requests(host)
+    gets = sorted(gets, key=_oid_key)
+    per_pdu = oids_per_pdu(host)
+    pdus = [ gets[i:i + per_pdu] for i in range(0, len(gets), per_pdu) ]
+    return (pdus, sorted(walks, key=_oid_key))
 
-class CollectorGen(FileGenerator):
+
+class CollectorGen(BundleGenerator):
     """Generator for the Collector"""
 
     def generate_host(self, hostname, vserver):
-        fileName = os.path.join(self.baseDir, vserver, self.application.name,
-                                "%s.pm" % hostname)
+        fileName = self.hostFile(hostname, vserver, "%s.pm" % hostname)
         h = conf.hostsConf[hostname]
-        newhash = h.copy()
-        if newhash['snmpVersion'] == '2' or newhash['snmpVersion'] == '1':
-            newhash['snmpAuth'] = "communityString => '%(snmpCommunity)s'" \
-                                  % newhash
+        extra = {'confid': conf.confid}
+        if h['snmpVersion'] == '2' or h['snmpVersion'] == '1':
+            extra['snmpAuth'] = "communityString => '%(snmpCommunity)s'" % h
         else:
-            if newhash['snmpVersion'] == '3':
+            if h['snmpVersion'] == '3':
                 # Récupère les paramètres de l'authentification en v3.
                 # (snmpSeclevel, snmpSecname, etc.)
                 snmpAuth = []
@@ -34,19 +56,23 @@ class CollectorGen(FileGenerator):
                     'Authpass',
                     'Privproto',
                     'Privpass'):
-                    if newhash.get('snmp' + snmpV3Param):
+                    if h.get('snmp' + snmpV3Param):
                         snmpAuth.append("'%s' => '%s'" % (
                             snmpV3Param.lower(),
-                            newhash['snmp' + snmpV3Param]
+                            h['snmp' + snmpV3Param]
                         ))
-                newhash['snmpAuth'] = u', '.join(snmpAuth)
+                extra['snmpAuth'] = u', '.join(snmpAuth)
 
-        newhash['confid'] = conf.confid
-        self.templateCreate(fileName, self.templates["header"], newhash)
+        header = self.templates["header"]
+        self.hostCreate(fileName, hostname, header,
+                        header.context(h, **extra))
         if len(h['SNMPJobs']):
+            # Le plan est établi avant la conversion des variables
+            # des jobs en syntaxe Perl.
+            plan = snmp_request_plan(h)
             self.__fillsnmpjobs(hostname, fileName)
-        self.templateAppend(fileName, self.COMMON_PERL_LIB_FOOTER, {})
-        self.templateClose(fileName)
+            self.__fillrequests(fileName, plan)
+        self.hostClose(fileName, hostname)
 
     def __fillsnmpjobs(self, hostname, fileName):
         """Fill the contents of the SNMP jobs file"""
@@ -75,9 +101,7 @@ class CollectorGen(FileGenerator):
                 forHost = jobdata['reRouteFor']['host']
                 service = self.quote(jobdata['reRouteFor']['service'].strip())
                 tplvars["dsname"] = service
-                vserver = self.ventilation[forHost]['nagios']
-                if isinstance(vserver, list):
-                    vserver = vserver[0]
+                vserver = self.ventilation.server_for(forHost, 'nagios')
                 if jobtype != 'perfData': # service check result => forHost's spoolme server
                     tplvars['reRouteFor'] = rr_tpl % (vserver, forHost,
                                                       service)
@@ -88,6 +112,15 @@ class CollectorGen(FileGenerator):
                 self.templateAppend(fileName, self.templates["service"],
                                     tplvars)
 
+    def __fillrequests(self, fileName, plan):
+        """Ajoute le plan des requêtes SNMP de l'hôte"""
+        pdus, walks = plan
+        self.templateAppend(fileName, self.templates["requests"], {
+            "get": "[%s]" % ", ".join([ self._convert_list(pdu)
+                                        for pdu in pdus ]),
+            "walk": self._convert_list(walks),
+        })
+
     def _convert_list(self, l):
         """Convertit en syntaxe Perl en protégeant contre l'unicode (#882)"""
         result = []
@@ -0,0 +1,2 @@
+$Hosts{'%(name)s'} = {%%Host};
+}
@@ -0,0 +1 @@
+$Host{requests} = {get => %(get)s, walk => %(walk)s};
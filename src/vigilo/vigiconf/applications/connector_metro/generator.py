@@ -7,12 +7,9 @@ Generator for connector-metro, the RRD db generator
 """
 
 
-import os.path
-import stat
-import sqlite3
-
 from vigilo.vigiconf import conf
-from vigilo.vigiconf.lib.generators import Generator, GenerationError
+from vigilo.vigiconf.lib.generators import GenerationError
+from vigilo.vigiconf.lib.generators.sqlitedb import SQLiteGenerator
 from vigilo.common.logging import get_logger
 LOGGER = get_logger(__name__)
 
@@ -20,15 +17,72 @@ from vigilo.common.gettext import translate
 _ = translate(__name__)
 
 
-class ConnectorMetroGen(Generator):
+SCHEMA = [
+    # perfdatasource
+    """CREATE TABLE perfdatasource (
+           idperfdatasource INTEGER NOT NULL,
+           name TEXT NOT NULL,
+           hostname VARCHAR(255) NOT NULL,
+           type VARCHAR(255) NOT NULL,
+           PDP_step INTEGER NOT NULL,
+           heartbeat INTEGER NOT NULL,
+           min FLOAT,
+           max FLOAT,
+           factor FLOAT NOT NULL,
+           warning_threshold VARCHAR(32),
+           critical_threshold VARCHAR(32),
+           nagiosname VARCHAR(255),
+           ventilation VARCHAR(255),
+           PRIMARY KEY (idperfdatasource)
+       )""",
+    # rra
+    """CREATE TABLE rra (
+           idrra INTEGER NOT NULL,
+           type VARCHAR(255) NOT NULL,
+           xff FLOAT,
+           RRA_step INTEGER NOT NULL,
+           rows INTEGER NOT NULL,
+           PRIMARY KEY (idrra)
+       )""",
+    # liaison
+    """CREATE TABLE pdsrra (
+           idperfdatasource INTEGER NOT NULL,
+           idrra INTEGER NOT NULL,
+           "order" INTEGER NOT NULL,
+           PRIMARY KEY (idperfdatasource, idrra),
+           UNIQUE (idperfdatasource, "order"),
+           FOREIGN KEY(idperfdatasource)
+               REFERENCES perfdatasource (idperfdatasource)
+               ON DELETE CASCADE ON UPDATE CASCADE,
+           FOREIGN KEY(idrra)
+               REFERENCES rra (idrra)
+               ON DELETE CASCADE ON UPDATE CASCADE
+       )""",
+]
+
+INDEXES = [
+    "CREATE INDEX ix_perfdatasource_name ON perfdatasource (name)",
+    "CREATE INDEX ix_perfdatasource_hostname ON perfdatasource (hostname)",
+    "CREATE INDEX ix_perfdatasource_warning_threshold "
+        "ON perfdatasource (warning_threshold)",
+    "CREATE INDEX ix_perfdatasource_critical_threshold "
+        "ON perfdatasource (critical_threshold)",
+]
+
+
+class ConnectorMetroGen(SQLiteGenerator):
     """Generator for connector-metro, the RRD db generator"""
     # On doit déployer sur tous les serveurs retournés
     # par la ventilation (nominal + backup).
     deploy_only_on_first = False
+    db_name = "connector-metro.db"
+    schema = SCHEMA
+    indexes = INDEXES
 
     def generate(self):
         # pylint: disable-msg=W0201
-        self.connections = {}
+        self.init_databases()
+        self._rras = {}
         super(ConnectorMetroGen, self).generate()
         self.finalize_databases()
 
@@ -40,14 +94,10 @@ class ConnectorMetroGen(Generator):
         # Ajout des serveurs de backup
         if vserver not in self.application.servers:
             self.application.add_server(vserver)
-        # Initialisation de la base
-        db_path = os.path.join(self.baseDir, vserver, "connector-metro.db")
-        if vserver not in self.connections:
-            self.init_db(db_path, vserver)
-            os.chmod(db_path, # chmod 644
-                     stat.S_IRUSR | stat.S_IWUSR | \
-                     stat.S_IRGRP | stat.S_IROTH )
-        cursor = self.connections[vserver]["cursor"]
+        signature = (h['dataSources'], h['netflow'], h['metro_services'],
+                     self.config_digest)
+        if not self.host_changed(vserver, hostname, signature):
+            return
         datasources = h['dataSources'].keys()
         datasources.sort()
         netflow_datasources = []
@@ -85,70 +135,45 @@ class ConnectorMetroGen(Generator):
                 tplvars["min"] = None
 
             if not datasource in netflow_datasources:
-                self.db_add_ds(cursor, tplvars, ds_data.get("rra_template"))
+                self.db_add_ds(vserver, tplvars, ds_data.get("rra_template"))
             else:
                 # Netflow est un cas un peu à part
                 # et nécessite un modèle spécifique
                 # de stockage des données dans les RRD.
-                self.db_add_ds(cursor, tplvars, "netflow")
-
-    def init_db(self, db_path, vserver):
-        try:
-            os.makedirs(os.path.dirname(db_path))
-        except OSError:
-            pass
-        db = sqlite3.connect(db_path)
-        c = db.cursor()
-        self.connections[vserver] = {"db": db, "cursor": c}
-        # perfdatasource
-        c.execute("""CREATE TABLE perfdatasource (
-                         idperfdatasource INTEGER NOT NULL,
-                         name TEXT NOT NULL,
-                         hostname VARCHAR(255) NOT NULL,
-                         type VARCHAR(255) NOT NULL,
-                         PDP_step INTEGER NOT NULL,
-                         heartbeat INTEGER NOT NULL,
-                         min FLOAT,
-                         max FLOAT,
-                         factor FLOAT NOT NULL,
-                         warning_threshold VARCHAR(32),
-                         critical_threshold VARCHAR(32),
-                         nagiosname VARCHAR(255),
-                         ventilation VARCHAR(255),
-                         PRIMARY KEY (idperfdatasource)
-                     )""")
-        #c.execute("CREATE INDEX ix_perfdatasource_name "
-        #          "ON perfdatasource (name)")
-        #c.execute("CREATE INDEX ix_perfdatasource_hostname "
-        #          "ON perfdatasource (hostname)")
-        # rra
-        c.execute("""CREATE TABLE rra (
-                         idrra INTEGER NOT NULL,
-                         type VARCHAR(255) NOT NULL,
-                         xff FLOAT,
-                         RRA_step INTEGER NOT NULL,
-                         rows INTEGER NOT NULL,
-                         PRIMARY KEY (idrra)
-                     )""")
-        # liaison
-        c.execute("""CREATE TABLE pdsrra (
-                         idperfdatasource INTEGER NOT NULL,
-                         idrra INTEGER NOT NULL,
-                         "order" INTEGER NOT NULL,
-                         PRIMARY KEY (idperfdatasource, idrra),
-                         UNIQUE (idperfdatasource, "order"),
-                         FOREIGN KEY(idperfdatasource)
-                             REFERENCES perfdatasource (idperfdatasource)
-                             ON DELETE CASCADE ON UPDATE CASCADE,
-                         FOREIGN KEY(idrra)
-                             REFERENCES rra (idrra)
-                             ON DELETE CASCADE ON UPDATE CASCADE
-                     )""")
-        #db.commit()
-        #c.close()
-        #db.close()
-
-    def db_add_ds(self, cursor, data, rra_template=None):
+                self.db_add_ds(vserver, tplvars, "netflow")
+
+    def open_database(self, vserver, db):
+        # Définitions des RRA déjà présentes dans la base :
+        # (type, xff, RRA_step, rows) -> idrra
+        self._rras[vserver] = {}
+        if db.base is not None:
+            for row in db.execute("SELECT type, xff, RRA_step, rows, idrra "
+                                  "FROM rra"):
+                self._rras[vserver][tuple(row[:4])] = row[4]
+
+    def delete_host(self, db, hostname):
+        db.execute("DELETE FROM pdsrra WHERE idperfdatasource IN "
+                   "(SELECT idperfdatasource FROM perfdatasource "
+                   "WHERE hostname = ?)", (hostname, ))
+        db.execute("DELETE FROM perfdatasource WHERE hostname = ?",
+                   (hostname, ))
+
+    def db_add_rra(self, vserver, rra):
+        """
+        Retourne l'identifiant de la définition de RRA donnée,
+        en l'ajoutant à la base si elle n'y figure pas encore.
+        Une même définition n'est ainsi stockée qu'une seule fois,
+        quel que soit le nombre de sources de données qui l'utilisent.
+        """
+        key = (rra["type"], rra["xff"], rra["RRA_step"], rra["rows"])
+        rras = self._rras[vserver]
+        if key not in rras:
+            db = self.databases[vserver]
+            rras[key] = db.next_id("rra")
+            db.insert("rra", (rras[key], ) + key)
+        return rras[key]
+
+    def db_add_ds(self, vserver, data, rra_template=None):
         config = self.application.getConfig()
         if rra_template is None:
             rra_template = "basic"
@@ -158,44 +183,16 @@ class ConnectorMetroGen(Generator):
         rra_template = config["rra"][rra_template]
         rras = rra_template["rras"]
 
-
+        db = self.databases[vserver]
         PDP_step = rra_template.get("PDP_step", config["PDP_step"])
         heartbeat = rra_template.get("heartbeat", config["heartbeat"])
-        cursor.execute("INSERT INTO perfdatasource VALUES ("
-                       "NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                       (data["dsName"], data["host"], data["dsType"],
-                        PDP_step, heartbeat,
-                        data["min"], data["max"], data["factor"],
-                        data["warningThreshold"], data["criticalThreshold"],
-                        data["nagiosName"], data['vserver']))
-        ds_id = cursor.lastrowid
+        ds_id = db.next_id("perfdatasource")
+        db.insert("perfdatasource",
+                  (ds_id, data["dsName"], data["host"], data["dsType"],
+                   PDP_step, heartbeat,
+                   data["min"], data["max"], data["factor"],
+                   data["warningThreshold"], data["criticalThreshold"],
+                   data["nagiosName"], data['vserver']))
 
         for index, rra in enumerate(rras):
-            cursor.execute("SELECT idrra FROM rra WHERE type = ? AND xff = ? "
-                           "AND RRA_step = ? AND rows = ?",
-                           (rra["type"], rra["xff"], rra["RRA_step"], rra["rows"]))
-            rra_id = cursor.fetchone()
-            if rra_id is None:
-                cursor.execute("INSERT INTO rra VALUES (NULL, ?, ?, ?, ?)",
-                           (rra["type"], rra["xff"], rra["RRA_step"], rra["rows"]))
-                rra_id = cursor.lastrowid
-            else:
-                rra_id = rra_id[0]
-            cursor.execute("INSERT INTO pdsrra VALUES (?, ?, ?)",
-                           (ds_id, rra_id, index))
-
-    def finalize_databases(self):
-        for vserver in self.connections:
-            db = self.connections[vserver]["db"]
-            cursor = self.connections[vserver]["cursor"]
-            cursor.execute("CREATE INDEX ix_perfdatasource_name "
-                           "ON perfdatasource (name)")
-            cursor.execute("CREATE INDEX ix_perfdatasource_hostname "
-                           "ON perfdatasource (hostname)")
-            cursor.execute("CREATE INDEX ix_perfdatasource_warning_threshold "
-                           "ON perfdatasource (warning_threshold)")
-            cursor.execute("CREATE INDEX ix_perfdatasource_critical_threshold "
-                           "ON perfdatasource (critical_threshold)")
-            db.commit()
-            cursor.close()
-            db.close()
+            db.insert("pdsrra", (ds_id, self.db_add_rra(vserver, rra), index))
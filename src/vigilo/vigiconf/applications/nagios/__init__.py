@@ -20,6 +20,16 @@ class Nagios(Application):
     stop_command = "stop.sh"
     generator = generator.NagiosGen
     group = "collect"
+    defaults = {
+        # Répartition de la première vérification des services actifs
+        # sur leur intervalle (voir le fichier "nagios/schedule").
+        "spread_checks": False,
+        # Durée (en secondes) d'une unité de temps Nagios.
+        "interval_length": 60,
+        # Un fichier par hôte dans le dossier "nagios/hosts", au lieu
+        # d'un unique fichier "nagios/nagios.cfg".
+        "per_host_files": False,
+    }
 #pylint: disable-msg=C0103
 
 
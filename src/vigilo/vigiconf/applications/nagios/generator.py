@@ -7,16 +7,10 @@
 from vigilo.common.conf import settings
 
 import os.path
-
-import networkx as nx
+import hashlib
 
 from vigilo.vigiconf import conf
-from vigilo.vigiconf.lib.generators import FileGenerator
-
-from sqlalchemy.orm import aliased
-from vigilo.models.session import DBSession
-from vigilo.models.tables import Host, Ventilation, VigiloServer, Dependency, \
-                                    DependencyGroup, Application
+from vigilo.vigiconf.lib.generators import FileGenerator, TopologyIndex
 
 class NagiosGen(FileGenerator):
     """
@@ -32,14 +26,118 @@ class NagiosGen(FileGenerator):
     def generate(self):
         # pylint: disable-msg=W0201
         self._files = {}
-        self._graph = None
+        self._topology = TopologyIndex(self.ventilation,
+                                       self.application.name)
+        self._offsets = {}
+        self._hostfiles = {}
         # Force the creation of a configuration directory.
         # That way, Nagios won't refuse to start due to a non-existing
         # directory appearing in the main configuration file (cfg_dir).
-        for vserver in self.ventilation.keys():
+        for vserver in self.get_vigilo_servers():
             self.createDirIfMissing(os.path.join(
                 self.baseDir, vserver, "nagios", "nagios.cfg"))
+        config = self.application.getConfig()
+        self._per_host = bool(config.get("per_host_files"))
+        if config.get("spread_checks"):
+            self._compute_offsets(config.get("interval_length", 60))
         super(NagiosGen, self).generate()
+        if self._offsets:
+            self._write_schedules()
+        if self._per_host:
+            self._write_hosts_index()
+
+    def _active_services(self, hostname):
+        """
+        @return: services actifs de l'hôte et leur intervalle de
+            vérification (en unités de temps Nagios).
+        @rtype: C{list} of C{tuple}
+        """
+        h = conf.hostsConf[hostname]
+        if h['force-passive']:
+            return []
+        default = h['nagiosDirectives'].get('services', {}).get(
+                    'check_interval', 5)
+        services = []
+        for srvname, srvdata in h['services'].iteritems():
+            if srvdata['type'] != 'active':
+                continue
+            interval = h['nagiosSrvDirs'].get(srvname, {}).get(
+                            'check_interval', default)
+            try:
+                interval = float(interval)
+            except (TypeError, ValueError):
+                interval = 5.0
+            services.append((srvname, interval))
+        return services
+
+    def _compute_offsets(self, interval_length):
+        """
+        Calcule le décalage de la première vérification de chaque service
+        actif, afin de répartir uniformément les vérifications de chaque
+        serveur Vigilo sur leur intervalle.
+
+        Les services d'un serveur ayant le même intervalle sont ordonnés
+        selon l'empreinte de leur nom (et de celui de leur hôte), puis
+        répartis à intervalles réguliers : le résultat ne dépend pas de
+        l'ordre de génération.
+        """
+        # (serveur, intervalle) -> [(empreinte, hôte, service)]
+        slots = {}
+        for hostname, vservers in self.ventilation.assignments(
+                                    self.application.name):
+            for srvname, interval in self._active_services(hostname):
+                key = u"%s/%s" % (hostname, srvname)
+                digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+                slots.setdefault((vservers[0], interval), []).append(
+                        (digest, hostname, srvname))
+        for (vserver, interval), services in slots.iteritems():
+            services.sort()
+            period = interval * interval_length
+            step = period / len(services)
+            for index, (_digest, hostname, srvname) in enumerate(services):
+                self._offsets[(hostname, srvname)] = (vserver,
+                                                      int(index * step))
+
+    def _write_schedules(self):
+        """
+        Écrit, pour chaque serveur Vigilo, le fichier C{nagios/schedule}
+        utilisé au démarrage de Nagios pour planifier la première
+        vérification de chaque service actif.
+        """
+        by_vserver = {}
+        for (hostname, srvname), (vserver, offset) in \
+                self._offsets.iteritems():
+            by_vserver.setdefault(vserver, []).append(
+                    (offset, hostname, srvname))
+        tpl = self.templates["schedule"]
+        for vserver, services in by_vserver.iteritems():
+            services.sort()
+            fileName = os.path.join(self.baseDir, vserver, "nagios",
+                                    "schedule")
+            for index, (offset, hostname, srvname) in enumerate(services):
+                tplvars = {'name': hostname, 'serviceName': srvname,
+                           'offset': offset}
+                if not index:
+                    self.templateCreate(fileName, tpl, tplvars)
+                else:
+                    self.templateAppend(fileName, tpl, tplvars)
+            self.templateClose(fileName)
+
+    def _write_hosts_index(self):
+        """
+        Écrit, pour chaque serveur Vigilo, le fichier C{nagios/hosts.index}
+        donnant l'empreinte MD5 du fichier de chaque hôte (au format de
+        C{md5sum}).
+        """
+        for vserver, hostfiles in self._hostfiles.iteritems():
+            fileName = os.path.join(self.baseDir, vserver, "nagios",
+                                    "hosts.index")
+            index = open(fileName, "w")
+            for hostname in sorted(hostfiles):
+                index.write("%s  %s\n" % (hostfiles[hostname],
+                            os.path.join("hosts", "%s.cfg" % hostname)))
+            index.close()
+            self.results["files"] += 1
 
     def generate_host(self, hostname, vserver):
         # pylint: disable-msg=W0201
@@ -55,38 +153,48 @@ class NagiosGen(FileGenerator):
             self.templateCreate(self.fileName, self.templates["header"], {
                     "confid": conf.confid,
                 })
-        newhash = h.copy()
         # Groups
-        self.__fillgroups(hostname, newhash)
+        hdirectives = self.__fillgroups(hostname)
 
         # Dependencies
         parents = self._getdeps(hostname)
         if parents:
-            newhash['parents'] = "parents ".ljust(self.pad) + ",".join(parents)
+            parents = "parents ".ljust(self.pad) + ",".join(parents)
         else:
-            newhash['parents'] = ""
+            parents = ""
 
         # directives generiques du type host
-        newhash['generic_hdirectives'] =  "".join(["%s %s\n    " % \
+        generic_hdirectives = "".join(["%s %s\n    " % \
             (directive.ljust(self.pad), val)
-            for directive, val in \
-                    newhash['nagiosDirectives']['host'].iteritems()])
+            for directive, val in hdirectives.iteritems()])
 
-        # Add the host definition
-        self.templateAppend(self.fileName, self.templates['host'], newhash)
+        # Les groupes d'hôtes restent déclarés dans le fichier commun,
+        # l'hôte et ses services peuvent être placés dans leur propre fichier.
+        hostFile = self.fileName
+        if self._per_host:
+            hostFile = os.path.join(self.baseDir, vserver, "nagios", "hosts",
+                                    "%s.cfg" % hostname)
+            self.templateCreate(hostFile, self.templates["header"], {
+                    "confid": conf.confid,
+                })
 
-        # directives generiques du type services
-        newhash['generic_sdirectives'] = ""
-        generic_sdirectives = ""
-        if "nagiosDirectives" in newhash:
-            if "services" in newhash['nagiosDirectives']:
-                for directive, value in \
-                       newhash['nagiosDirectives']['services'].iteritems():
-                    newhash['generic_sdirectives'] += "%s %s\n    " % \
-                            (directive.ljust(self.pad), value)
+        # Add the host definition
+        tpl = self.templates['host']
+        self.templateAppend(hostFile, tpl, tpl.context(h,
+                            parents=parents,
+                            generic_hdirectives=generic_hdirectives))
 
         # Add the service item into the Nagios configuration file
-        self.__fillservices(hostname, newhash)
+        self.__fillservices(hostname, hostFile)
+
+        if self._per_host:
+            self.templateClose(hostFile)
+            content = open(hostFile, "rb")
+            try:
+                self._hostfiles.setdefault(vserver, {})[hostname] = \
+                    hashlib.md5(content.read()).hexdigest()
+            finally:
+                content.close()
 
         ## WARNING: ugly hack to handle routes (GCE based, must disappear)!!
         ## unused unless your host has a '-RT-DC' in its name
@@ -104,11 +212,16 @@ class NagiosGen(FileGenerator):
         #                                        {'name': h['name'],
         #                                        'serviceName': sname})
 
-    def __fillgroups(self, hostname, newhash):
-        """Fill the groups in the configuration file"""
+    def __fillgroups(self, hostname):
+        """
+        Fill the groups in the configuration file
+        @return: Directives Nagios de l'hôte, complétées avec ses groupes.
+        @rtype: C{dict}
+        """
         h = conf.hostsConf[hostname]
+        hdirectives = h['nagiosDirectives'].get('host', {}).copy()
         if "otherGroups" not in h:
-            return
+            return hdirectives
 
         # Déclaration des groupes d'hôtes à la volée pour pouvoir ensuite
         # les associer à la machine.
@@ -129,47 +242,11 @@ class NagiosGen(FileGenerator):
         # Les groupes sont ajoutés aux directives génériques.
         # Cela permet de fusionner ces groupes avec des groupes qui auraient
         # été ajoutés manuellement dans la configuration (cf. #2002).
-        hdirectives = newhash['nagiosDirectives'].setdefault('host', {})
         hgroups = ','.join(h['otherGroups'])
         if 'hostgroups' in hdirectives:
             hgroups = '%s,%s' % (hgroups, hdirectives['hostgroups'])
         hdirectives['hostgroups'] = hgroups
-
-    def _build_topology(self):
-        """
-        Construit la topologie dans un graphe NetworkX, accessible par
-        C{self._graph}.
-        """
-        self._graph = nx.DiGraph()
-
-        # On récupère dans la BDD la liste des dépendances.
-        # note: l'argument alias évite la création d'une sous-requête inutile
-        host1 = aliased(Host, alias=Host.__table__.alias())
-        host2 = aliased(Host, alias=Host.__table__.alias())
-        dependencies = DBSession.query(
-                            host1.name.label('host1'),
-                            host2.name.label('host2'),
-                            VigiloServer.name.label('vserver'),
-                        ).join(
-                            (Dependency, Dependency.idsupitem == host1.idhost),
-                            (DependencyGroup, DependencyGroup.idgroup ==
-                                Dependency.idgroup),
-                            (host2, host2.idhost == DependencyGroup.iddependent),
-                            (Ventilation, Ventilation.idhost ==
-                                Dependency.idsupitem),
-                            (VigiloServer, VigiloServer.idvigiloserver ==
-                                Ventilation.idvigiloserver),
-                            (Application, Application.idapp ==
-                                Ventilation.idapp),
-                        ).filter(DependencyGroup.role == u'topology'
-                        ).filter(Application.name == u'nagios'
-                        ).all()
-
-        # On ajoute ces dépendances dans le graphe en tant qu'arcs.
-        for dependency in dependencies:
-            self._graph.add_edge(dependency.host1, dependency.host2,
-                                 vserver=dependency.vserver)
-
+        return hdirectives
 
     def _getdeps(self, hostname):
         """
@@ -178,44 +255,30 @@ class NagiosGen(FileGenerator):
         @return: Parents topologiques de l'hôte
         @rtype: C{list}
         """
-        if self._graph is None:
-            self._build_topology()
-
-        if hostname not in self._graph.node:
-            return []
-
-        vserver = self.ventilation[hostname]['nagios']
-        if isinstance(vserver, list):
-            vserver = vserver[0]
+        return self._topology.parents(hostname)
 
-        deps = [ p for p in self._graph.predecessors(hostname)
-                 if self._graph.edge[p][hostname]['vserver'] == vserver ]
-        return deps
-
-    def __fillservices(self, hostname, newhash):
+    def __fillservices(self, hostname, fileName):
         """Fill the services section in the configuration file"""
         h = conf.hostsConf[hostname]
+        # directives generiques du type services, communes à tous
+        # les services de l'hôte
+        common_sdirectives = ""
+        for directive, value in \
+                h['nagiosDirectives'].get('services', {}).iteritems():
+            common_sdirectives += "%s %s\n    " % \
+                    (directive.ljust(self.pad), value)
         for (srvname, srvdata) in h['services'].iteritems():
-            scopy = srvdata.copy()
-
-            # directives generiques du type services
-            generic_sdirectives = ""
-            if "nagiosDirectives" in newhash:
-                if "services" in newhash['nagiosDirectives']:
-                    for directive, value in \
-                        newhash['nagiosDirectives']['services'].iteritems():
-                            generic_sdirectives += "%s %s\n    " % \
-                                        (directive.ljust(self.pad), value)
-            if newhash['nagiosSrvDirs'].has_key(srvname):
+            generic_sdirectives = common_sdirectives
+            if srvname in h['nagiosSrvDirs']:
                 for directive, value in \
-                        newhash['nagiosSrvDirs'][srvname].iteritems():
-                            generic_sdirectives += "%s %s\n    " % \
-                                    (directive.ljust(self.pad), value)
+                        h['nagiosSrvDirs'][srvname].iteritems():
+                    generic_sdirectives += "%s %s\n    " % \
+                            (directive.ljust(self.pad), value)
             # Handle command definition
-            if scopy.has_key('command') and scopy['type'] == 'active' and \
+            if 'command' in srvdata and srvdata['type'] == 'active' and \
                      not h['force-passive']:
                 generic_sdirectives += "%s %s\n    " % \
-                        ("check_command".ljust(self.pad), scopy['command'])
+                        ("check_command".ljust(self.pad), srvdata['command'])
             # Handle perfdata
             if srvname in h['PDHandlers']:
                 generic_sdirectives += "%s 1\n    " % \
@@ -225,10 +288,17 @@ class NagiosGen(FileGenerator):
                 # forcing passive type of service
                 tpltype = "passive"
             else:
-                tpltype = scopy['type']
-            self.templateAppend(self.fileName, self.templates[tpltype],
-                        {'name': h['name'],
-                         'serviceName': srvname,
-                         'generic_sdirectives': generic_sdirectives.rstrip()})
+                tpltype = srvdata['type']
+            # Décalage de la première vérification (informatif, la
+            # planification est effectuée au démarrage de Nagios).
+            if tpltype == "active" and (hostname, srvname) in self._offsets:
+                generic_sdirectives += "%s %d\n    " % \
+                    ("_SCHEDULE_OFFSET".ljust(self.pad),
+                     self._offsets[(hostname, srvname)][1])
+            tpl = self.templates[tpltype]
+            self.templateAppend(fileName, tpl, tpl.context(h, srvdata,
+                        name=h['name'],
+                        serviceName=srvname,
+                        generic_sdirectives=generic_sdirectives.rstrip()))
 
 # vim:set expandtab tabstop=4 shiftwidth=4:
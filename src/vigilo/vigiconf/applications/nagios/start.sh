@@ -8,4 +8,25 @@ if [ ! -f "$confdir/nagios/nagios.cfg" ]; then
     echo "No Nagios configuration file, not starting Nagios"
     exit 0
 fi
-sudo service '%%(nagios_svc)s' start
+sudo service '%%(nagios_svc)s' start || exit $?
+
+# Planification de la première vérification des services actifs,
+# réparties sur leur intervalle (option "spread_checks").
+schedule="$confdir/nagios/schedule"
+[ -f "$schedule" ] || exit 0
+cmdfile=`sed -n -e 's/^command_file=//p' '%%(nagios_cfg)s' | tail -n 1`
+[ -n "$cmdfile" ] || exit 0
+for i in `seq 30`; do
+    [ -p "$cmdfile" ] && break
+    sleep 1
+done
+if [ ! -w "$cmdfile" ]; then
+    echo "Cannot write to $cmdfile, checks will not be spread"
+    exit 0
+fi
+# srand() renvoie la graine précédente : l'heure courante au 2nd appel.
+now=`awk 'BEGIN { srand(); print srand() }'`
+awk -F';' -v now="$now" 'NF == 3 {
+    print "[" now "] SCHEDULE_SVC_CHECK;" $1 ";" $2 ";" (now + $3)
+}' "$schedule" > "$cmdfile"
+exit 0
@@ -0,0 +1 @@
+%(name)s;%(serviceName)s;%(offset)d
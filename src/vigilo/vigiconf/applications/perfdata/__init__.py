@@ -19,6 +19,7 @@ class PerfData(Application):
     start_command = None
     stop_command = None
     generator = generator.PerfDataGen
+    defaults = {"bundle_shards": 0}
     group = "collect"
 
 
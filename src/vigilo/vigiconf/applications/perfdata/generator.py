@@ -4,25 +4,52 @@
 
 """Generator for PerfData handler"""
 
-import os
+import os.path
 
 from vigilo.vigiconf import conf
-from vigilo.vigiconf.lib.generators import FileGenerator
+from vigilo.vigiconf.lib.generators import BundleGenerator
+from vigilo.vigiconf.lib.cdb import CDBWriter
 
-class PerfDataGen(FileGenerator):
-    """Generator for PerfData handler"""
+class PerfDataGen(BundleGenerator):
+    """
+    Generator for PerfData handler
+
+    En plus des modules Perl, une table de correspondance au format CDB
+    (C{perfdata/perfdata.cdb}) est produite pour chaque serveur Vigilo.
+    Ses clés sont de la forme C{"hôte\\0service\\0variable"} et ses
+    valeurs de la forme C{"hôte\\0source de données\\0reRouteFor"}, le
+    dernier champ étant vide en l'absence de redirection.
+    """
+
+    LOOKUP_MAP = "perfdata.cdb"
+
+    def generate(self):
+        # pylint: disable-msg=W0201
+        self._lookup = {}
+        super(PerfDataGen, self).generate()
+        self._write_lookup()
+
+    def _write_lookup(self):
+        """Écrit la table de correspondance de chaque serveur Vigilo"""
+        for vserver, entries in self._lookup.iteritems():
+            writer = CDBWriter(os.path.join(self.baseDir, vserver,
+                               self.application.name, self.LOOKUP_MAP))
+            for key, value in sorted(entries):
+                writer.add(key, value)
+            writer.close()
+            self.results["files"] += 1
 
     def generate_host(self, hostname, vserver):
         h = conf.hostsConf[hostname]
         if not h.has_key("PDHandlers") or len(h['PDHandlers']) == 0:
             return
-        fileName = os.path.join(self.baseDir, vserver, "perfdata",
-                                "perf-%s.pm" % hostname)
-        newhash = h.copy()
-        newhash['confid'] = conf.confid
-        self.templateCreate(fileName, self.templates["header"], newhash)
+        fileName = self.hostFile(hostname, vserver, "perf-%s.pm" % hostname)
+        header = self.templates["header"]
+        self.hostCreate(fileName, hostname, header,
+                        header.context(h, confid=conf.confid))
+        lookup = self._lookup.setdefault(vserver, [])
         for (servicename, perfitems) in h['PDHandlers'].iteritems():
-            servicename = self.quote(servicename.strip())
+            servicename = servicename.strip()
             for perfitem in perfitems:
                 if perfitem['reRouteFor'] is not None:
                     forHost = perfitem['reRouteFor']['host']
@@ -30,16 +57,20 @@ class PerfDataGen(FileGenerator):
                 else:
                     forHost = hostname
                     reRouteFor = "undef"
-                rrdname = self.quote(perfitem["name"].strip())
-                pdvn = self.quote(perfitem['perfDataVarName'].strip())
-                tplvars = {'service': servicename,
+                rrdname = perfitem["name"].strip()
+                pdvn = perfitem['perfDataVarName'].strip()
+                tplvars = {'service': self.quote(servicename),
                            'host': forHost,
-                           'ds': rrdname,
-                           'perfDataVarName': pdvn,
+                           'ds': self.quote(rrdname),
+                           'perfDataVarName': self.quote(pdvn),
                            'reRouteFor': reRouteFor}
                 self.templateAppend(fileName, self.templates["map"], tplvars)
-        self.templateAppend(fileName, self.COMMON_PERL_LIB_FOOTER, {})
-        self.templateClose(fileName)
+                lookup.append((
+                    u"\0".join((hostname, servicename, pdvn)),
+                    u"\0".join((forHost, rrdname,
+                                perfitem['reRouteFor'] and forHost or u"")),
+                ))
+        self.hostClose(fileName, hostname)
 
 
 # vim:set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,7 @@
+# confid:%(confid)s
+
+use strict;
+use warnings;
+package perf;
+our %%hosts = ();
+
@@ -0,0 +1,2 @@
+$hosts{'%(name)s'} = {%%host};
+}
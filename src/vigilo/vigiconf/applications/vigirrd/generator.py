@@ -6,24 +6,87 @@
 
 from __future__ import absolute_import
 
-import os
-import stat
-import sqlite3
-
 from vigilo.common.gettext import translate
 _ = translate(__name__)
 
 from vigilo.vigiconf import conf
-from vigilo.vigiconf.lib.generators import Generator
-
-class VigiRRDGen(Generator):
+from vigilo.vigiconf.lib.generators.sqlitedb import SQLiteGenerator
+
+
+SCHEMA = [
+    # host
+    """CREATE TABLE host (
+           idhost INTEGER NOT NULL,
+           name VARCHAR(255) NOT NULL,
+           grid VARCHAR(64) NOT NULL,
+           height INTEGER NOT NULL,
+           width INTEGER NOT NULL,
+           step INTEGER NOT NULL,
+           PRIMARY KEY (idhost),
+            UNIQUE (name)
+       )""",
+    # perfdatasource
+    """CREATE TABLE perfdatasource (
+           idperfdatasource INTEGER NOT NULL,
+           name TEXT NOT NULL,
+           label TEXT,
+           factor FLOAT NOT NULL,
+           max FLOAT,
+           PRIMARY KEY (idperfdatasource)
+       )""",
+    # graph
+    """CREATE TABLE graph (
+           idgraph INTEGER NOT NULL,
+           idhost INTEGER,
+           name VARCHAR(255) NOT NULL,
+           template VARCHAR(255) NOT NULL,
+           vlabel VARCHAR(255) NOT NULL,
+           lastismax BOOLEAN,
+           min FLOAT,
+           max FLOAT,
+           PRIMARY KEY (idgraph),
+            FOREIGN KEY(idhost) REFERENCES host (idhost)
+       )""",
+    # liaison
+    """CREATE TABLE graphperfdatasource (
+           idperfdatasource INTEGER NOT NULL,
+           idgraph INTEGER NOT NULL,
+           `order` INTEGER NOT NULL,
+           PRIMARY KEY (idperfdatasource, idgraph),
+            FOREIGN KEY(idperfdatasource) REFERENCES perfdatasource (idperfdatasource) ON DELETE CASCADE ON UPDATE CASCADE,
+            FOREIGN KEY(idgraph) REFERENCES graph (idgraph) ON DELETE CASCADE ON UPDATE CASCADE
+       )""",
+    # CDEFs
+    """CREATE TABLE cdef (
+           idcdef INTEGER NOT NULL,
+           idgraph INTEGER NOT NULL,
+           name TEXT,
+           cdef TEXT,
+           PRIMARY KEY (idcdef),
+            FOREIGN KEY(idgraph) REFERENCES graph (idgraph) ON DELETE CASCADE ON UPDATE CASCADE,
+            UNIQUE (idgraph, name)
+       )""",
+]
+
+INDEXES = [
+    "CREATE INDEX ix_perfdatasource_name ON perfdatasource (name)",
+    "CREATE INDEX ix_host_name ON host (name)",
+    "CREATE INDEX ix_graph_name ON graph (name)",
+]
+
+
+class VigiRRDGen(SQLiteGenerator):
     """Generator for RRD graph generator"""
 
+    db_name = "vigirrd.db"
+    schema = SCHEMA
+    indexes = INDEXES
+
     def generate(self):
         # pylint: disable-msg=W0201
         self._all_ds_graph = set()
         self._all_ds_metro = set()
-        self.connections = {}
+        self.init_databases()
         super(VigiRRDGen, self).generate()
         self.validate_ds_list()
         self.finalize_databases()
@@ -32,17 +95,14 @@ class VigiRRDGen(Generator):
         h = conf.hostsConf[hostname]
         if len(h['graphItems']) == 0:
             return
-        db_path = os.path.join(self.baseDir, vserver, "vigirrd.db")
-        if vserver not in self.connections:
-            self.init_db(db_path, vserver)
-            os.chmod(db_path, # chmod 644
-                     stat.S_IRUSR | stat.S_IWUSR |
-                     stat.S_IRGRP | stat.S_IROTH )
-        cursor = self.connections[vserver]["cursor"]
-
-        idhost = self.db_add_host(cursor, hostname)
-        for graphname, graphdata in h["graphItems"].iteritems():
-            self.db_add_graph(cursor, idhost, graphname, graphdata, h["dataSources"])
+        signature = (h["graphItems"], h["dataSources"],
+                     self.config_digest)
+        if self.host_changed(vserver, hostname, signature):
+            db = self.get_database(vserver)
+            idhost = self.db_add_host(db, hostname)
+            for graphname, graphdata in h["graphItems"].iteritems():
+                self.db_add_graph(db, idhost, graphname, graphdata,
+                                  h["dataSources"])
 
         # list all ds for validation
         for graphvalues in h["graphItems"].values():
@@ -71,119 +131,54 @@ class VigiRRDGen(Generator):
         self.addWarning("VigiRRD", _("Some datasources are not on a graph: %s")
                     % ", ".join([ "%s/%s" % dsr for dsr in missing_ds_report]))
 
-    def init_db(self, db_path, vserver):
-        try:
-            os.makedirs(os.path.dirname(db_path))
-        except OSError:
-            pass
-        db = sqlite3.connect(db_path)
-        c = db.cursor()
-        self.connections[vserver] = {"db": db, "cursor": c}
-        # host
-        c.execute("""CREATE TABLE host (
-                         idhost INTEGER NOT NULL,
-                         name VARCHAR(255) NOT NULL,
-                         grid VARCHAR(64) NOT NULL,
-                         height INTEGER NOT NULL,
-                         width INTEGER NOT NULL,
-                         step INTEGER NOT NULL,
-                         PRIMARY KEY (idhost),
-                          UNIQUE (name)
-                     )""")
-        # perfdatasource
-        c.execute("""CREATE TABLE perfdatasource (
-                         idperfdatasource INTEGER NOT NULL,
-                         name TEXT NOT NULL,
-                         label TEXT,
-                         factor FLOAT NOT NULL,
-                         max FLOAT,
-                         PRIMARY KEY (idperfdatasource)
-                     )""")
-        # graph
-        c.execute("""CREATE TABLE graph (
-                         idgraph INTEGER NOT NULL,
-                         idhost INTEGER,
-                         name VARCHAR(255) NOT NULL,
-                         template VARCHAR(255) NOT NULL,
-                         vlabel VARCHAR(255) NOT NULL,
-                         lastismax BOOLEAN,
-                         min FLOAT,
-                         max FLOAT,
-                         PRIMARY KEY (idgraph),
-                          FOREIGN KEY(idhost) REFERENCES host (idhost)
-                     )""")
-        # liaison
-        c.execute("""CREATE TABLE graphperfdatasource (
-                         idperfdatasource INTEGER NOT NULL,
-                         idgraph INTEGER NOT NULL,
-                         `order` INTEGER NOT NULL,
-                         PRIMARY KEY (idperfdatasource, idgraph),
-                          FOREIGN KEY(idperfdatasource) REFERENCES perfdatasource (idperfdatasource) ON DELETE CASCADE ON UPDATE CASCADE,
-                          FOREIGN KEY(idgraph) REFERENCES graph (idgraph) ON DELETE CASCADE ON UPDATE CASCADE
-                     )""")
-        # CDEFs
-        c.execute("""CREATE TABLE cdef (
-                         idcdef INTEGER NOT NULL,
-                         idgraph INTEGER NOT NULL,
-                         name TEXT,
-                         cdef TEXT,
-                         PRIMARY KEY (idcdef),
-                          FOREIGN KEY(idgraph) REFERENCES graph (idgraph) ON DELETE CASCADE ON UPDATE CASCADE,
-                          UNIQUE (idgraph, name)
-                     )""")
-
-    def db_add_host(self, cursor, hostname):
+    def delete_host(self, db, hostname):
+        graphs = ("SELECT idgraph FROM graph WHERE idhost IN "
+                  "(SELECT idhost FROM host WHERE name = ?)")
+        db.execute("DELETE FROM perfdatasource WHERE idperfdatasource IN "
+                   "(SELECT idperfdatasource FROM graphperfdatasource "
+                   "WHERE idgraph IN (%s))" % graphs, (hostname, ))
+        db.execute("DELETE FROM graphperfdatasource WHERE idgraph IN (%s)"
+                   % graphs, (hostname, ))
+        db.execute("DELETE FROM cdef WHERE idgraph IN (%s)" % graphs,
+                   (hostname, ))
+        db.execute("DELETE FROM graph WHERE idhost IN "
+                   "(SELECT idhost FROM host WHERE name = ?)", (hostname, ))
+        db.execute("DELETE FROM host WHERE name = ?", (hostname, ))
+
+    def db_add_host(self, db, hostname):
         config = self.application.getConfig()
-        cursor.execute("INSERT INTO host VALUES (NULL, ?, ?, ?, ?, ?)",
-                       (hostname, config["grid"], config["height"],
-                        config["width"], config["step"]))
-        return cursor.lastrowid
-
-    def db_add_graph(self, cursor, idhost, graphname, graphdata, dses):
-        cursor.execute("INSERT INTO graph VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)",
-                   (idhost, graphname, graphdata["template"],
-                    graphdata["vlabel"],
-                    graphdata.get("last_is_max", False),
-                    graphdata["min"], graphdata["max"]))
-        idgraph = cursor.lastrowid
+        idhost = db.next_id("host")
+        db.insert("host", (idhost, hostname, config["grid"], config["height"],
+                           config["width"], config["step"]))
+        return idhost
+
+    def db_add_graph(self, db, idhost, graphname, graphdata, dses):
+        idgraph = db.next_id("graph")
+        db.insert("graph", (idgraph, idhost, graphname, graphdata["template"],
+                            graphdata["vlabel"],
+                            graphdata.get("last_is_max", False),
+                            graphdata["min"], graphdata["max"]))
 
         for index, dsname in enumerate(graphdata["ds"]):
             factor = graphdata["factors"].get(dsname, 1)
-            self.db_add_pds(cursor, idgraph, dsname, factor, index, dses)
+            self.db_add_pds(db, idgraph, dsname, factor, index, dses)
 
         for cdef in graphdata["cdefs"]:
-            self.db_add_cdef(cursor, idgraph, cdef)
+            self.db_add_cdef(db, idgraph, cdef)
 
         return idgraph
 
-    def db_add_pds(self, cursor, idgraph, name, factor, index, dses): # pylint: disable-msg=R0201
-        cursor.execute("INSERT INTO perfdatasource(name, factor, label, max) "
-                       "VALUES (?, ?, ?, ?)",
-                       (name, factor, dses[name]['label'], dses[name]['max']))
-        idpds = cursor.lastrowid
-        cursor.execute("INSERT INTO graphperfdatasource "
-                       "VALUES (?, ?, ?)", (idpds, idgraph, index))
+    def db_add_pds(self, db, idgraph, name, factor, index, dses): # pylint: disable-msg=R0201
+        idpds = db.next_id("perfdatasource")
+        db.insert("perfdatasource", (idpds, name, dses[name]['label'],
+                                     factor, dses[name]['max']))
+        db.insert("graphperfdatasource", (idpds, idgraph, index))
         return idpds
 
-    def db_add_cdef(self, cursor, idgraph, cdef): # pylint: disable-msg=R0201
-        cursor.execute("INSERT INTO cdef (idgraph, name, cdef) "
-                       "VALUES (?, ?, ?)",
-                       (idgraph, cdef["name"], cdef["cdef"]))
-        return cursor.lastrowid
-
-    def finalize_databases(self):
-        for vserver in self.connections:
-            db = self.connections[vserver]["db"]
-            cursor = self.connections[vserver]["cursor"]
-            cursor.execute("CREATE INDEX ix_perfdatasource_name "
-                           "ON perfdatasource (name)")
-            cursor.execute("CREATE INDEX ix_host_name "
-                           "ON host (name)")
-            cursor.execute("CREATE INDEX ix_graph_name "
-                           "ON graph (name)")
-            db.commit()
-            cursor.close()
-            db.close()
+    def db_add_cdef(self, db, idgraph, cdef): # pylint: disable-msg=R0201
+        idcdef = db.next_id("cdef")
+        db.insert("cdef", (idcdef, idgraph, cdef["name"], cdef["cdef"]))
+        return idcdef
 
 
 # vim:set expandtab tabstop=4 shiftwidth=4:
@@ -103,7 +103,8 @@ def deploy(user, args):
     if args.revision:
         dispatchator.deploy_revision = args.revision
     dispatchator.force = tuple(flatten(args.force))
-    dispatchator.run(stop_after=args.stop_after, with_dbonly=args.dbonly)
+    dispatchator.run(stop_after=args.stop_after, with_dbonly=args.dbonly,
+                     resume=args.resume)
 
 def apps(user, args):
     dispatchator = get_dispatchator(user, args)
@@ -181,6 +182,44 @@ def server(user, args):
     dispatchator.server_status(args.server, args.status, args.no_deploy)
 
 
+def capacity(user, args):
+    from vigilo.vigiconf.lib.application import ApplicationManager
+    from vigilo.vigiconf.lib.capacity import CapacityReport
+    from vigilo.vigiconf.lib.ventilation import get_ventilator, \
+                                                VentilationIndex
+    conf.load_general_conf(['general'])
+    conf.load_xml_conf()
+    apps_mgr = ApplicationManager()
+    apps_mgr.list()
+    ventilator = get_ventilator(apps_mgr.applications)
+    report = CapacityReport(VentilationIndex(ventilator.ventilate()))
+    report.compute()
+    if args.server:
+        report.loads = dict((s, l) for s, l in report.loads.iteritems()
+                            if s in args.server)
+    encoding = sys.getfilesystemencoding() or "ISO-8859-1"
+    encoding = encoding.lower()
+    for line in report.format():
+        print(line.encode(encoding))
+    errors = False
+    for level, server, appname, metric, value, limit in report.check():
+        msg = _("%(server)s: estimated %(metric)s for %(app)s: "
+                "%(value)d (limit: %(limit)d)") % {
+                    "server": server,
+                    "metric": metric,
+                    "app": appname,
+                    "value": value,
+                    "limit": limit,
+                }
+        if level == "error":
+            errors = True
+            LOGGER.error(msg)
+        else:
+            LOGGER.warning(msg)
+    if errors:
+        sys.exit(1)
+
+
 def get_config(user, args):
     conf.load_general_conf(['general'])
     # @FIXME: Ce serait mieux de ne pas dupliquer du code de conf.py
@@ -192,6 +231,7 @@ def get_config(user, args):
         'confid',
         'appsGroupsByServer',
         'appsGroupsBackup',
+        'capacityLimits',
     )
     dumpable_conf = {}
     for key in conf_keys:
@@ -307,6 +347,10 @@ def parse_args(): # pragma: no cover
                         choices=stop_after_choices, metavar=N_("OPERATION"),
                         help=N_("Stop after the given OPERATION (one of '%s')")
                             % "', '".join(stop_after_choices))
+    parser_deploy.add_argument("--resume", action="store_true",
+                        help=N_("Resume the previous deployment from its "
+                                "first unfinished step, reusing the "
+                                "generated files when possible."))
     parser_deploy.add_argument("--revision", type=int,
                         help=N_("Deploy the given revision"))
     force_choices = ['deploy', 'db-sync']
@@ -366,6 +410,18 @@ def parse_args(): # pragma: no cover
     parser_server.add_argument("server", nargs="+",
                                help=N_("Server name(s) to enable/disable"))
 
+    # capacity
+    parser_capacity = subparsers.add_parser('capacity',
+                        add_help=False,
+                        parents=[common_args_parser],
+                        help=N_("Estimates the load of each Vigilo server "
+                                "and checks it against the configured "
+                                "limits."))
+    parser_capacity.set_defaults(func=capacity)
+    parser_capacity.add_argument('server', nargs='*',
+                        help=N_("Vigilo servers to report on, all of them "
+                                "if not specified."))
+
     # get-config
     parser_config = subparsers.add_parser('get-config',
                         add_help=False,
@@ -69,6 +69,7 @@ def load_general_conf(subdirs=None):
         'confid': '',
         'appsGroupsByServer': {},
         'appsGroupsBackup': {},
+        'capacityLimits': {},
     }
     conf_keys = conf.keys()
 
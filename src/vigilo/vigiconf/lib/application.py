@@ -14,7 +14,6 @@ from __future__ import absolute_import
 
 import os
 import sys
-from time import sleep
 from collections import deque
 from threading import Thread, current_thread
 # Warning, the "threading" module overwrites the built-in function enumerate()
@@ -34,6 +33,9 @@ from vigilo.vigiconf import conf
 from vigilo.vigiconf.lib.systemcommand import SystemCommand, SystemCommandError
 from vigilo.vigiconf.lib.exceptions import VigiConfError, DispatchatorError
 from vigilo.vigiconf.lib.server.factory import ServerFactory
+from vigilo.vigiconf.lib.scheduler import ActionScheduler
+from vigilo.vigiconf.lib.manifest import Manifest
+from vigilo.vigiconf.lib.validationcache import ValidationCache
 
 class ApplicationError(VigiConfError):
     """Exception concerning an application"""
@@ -163,6 +165,20 @@ class Application(object):
             config.update(conf.apps_conf[self.name])
         return config
 
+    def get_timeout(self):
+        """
+        @return: Délai maximum (en secondes) accordé à une action de
+            l'application sur un serveur, ou C{None} s'il n'y a pas de
+            limite (option C{timeout} de la configuration de l'application).
+        @rtype: C{float}
+        """
+        timeout = self.getConfig().get("timeout", None)
+        if timeout is not None and \
+           isinstance(timeout, (int, long, float)) and \
+           timeout > 0:
+            return float(timeout)
+        return None
+
     def generate(self, ventilation):
         """
         Lance la génération de l'application
@@ -410,9 +426,48 @@ class Application(object):
             return
         files_dir = os.path.join(settings["vigiconf"].get("libdir"),
                                  "deploy", servername)
+        simulate = settings["vigiconf"].as_bool("simulate")
+        cache_key = None
+        if ValidationCache.enabled() and not simulate:
+            cache_key = self._validation_cache_key(servername)
+        if cache_key is None:
+            self._validate(servername, files_dir, simulate)
+            return
+        cache = ValidationCache()
+        # une même configuration n'est validée que par un seul thread
+        with cache.lock(cache_key):
+            if cache.has(cache_key):
+                LOGGER.info(_("%(app)s : Validation successful for server: "
+                              "%(server)s (cached)"),
+                            {'app': self.name, 'server': servername})
+                return
+            self._validate(servername, files_dir, simulate)
+            cache.add(cache_key, "%s %s" % (self.name, servername))
+
+    def _validation_cache_key(self, servername):
+        """
+        @return: clé de la validation de la configuration générée pour le
+            serveur dans le cache L{ValidationCache}, ou C{None} si elle ne
+            peut être calculée. Elle tient compte des fichiers de
+            l'application et de ceux qui ne relèvent d'aucune application
+            (bases SQLite à la racine de l'arborescence, que certains
+            scripts de validation vérifient).
+        @rtype: C{str}
+        """
+        manifest = Manifest.load(Manifest.generated_path(servername))
+        if manifest is None or self.name not in manifest.apps:
+            return None
+        script = resource_string(self.__module__, self.validation)
+        return ValidationCache.key(self.name, "%s:%s" % (
+                                        manifest.apps[self.name],
+                                        manifest.shared_hash),
+                                   script)
+
+    def _validate(self, servername, files_dir, simulate):
+        """Exécute la commande de validation locale."""
         _command = ["vigiconf-local", "validate-app", self.name, files_dir]
         _command = SystemCommand(_command)
-        _command.simulate = settings["vigiconf"].as_bool("simulate")
+        _command.simulate = simulate
         try:
             _command.execute()
         except SystemCommandError as e:
@@ -546,15 +601,7 @@ class ActionResult(object):
         """
         self.application = application
         self.action = action
-        self.timeout = self.application.getConfig().get("timeout", None)
-
-        if self.timeout is not None and \
-           isinstance(self.timeout, (int, long, float)) and \
-           self.timeout > 0:
-
-            self.timeout = float(self.timeout)
-        else:
-            self.timeout = None
+        self.timeout = self.application.get_timeout()
         for thread in self.application.threads:
             thread.start()
 
@@ -622,12 +669,17 @@ class ApplicationManager(object):
                     l'application ne doit pas dépasser un certain temps
                     d'exécution.
     @type attempts: C{int}
-    @ivar interval: Spécifie le temps à attendre entre chaque tentative
-                    lorsque le temps d'exécution est dépassé.
+    @ivar interval: Spécifie le temps maximum à attendre entre deux
+                    tentatives lorsque le temps d'exécution est dépassé.
     @type interval: C{int}
+    @ivar retry_delay: Temps à attendre avant la première nouvelle
+                       tentative, doublé à chaque tentative suivante
+                       (sans dépasser L{interval}).
+    @type retry_delay: C{int}
     """
     attempts = 3
     interval = 60
+    retry_delay = 5
 
 
     def __init__(self):
@@ -677,6 +729,8 @@ class ApplicationManager(object):
         for result in results:
             result_status = result.get()
             valid = valid and result_status
+        if ValidationCache.enabled():
+            ValidationCache().prune()
         if not valid:
             raise DispatchatorError(_("validation failed, see above for "
                                       "more information."))
@@ -698,73 +752,86 @@ class ApplicationManager(object):
                                       "more information."))
         LOGGER.info(_("Qualification successful"))
 
-    def execute(self, action, servers):
+    def server_steps(self, action, servername, only=None):
+        """
+        Commandes C{vigiconf-local} correspondant à une action des
+        applications sur un serveur, pour un lot de commandes (voir
+        L{Server.run_steps<server.base.Server.run_steps>}). Les applications
+        sont traitées par ordre de priorité décroissante.
+        @param action: C{qualify}, C{stop} ou C{start}
+        @type  action: C{str}
+        @param servername: nom du serveur concerné.
+        @type  servername: C{str}
+        @param only: noms des applications concernées (par défaut : toutes).
+        @type  only: C{set}
+        @rtype: C{list} de C{list}
+        """
+        commands = {"qualify": "validate-app",
+                    "stop": "stop-app",
+                    "start": "start-app"}
+        steps = []
+        for app in self.applications:
+            if servername not in app.servers:
+                continue
+            if only is not None and app.name not in only:
+                continue
+            if action == "qualify":
+                if not app.validation:
+                    continue
+            elif action not in app.actions[servername] or \
+                    not getattr(app, "%s_command" % action):
+                continue
+            steps.append([commands[action], app.name])
+        return steps
+
+    def execute(self, action, servers, only=None):
         """
         Arrête ou démarre les applications sur les serveurs spécifiés.
+
+        Sur chaque serveur, les applications sont traitées par ordre de
+        priorité décroissante, mais les serveurs sont traités indépendamment
+        les uns des autres (voir L{ActionScheduler}). Le nombre d'actions
+        simultanées est limité par l'option C{app_concurrency}.
+
         @param action: C{start} ou C{stop}
         @type  action: C{str}
         @param servers: Liste des noms de serveurs sur lesquels exécuter
             l'action.
         @type  servers: C{list} de C{str}
+        @param only: applications concernées sur certains serveurs (voir
+            L{ActionScheduler.build}()).
+        @type  only: C{dict}
         """
         if not self.applications:
             return
-        status = True
-        results = []
         if isinstance(self.attempts, int) and \
            self.attempts > 0:
             attempts = self.attempts
         else:
             attempts = 1
-        priorities = {}
-        # construction d'un dictionnaire de priorité d'application
-        # dict = {1: [app1, app2],
-        #         2: [app3, app4]}
-        for app in self.applications:
-            p = app.priority
-            if p in priorities:
-                priorities[p].append(app)
-            else:
-                priorities[p] = [app]
-        # lancement des action/application pour chaque priorité
-        for priority in sorted(priorities, reverse=True):
-            apps = priorities[priority]
-            for app in apps:
-                results.append(app.execute(action, servers, async=True))
-            test = 0
-            timedout = []
-            while test < attempts :
-                test += 1
-                if timedout:
-                    # attente d'un interval de temps avant nouvel essai
-                    msg = _("Next attempt for %(action)s action in %(interval)d"
-                            " second(s) (attempt #%(attempt)d)") % {
-                                  "action": action,
-                                  "interval": self.interval,
-                                  "attempt": test}
-                    LOGGER.info(msg)
-                    sleep(self.interval)
-                    for e in timedout:
-                        timeout_app = e.application
-                        timeout_act = e.action
-                        timeout_servers = e.servers
-                        # relance des exécutions précédemment en time out
-                        results.append(
-                            timeout_app.execute(timeout_act, timeout_servers,
-                                                           async=True))
-                timedout = []
-                for result in results:
-                    try:
-                        status = status and result.get()
-                    except ApplicationTimeOutError as e:
-                        LOGGER.info(get_error_message(e))
-                        status = status and e.status
-                        timedout.append(e)
-                results = []
-            if timedout:
-                for e in timedout:
-                    LOGGER.error(get_error_message(e))
-                sys.exit(2)
+        try:
+            concurrency = settings["vigiconf"].as_int("app_concurrency")
+        except KeyError:
+            concurrency = 0
+        scheduler = ActionScheduler(concurrency, attempts, self.retry_delay,
+                                    self.interval)
+        tasks = ActionScheduler.build(self.applications, action, servers,
+                                      only)
+        status = scheduler.run(tasks)
+
+        # regroupement des serveurs en time out par application
+        timedout = {}
+        for task in tasks:
+            if task.timedout:
+                timedout.setdefault(task.application, []).append(task.server)
+        if timedout:
+            for app in self.applications:
+                if app not in timedout:
+                    continue
+                e = ApplicationTimeOutError(status, app, action,
+                                            timedout[app])
+                LOGGER.error(get_error_message(e))
+            sys.exit(2)
 
         return status
 # vim:set expandtab tabstop=4 shiftwidth=4:
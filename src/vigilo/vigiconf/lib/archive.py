@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Création des archives de déploiement.
+
+Les archives sont produites au fil de l'eau dans n'importe quel objet
+fichier (fichier sur disque, tube vers la commande de transfert, etc.),
+éventuellement compressées. Leur contenu est reproductible : les fichiers
+y sont rangés dans l'ordre alphabétique et leur date de modification est
+fixée à L{ARCHIVE_MTIME}.
+"""
+
+from __future__ import absolute_import
+
+import os
+import bz2
+import gzip
+import tarfile
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from vigilo.vigiconf.lib import VigiConfError
+
+__all__ = ("write_archive", "get_compression", "COMPRESSIONS")
+
+
+# Date de modification des fichiers archivés (1er janvier 2000).
+ARCHIVE_MTIME = 946684800
+
+# Compressions disponibles, et leurs synonymes
+COMPRESSIONS = {
+    "": "",
+    "none": "",
+    "gz": "gz",
+    "gzip": "gz",
+    "bz2": "bz2",
+    "bzip2": "bz2",
+}
+
+
+class ArchiveError(VigiConfError):
+    """Erreur lors de la création d'une archive"""
+    pass
+
+
+class _BZ2Writer(object):
+    """Compression bzip2 au fil de l'eau vers un objet fichier."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.compressor = bz2.BZ2Compressor()
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+def get_compression(name):
+    """
+    @param name: nom de la compression (C{gz}, C{bz2}, ou une chaîne vide).
+    @type  name: C{str}
+    @return: nom normalisé de la compression.
+    @rtype: C{str}
+    @raise ArchiveError: compression inconnue.
+    """
+    try:
+        return COMPRESSIONS[(name or "").strip().lower()]
+    except KeyError:
+        raise ArchiveError(_("Unsupported archive compression: %s") % name)
+
+def _members(root, files):
+    """
+    @return: chemins relatifs des éléments à archiver, dans l'ordre.
+    @rtype: C{list}
+    """
+    if files is not None:
+        return sorted([ isinstance(f, unicode) and f.encode("utf-8") or f
+                        for f in files ])
+    members = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        relpath = os.path.relpath(dirpath, root)
+        if relpath != os.curdir:
+            members.append(relpath)
+        for filename in sorted(filenames):
+            members.append(os.path.normpath(os.path.join(relpath, filename)))
+    return members
+
+def write_archive(fileobj, root, files=None, compression=""):
+    """
+    Écrit une archive tar au fil de l'eau.
+    @param fileobj: destination de l'archive (seule la méthode C{write}
+        est utilisée, elle n'est pas fermée).
+    @type  fileobj: objet fichier
+    @param root: dossier à archiver.
+    @type  root: C{str}
+    @param files: chemins (relatifs à C{root}) des fichiers à archiver,
+        l'ensemble du dossier par défaut.
+    @type  files: C{list}
+    @param compression: compression à appliquer (voir L{COMPRESSIONS}).
+    @type  compression: C{str}
+    @return: nombre d'éléments archivés.
+    @rtype: C{int}
+    """
+    compression = get_compression(compression)
+    compressor = None
+    if compression == "gz":
+        compressor = gzip.GzipFile(filename="", mode="wb", fileobj=fileobj,
+                                   mtime=ARCHIVE_MTIME)
+    elif compression == "bz2":
+        compressor = _BZ2Writer(fileobj)
+    tar = tarfile.open(mode="w|", fileobj=compressor or fileobj,
+                       format=tarfile.GNU_FORMAT)
+    members = _members(root, files)
+    try:
+        for member in members:
+            path = os.path.join(root, member)
+            info = tar.gettarinfo(path, member)
+            info.mtime = ARCHIVE_MTIME
+            if info.isreg():
+                content = open(path, "rb")
+                try:
+                    tar.addfile(info, content)
+                finally:
+                    content.close()
+            else:
+                tar.addfile(info)
+    finally:
+        tar.close()
+        if compressor is not None:
+            compressor.close()
+    return len(members)
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Estimation de la charge de chaque serveur Vigilo à partir de la ventilation.
+
+Pour chaque serveur et chaque application, le rapport dénombre les hôtes,
+les services actifs et passifs, les requêtes SNMP du Collector (et le
+nombre de PDU SNMP émises à chaque cycle, d'après C{snmpOIDsPerPDU}), les
+sources de données de métrologie et l'espace disque occupé par les bases
+RRD correspondantes (d'après les définitions de RRA de connector-metro).
+
+Des seuils peuvent être définis dans le dictionnaire C{capacityLimits} du
+dossier C{conf.d/general}::
+
+    capacityLimits = {
+        # Seuils appliqués à tous les serveurs
+        "default": {
+            "nagios": {"active_services": (20000, 40000)},
+            "connector-metro": {"rrd_bytes": (50 * 2**30, 100 * 2**30)},
+        },
+        # Seuils propres à un serveur
+        "sup1.example.com": {
+            "nagios": {"active_services": (5000, 10000)},
+        },
+    }
+
+Chaque seuil est un couple (avertissement, erreur), l'une ou l'autre des
+valeurs pouvant valoir C{None}.
+"""
+
+from __future__ import absolute_import
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from vigilo.vigiconf import conf
+
+__all__ = ("CapacityReport", "host_metrics", "snmp_requests", "rrd_size",
+           "oids_per_pdu", "DEFAULT_OIDS_PER_PDU")
+
+
+# Ordre d'affichage des métriques
+METRICS = (
+    "hosts",
+    "active_services",
+    "passive_services",
+    "snmp_jobs",
+    "snmp_pdus",
+    "datasources",
+    "rrd_bytes",
+)
+
+# Nombre d'OID par PDU SNMP lorsque C{snmpOIDsPerPDU} n'est pas défini
+# (même valeur par défaut que dans L{Host<confclasses.host.Host>}).
+DEFAULT_OIDS_PER_PDU = 10
+
+# Taille (en octets) de l'en-tête d'un fichier RRD contenant une seule
+# source de données, et de la description de chacune de ses RRA.
+RRD_HEADER_SIZE = 600
+RRA_HEADER_SIZE = 200
+# Taille d'une valeur stockée dans une RRA.
+RRD_VALUE_SIZE = 8
+
+
+def oids_per_pdu(host):
+    """
+    @param host: configuration de l'hôte (entrée de C{conf.hostsConf}).
+    @type  host: C{dict}
+    @return: nombre d'OID interrogés dans une même PDU SNMP GET.
+    @rtype: C{int}
+    """
+    value = host.get("snmpOIDsPerPDU")
+    if value is None:
+        value = DEFAULT_OIDS_PER_PDU
+    return max(int(value or 1), 1)
+
+def snmp_requests(host):
+    """
+    Recense les OID interrogés par le Collector pour un hôte.
+    @param host: configuration de l'hôte (entrée de C{conf.hostsConf}).
+    @type  host: C{dict}
+    @return: OID des requêtes GET et des parcours (WALK), sans doublons.
+    @rtype: C{tuple} de deux C{set}
+    """
+    gets = set()
+    walks = set()
+    for job in host.get("SNMPJobs", {}).itervalues():
+        for var in job.get("vars", ()):
+            if not isinstance(var, basestring):
+                continue
+            if var.startswith("GET/"):
+                gets.add(var[4:])
+            elif var.startswith("WALK/"):
+                walks.add(var[5:])
+    return (gets, walks)
+
+def rrd_size(rra_template):
+    """
+    Estime la taille d'un fichier RRD.
+    @param rra_template: modèle de RRA (voir la configuration de
+        connector-metro).
+    @type  rra_template: C{dict}
+    @rtype: C{int}
+    """
+    size = RRD_HEADER_SIZE
+    for rra in rra_template.get("rras", ()):
+        size += RRA_HEADER_SIZE + RRD_VALUE_SIZE * int(rra["rows"])
+    return size
+
+def host_metrics(host, metro_config=None):
+    """
+    Calcule la charge représentée par un hôte.
+    @param host: configuration de l'hôte (entrée de C{conf.hostsConf}).
+    @type  host: C{dict}
+    @param metro_config: configuration de connector-metro, utilisée pour
+        estimer la taille des bases RRD (ignorée si C{None}).
+    @type  metro_config: C{dict}
+    @return: valeur de chacune des métriques de L{METRICS}.
+    @rtype: C{dict}
+    """
+    metrics = dict.fromkeys(METRICS, 0)
+    metrics["hosts"] = 1
+    for definition in host.get("services", {}).itervalues():
+        if definition.get("type") == "active":
+            metrics["active_services"] += 1
+        else:
+            metrics["passive_services"] += 1
+    metrics["snmp_jobs"] = len(host.get("SNMPJobs", {}))
+    gets, walks = snmp_requests(host)
+    per_pdu = oids_per_pdu(host)
+    # Un parcours nécessite au moins une PDU, souvent davantage.
+    metrics["snmp_pdus"] = (len(gets) + per_pdu - 1) // per_pdu + len(walks)
+    datasources = host.get("dataSources", {})
+    metrics["datasources"] = len(datasources)
+    if metro_config is not None:
+        templates = metro_config.get("rra", {})
+        sizes = {}
+        for ds in datasources.itervalues():
+            name = ds.get("rra_template") or "basic"
+            if name not in sizes:
+                sizes[name] = rrd_size(templates.get(name,
+                                       templates.get("basic", {})))
+            metrics["rrd_bytes"] += sizes[name]
+    return metrics
+
+def format_size(size):
+    """Formate une taille en octets pour l'affichage."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f TiB" % size
+
+
+class CapacityReport(object):
+    """
+    Rapport de charge des serveurs Vigilo.
+
+    @ivar loads: charge estimée, sous la forme
+        {serveur: {nom de l'application: {métrique: valeur}}}.
+    @type loads: C{dict}
+    """
+
+    def __init__(self, ventilation, limits=None):
+        """
+        @param ventilation: index de la ventilation.
+        @type  ventilation: L{VentilationIndex
+            <vigilo.vigiconf.lib.ventilation.VentilationIndex>}
+        @param limits: seuils, C{conf.capacityLimits} par défaut.
+        @type  limits: C{dict}
+        """
+        self.ventilation = ventilation
+        if limits is None:
+            limits = getattr(conf, "capacityLimits", {})
+        self.limits = limits
+        self.loads = {}
+
+    def _metro_config(self):
+        app = self.ventilation.app("connector-metro")
+        if hasattr(app, "getConfig"):
+            return app.getConfig()
+        return None
+
+    def compute(self):
+        """
+        Agrège la charge des hôtes par serveur et par application.
+        @return: la charge estimée (voir L{loads}).
+        @rtype: C{dict}
+        """
+        metro_config = self._metro_config()
+        by_host = {}
+        self.loads = {}
+        for appname in self.ventilation.apps():
+            app = self.ventilation.app(appname)
+            generator = getattr(app, "generator", None)
+            # Les serveurs de secours reçoivent la configuration
+            # lorsque le générateur déploie sur tous les serveurs.
+            all_servers = not getattr(generator, "deploy_only_on_first", True)
+            for hostname, servers in self.ventilation.assignments(appname):
+                if hostname not in conf.hostsConf:
+                    continue
+                if hostname not in by_host:
+                    by_host[hostname] = host_metrics(conf.hostsConf[hostname],
+                                                     metro_config)
+                if not all_servers:
+                    servers = servers[:1]
+                for server in servers:
+                    load = self.loads.setdefault(server, {}).setdefault(
+                                appname, dict.fromkeys(METRICS, 0))
+                    for metric, value in by_host[hostname].iteritems():
+                        load[metric] += value
+        return self.loads
+
+    def get_limit(self, server, appname, metric):
+        """
+        @return: seuils (avertissement, erreur) applicables,
+            ou C{(None, None)}.
+        @rtype: C{tuple}
+        """
+        for key in (server, "default"):
+            limit = self.limits.get(key, {}).get(appname, {}).get(metric)
+            if limit is not None:
+                return tuple(limit)
+        return (None, None)
+
+    def check(self):
+        """
+        Compare la charge estimée aux seuils.
+        @return: dépassements, sous la forme de tuples
+            (niveau, serveur, application, métrique, valeur, seuil),
+            le niveau valant C{"warning"} ou C{"error"}.
+        @rtype: C{list}
+        """
+        overloads = []
+        for server in sorted(self.loads):
+            for appname in sorted(self.loads[server]):
+                load = self.loads[server][appname]
+                for metric in METRICS:
+                    warning, error = self.get_limit(server, appname, metric)
+                    if error is not None and load[metric] > error:
+                        overloads.append(("error", server, appname, metric,
+                                          load[metric], error))
+                    elif warning is not None and load[metric] > warning:
+                        overloads.append(("warning", server, appname, metric,
+                                          load[metric], warning))
+        return overloads
+
+    def format(self):
+        """
+        @return: le rapport sous forme textuelle, ligne par ligne.
+        @rtype: C{list} of C{unicode}
+        """
+        lines = []
+        for server in sorted(self.loads):
+            lines.append(_("Server %s:") % server)
+            for appname in sorted(self.loads[server]):
+                load = self.loads[server][appname]
+                lines.append(_(
+                    "    %(app)s: %(hosts)d hosts, %(active_services)d active "
+                    "services, %(passive_services)d passive services, "
+                    "%(snmp_jobs)d SNMP jobs (%(snmp_pdus)d PDUs per cycle), "
+                    "%(datasources)d datasources (%(rrd_size)s of RRD files)"
+                ) % dict(load, app=appname,
+                         rrd_size=format_size(load["rrd_bytes"])))
+        return lines
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
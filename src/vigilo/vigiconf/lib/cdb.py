@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Lecture et écriture de tables de correspondance au format CDB
+(U{http://cr.yp.to/cdb/cdb.txt}).
+
+Une table CDB est un fichier en lecture seule associant des clés à des
+valeurs. Une recherche ne nécessite que deux ou trois accès au fichier,
+quelle que soit sa taille, ce qui permet de l'utiliser directement
+(par exemple à l'aide de C{mmap}) sans le charger en mémoire. Le format est
+lu par de nombreuses bibliothèques, dont le module Perl C{CDB_File}.
+"""
+
+from __future__ import absolute_import
+
+import os
+import mmap
+import struct
+
+__all__ = ("CDBWriter", "CDBReader", "cdb_hash")
+
+
+HEADER_SIZE = 2048
+_PAIR = struct.Struct("<LL")
+
+
+def cdb_hash(key):
+    """
+    @return: empreinte d'une clé (fonction de hachage du format CDB).
+    @rtype: C{int}
+    """
+    h = 5381
+    for c in bytearray(key):
+        h = (((h << 5) + h) ^ c) & 0xffffffff
+    return h
+
+def _encode(s):
+    if isinstance(s, unicode):
+        return s.encode("utf-8")
+    return s
+
+
+class CDBWriter(object):
+    """
+    Écriture d'une table CDB.
+
+    Le fichier est écrit sous un nom temporaire puis renommé lors de
+    l'appel à L{close}() : les lecteurs ne voient jamais une table
+    incomplète.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._tmpname = "%s.tmp" % filename
+        self._file = open(self._tmpname, "wb")
+        self._file.write("\0" * HEADER_SIZE)
+        self._pos = HEADER_SIZE
+        self._tables = [ [] for _i in range(256) ]
+
+    def add(self, key, value):
+        """
+        Ajoute une entrée à la table.
+        @type key: C{str} ou C{unicode} (encodé en UTF-8)
+        @type value: C{str} ou C{unicode} (encodé en UTF-8)
+        """
+        key = _encode(key)
+        value = _encode(value)
+        self._file.write(_PAIR.pack(len(key), len(value)))
+        self._file.write(key)
+        self._file.write(value)
+        h = cdb_hash(key)
+        self._tables[h & 0xff].append((h, self._pos))
+        self._pos += _PAIR.size + len(key) + len(value)
+
+    def close(self):
+        """Écrit les tables de hachage et l'en-tête du fichier."""
+        header = []
+        for entries in self._tables:
+            nslots = len(entries) * 2
+            slots = [(0, 0)] * nslots
+            for h, pos in entries:
+                slot = (h >> 8) % nslots
+                while slots[slot][1]:
+                    slot = (slot + 1) % nslots
+                slots[slot] = (h, pos)
+            header.append(_PAIR.pack(self._pos, nslots))
+            for h, pos in slots:
+                self._file.write(_PAIR.pack(h, pos))
+            self._pos += _PAIR.size * nslots
+        self._file.seek(0)
+        self._file.write("".join(header))
+        self._file.close()
+        os.rename(self._tmpname, self.filename)
+
+
+class CDBReader(object):
+    """Lecture d'une table CDB, projetée en mémoire."""
+
+    def __init__(self, filename):
+        cdbfile = open(filename, "rb")
+        try:
+            self._map = mmap.mmap(cdbfile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            cdbfile.close()
+
+    def _pair(self, pos):
+        return _PAIR.unpack(self._map[pos:pos + _PAIR.size])
+
+    def getall(self, key):
+        """
+        @return: les valeurs associées à la clé, dans l'ordre d'ajout.
+        @rtype: C{list} of C{str}
+        """
+        key = _encode(key)
+        h = cdb_hash(key)
+        tablepos, nslots = self._pair((h & 0xff) * _PAIR.size)
+        values = []
+        if not nslots:
+            return values
+        slot = (h >> 8) % nslots
+        for _i in xrange(nslots):
+            slot_hash, pos = self._pair(tablepos + slot * _PAIR.size)
+            if not pos:
+                break
+            if slot_hash == h:
+                klen, vlen = self._pair(pos)
+                start = pos + _PAIR.size
+                if self._map[start:start + klen] == key:
+                    values.append(self._map[start + klen:
+                                            start + klen + vlen])
+            slot = (slot + 1) % nslots
+        return values
+
+    def get(self, key, default=None):
+        """
+        @return: la première valeur associée à la clé, ou C{default}.
+        @rtype: C{str}
+        """
+        values = self.getall(key)
+        if values:
+            return values[0]
+        return default
+
+    def close(self):
+        self._map.close()
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -11,6 +11,8 @@ from __future__ import absolute_import
 
 import transaction
 
+from vigilo.common.conf import settings
+
 from vigilo.common.logging import get_logger
 LOGGER = get_logger(__name__)
 
@@ -20,6 +22,9 @@ _ = translate(__name__)
 
 from vigilo.vigiconf.lib.generators import GenerationError
 from vigilo.vigiconf.lib.exceptions import DispatchatorError
+from vigilo.vigiconf.lib.server.base import Server
+from .pipeline import DeployPipeline
+from .checkpoint import Checkpoint
 
 
 class Dispatchator(object):
@@ -40,6 +45,9 @@ class Dispatchator(object):
     @type srv_mgr: L{ServerManager<server.manager.ServerManager>}
     @ivar gen_mgr: Gestionnaire du processus de génération
     @type gen_mgr: L{GeneratorManager<generators.manager.GeneratorManager>}
+    @ivar batch: Regroupement des commandes destinées à chaque serveur en
+        lots (voir L{Server.run_steps<server.base.Server.run_steps>}).
+    @type batch: C{bool}
     """
 
     def __init__(self, apps_mgr, rev_mgr, srv_mgr, gen_mgr):
@@ -48,6 +56,9 @@ class Dispatchator(object):
         self.rev_mgr = rev_mgr
         self.srv_mgr = srv_mgr
         self.gen_mgr = gen_mgr
+        self.batch = Server.use_batch()
+        # serveurs dont la révision reste à transmettre (mode batch)
+        self._pending_revision = []
 
     def get_force(self):
         return self._force
@@ -79,7 +90,7 @@ class Dispatchator(object):
     def servers_for_app(self, app):
         raise NotImplementedError()
 
-    def generate(self, nosyncdb=False):
+    def generate(self, nosyncdb=False, validate=True, reuse=None):
         """
         Génère la configuration des différents composants, en utilisant le
         L{GeneratorManager}.
@@ -87,16 +98,81 @@ class Dispatchator(object):
             base ne sera réalisée (utile pour redéployer rapidement dans un cas
             de perte d'un serveur Vigilo.
         @type  nosyncdb: C{bool}
+        @param validate: Valider la configuration générée.
+        @type  validate: C{bool}
+        @param reuse: Empreinte de la ventilation de la génération précédente,
+            dont les fichiers sont conservés si la ventilation est inchangée
+            (voir L{GeneratorManager.generate}).
+        @type  reuse: C{str}
+        @return: C{True} si les fichiers déjà générés ont été conservés.
+        @rtype:  C{bool}
         """
         try:
-            self.gen_mgr.generate(rev_mgr=self.rev_mgr, nosyncdb=nosyncdb)
+            reused = self.gen_mgr.generate(rev_mgr=self.rev_mgr,
+                                           nosyncdb=nosyncdb, reuse=reuse)
         except GenerationError:
             LOGGER.error(_("Generation failed!"))
             raise
         else:
             LOGGER.info(_("Generation successful"))
-        # Validation de la génération
-        self.apps_mgr.validate()
+        # Validation de la génération (les fichiers conservés ne sont
+        # enregistrés dans le point de reprise qu'une fois validés)
+        if validate and not reused:
+            self.apps_mgr.validate()
+        return reused
+
+    def generate_and_deploy(self, checkpoint=None):
+        """
+        Génère la configuration, et valide puis déploie celle de chaque
+        serveur dès qu'elle est prête (voir L{DeployPipeline}). Les serveurs
+        restants sont ensuite déployés, et la configuration est qualifiée
+        sur l'ensemble des serveurs.
+        @param checkpoint: Point de reprise sur lequel enregistrer la fin de
+            la génération, une fois la configuration de chaque serveur traité
+            validée.
+        @type  checkpoint: L{Checkpoint}
+        @return: Liste des serveurs déployés
+        @rtype:  C{list}
+        """
+        try:
+            concurrency = settings["vigiconf"].as_int("server_concurrency")
+        except KeyError:
+            concurrency = 0
+        pipeline = DeployPipeline(self.apps_mgr, self.srv_mgr, self.force,
+                                  concurrency)
+        self.gen_mgr.server_ready = pipeline.server_ready
+        try:
+            self.generate(validate=False)
+        finally:
+            self.gen_mgr.server_ready = None
+            # les déploiements en cours sont menés à terme dans tous les cas
+            pipeline.join()
+        remaining = [ s for s in self.srv_mgr.servers
+                      if s not in pipeline.processed ]
+        # La génération n'est considérée comme terminée (et la configuration
+        # réutilisable en cas de reprise) qu'une fois la configuration de
+        # tous les serveurs validée.
+        if not pipeline.invalid:
+            for app in self.apps_mgr.applications:
+                for servername in remaining:
+                    if servername in app.servers:
+                        app.validateServer(servername)
+            if checkpoint is not None:
+                checkpoint.complete_generation(
+                        self.gen_mgr.ventilation_fingerprint())
+        if pipeline.errors:
+            raise DispatchatorError(_("The configuration has not been "
+                    "deployed on the following servers: %s. See above for "
+                    "more information.") % ", ".join(sorted(pipeline.errors)))
+        deployed = list(pipeline.deployed)
+        if remaining:
+            deployed.extend(self.srv_mgr.deploy(remaining, self.force))
+        if deployed:
+            if self.batch:
+                self.qualify_batch()
+            else:
+                self.apps_mgr.qualify()
+        return deployed
 
     def prepareServers(self):
         """
@@ -114,9 +190,27 @@ class Dispatchator(object):
         """
         deployed = self.srv_mgr.deploy(force=self.force)
         if deployed:
-            self.apps_mgr.qualify()
+            if self.batch:
+                self.qualify_batch()
+            else:
+                self.apps_mgr.qualify()
         return deployed
 
+    def qualify_batch(self):
+        """
+        Valide la configuration des applications sur les serveurs distants,
+        avec un seul lot de commandes par serveur.
+        """
+        steps = {}
+        for app in self.apps_mgr.applications:
+            for servername in app.servers:
+                if servername not in steps:
+                    steps[servername] = self.apps_mgr.server_steps(
+                                            "qualify", servername)
+        self.srv_mgr.run_steps(steps, _("qualification failed. See above "
+                                        "for more information."))
+        LOGGER.info(_("Qualification successful"))
+
     def commit(self, servers): # pylint: disable-msg=R0201
         """
         Enregistre la configuration en base de données
@@ -130,8 +224,19 @@ class Dispatchator(object):
             transaction.abort()
             LOGGER.debug("Transaction rollbacked: %s", e)
             raise DispatchatorError(_("Database commit failed"))
-        # Envoi de la révision sur les serveurs
-        self.srv_mgr.set_revision(self.rev_mgr.deploy_revision, servers)
+        # La révision est également affectée aux serveurs dont la
+        # configuration est inchangée (option skip_unchanged).
+        unchanged = self.srv_mgr.unchanged_servers()
+        if unchanged:
+            LOGGER.info(_("Configuration unchanged on: %s"),
+                        ", ".join(unchanged))
+            servers = list(servers or []) + unchanged
+        # Envoi de la révision sur les serveurs (en mode batch, elle est
+        # transmise avec les commandes de redémarrage)
+        self.srv_mgr.set_revision(self.rev_mgr.deploy_revision, servers,
+                                  remote=not self.batch)
+        if self.batch:
+            self._pending_revision = list(servers or [])
 
     def restart(self):
         """
@@ -139,14 +244,60 @@ class Dispatchator(object):
         """
         servers = self.srv_mgr.filter_servers("needsRestart",
                                               force=self.force)
+        if self.batch:
+            return self.restart_batch(servers)
         if not servers:
             LOGGER.info(_("All servers are up-to-date. No restart needed."))
             return
         for server in servers:
             LOGGER.debug("Server %s should be restarted.", server)
-        self.apps_mgr.execute("stop", servers)
+        only = self._changed_apps(servers)
+        self.apps_mgr.execute("stop", servers, only)
         self.srv_mgr.switch_directories(servers)
-        self.apps_mgr.execute("start", servers)
+        self.apps_mgr.execute("start", servers, only)
+
+    def _changed_apps(self, servers):
+        """
+        @return: applications à redémarrer sur chaque serveur dont les
+            changements sont connus (voir L{ServerManager.changed_apps
+            <server.manager.ServerManager.changed_apps>}()).
+        @rtype: C{dict}
+        """
+        only = self.srv_mgr.changed_apps(servers,
+                    [ app.name for app in self.apps_mgr.applications ])
+        for servername in sorted(only):
+            LOGGER.info(_("Restarting on %(server)s: %(apps)s"), {
+                "server": servername,
+                "apps": ", ".join(sorted(only[servername])) or _("none"),
+            })
+        return only
+
+    def restart_batch(self, servers):
+        """
+        Transmet la révision et redémarre les applications avec un seul lot
+        de commandes par serveur : C{set-revision}, arrêt des applications,
+        C{activate-conf} puis démarrage des applications.
+        @param servers: Noms des serveurs à redémarrer.
+        @type  servers: C{list} de C{str}
+        """
+        steps = {}
+        for servername in self._pending_revision:
+            steps[servername] = [["set-revision",
+                                  str(self.rev_mgr.deploy_revision)]]
+        only = self._changed_apps(servers)
+        for servername in servers:
+            LOGGER.debug("Server %s should be restarted.", servername)
+            apps = only.get(servername)
+            steps.setdefault(servername, []).extend(
+                    self.apps_mgr.server_steps("stop", servername, apps) +
+                    [["activate-conf"]] +
+                    self.apps_mgr.server_steps("start", servername, apps))
+        self._pending_revision = []
+        if not servers:
+            LOGGER.info(_("All servers are up-to-date. No restart needed."))
+        self.srv_mgr.run_steps(steps, _("The restart was not successful on "
+                                        "each server. See above for more "
+                                        "information."))
 
     def getState(self):
         """
@@ -156,9 +307,18 @@ class Dispatchator(object):
         state = []
         _revision = self.rev_mgr.last_revision()
         state.append(_("Current revision in the repository : %d") % _revision)
-        for servername, server in self.srv_mgr.servers.items():
+        # interrogation des serveurs en parallèle
+        polled = self.srv_mgr.poll_revisions()
+        for servername, server in sorted(self.srv_mgr.servers.items()):
+            if not polled[servername].success:
+                state.append(_("Server %(server)s:\n    unknown state "
+                               "(%(reason)s)") % {
+                                    "server": servername,
+                                    "reason": polled[servername].error,
+                               })
+                continue
             try:
-                state.append(server.get_state_text(_revision))
+                state.append(server.get_state_text(_revision, update=False))
             except Exception as e: # pylint: disable-msg=W0703
                 try:
                     error_msg = unicode(e)
@@ -173,28 +333,84 @@ class Dispatchator(object):
     def server_status(self, servernames, status, no_deploy=False):
         raise NotImplementedError()
 
-    def _run(self, stop_after):
+    def load_checkpoint(self):
+        """
+        Charge et vérifie le point de reprise du déploiement précédent.
+        @return: Le point de reprise, ou C{None} s'il n'existe pas ou ne
+            permet pas la reprise (le déploiement est alors complet).
+        @rtype:  L{Checkpoint}
+        """
+        checkpoint = Checkpoint.load()
+        if checkpoint is None:
+            LOGGER.warning(_("No checkpoint to resume from, the whole "
+                             "deployment will be performed"))
+            return None
+        reason = checkpoint.check(self.rev_mgr.deploy_revision)
+        if reason is not None:
+            LOGGER.warning(_("Cannot resume the deployment (%s), the whole "
+                             "deployment will be performed"), reason)
+            return None
+        LOGGER.info(_("Resuming the deployment of revision %(revision)s "
+                      "at the %(phase)s step"), {
+                        "revision": checkpoint.revision,
+                        "phase": checkpoint.next_phase,
+                    })
+        return checkpoint
+
+    def _run(self, stop_after, resume=False):
         """
         Effectue le déploiement.
 
         @param stop_after: Étape après laquelle il faut s'arrêter.
             Valeurs possibles : C{generation}, C{push} ou C{None}.
         @type  stop_after: C{str}
+        @param resume: Reprendre le déploiement précédent à partir de la
+            première étape inachevée (voir L{Checkpoint}).
+        @type  resume: C{bool}
         """
         # On le fait au début pour gérer le cas où un serveur serait
         # indisponible (#867)
         self.prepareServers()
         self.rev_mgr.prepare()
-        self.generate()
-        if stop_after == "generation":
-            return
-        deployed = self.deploy()
-        if stop_after == "push":
-            return
-        self.commit(deployed)
+        checkpoint = None
+        if resume:
+            checkpoint = self.load_checkpoint()
+        if checkpoint is None:
+            Checkpoint.remove()
+            checkpoint = Checkpoint(self.rev_mgr.deploy_revision)
+        if checkpoint.is_complete("commit"):
+            # La révision est déjà enregistrée, il ne reste qu'à redémarrer
+            # (en mode batch, elle est transmise à nouveau aux serveurs).
+            if self.batch:
+                self._pending_revision = list(checkpoint.deployed)
+        else:
+            # La synchronisation en base n'a pas été validée : elle est
+            # refaite, mais les fichiers déjà générés sont conservés si la
+            # ventilation n'a pas changé.
+            if checkpoint.is_complete("generation"):
+                if not self.generate(reuse=checkpoint.ventilation):
+                    checkpoint = Checkpoint(self.rev_mgr.deploy_revision)
+                    checkpoint.complete_generation(
+                            self.gen_mgr.ventilation_fingerprint())
+            elif stop_after != "generation" and DeployPipeline.enabled():
+                deployed = self.generate_and_deploy(checkpoint)
+                checkpoint.complete_push(deployed)
+            else:
+                self.generate()
+                checkpoint.complete_generation(
+                        self.gen_mgr.ventilation_fingerprint())
+            if stop_after == "generation":
+                return
+            if not checkpoint.is_complete("push"):
+                checkpoint.complete_push(self.deploy())
+            if stop_after == "push":
+                return
+            self.commit(checkpoint.deployed)
+            checkpoint.complete("commit")
         self.restart()
+        Checkpoint.remove()
 
-    def run(self, stop_after=None, with_dbonly=True):
+    def run(self, stop_after=None, with_dbonly=True, resume=False):
         """
         Méthode principale pour déclencher VigiConf.
 
@@ -206,8 +422,11 @@ class Dispatchator(object):
             que sur la base de données (dbonly) doivent être exécutés
             ou non. Par défaut, ils sont exécutés normalement.
         @type with_dbonly: C{bool}
+        @param resume: Reprendre le déploiement précédent à partir de la
+            première étape inachevée (voir L{Checkpoint}).
+        @type  resume: C{bool}
         """
-        self._run(stop_after)
+        self._run(stop_after, resume)
         if with_dbonly:
             self.gen_mgr.generate_dbonly()
 
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+
+"""
+Point de reprise d'un déploiement.
+
+Au fil d'un déploiement, le fichier C{checkpoint.json} du dossier C{libdir}
+enregistre la révision déployée, l'empreinte de la ventilation, celle de la
+configuration générée pour chaque serveur (voir L{Manifest}) et les étapes
+terminées. Un déploiement interrompu peut ainsi être repris (option
+C{--resume}) à partir de la première étape inachevée, sans générer à nouveau
+la configuration, tant que ni la révision, ni la ventilation, ni les fichiers
+générés n'ont changé. Le fichier est supprimé à la fin du déploiement.
+"""
+
+from __future__ import absolute_import
+
+import os
+import json
+
+from vigilo.common.conf import settings
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from vigilo.vigiconf.lib.manifest import Manifest
+
+__all__ = ("Checkpoint", "PHASES")
+
+
+CHECKPOINT_VERSION = 1
+# étapes du déploiement, dans l'ordre
+PHASES = ("generation", "push", "commit", "restart")
+
+
+class Checkpoint(object):
+    """
+    Point de reprise d'un déploiement.
+
+    @ivar revision: révision de la configuration déployée.
+    @type revision: C{int}
+    @ivar ventilation: empreinte de la ventilation (voir
+        L{VentilationIndex.fingerprint
+        <vigilo.vigiconf.lib.ventilation.VentilationIndex.fingerprint>}).
+    @type ventilation: C{str}
+    @ivar manifests: empreinte de la configuration générée pour chaque
+        serveur (voir L{Manifest.tree_hash}).
+    @type manifests: C{dict}
+    @ivar phases: étapes terminées (voir L{PHASES}).
+    @type phases: C{list}
+    @ivar deployed: noms des serveurs sur lesquels la configuration a été
+        déployée.
+    @type deployed: C{list}
+    """
+
+    def __init__(self, revision, ventilation=None, manifests=None,
+                 phases=None, deployed=None):
+        self.revision = revision
+        self.ventilation = ventilation
+        self.manifests = manifests or {}
+        self.phases = list(phases or [])
+        self.deployed = list(deployed or [])
+
+    def is_complete(self, phase):
+        """
+        @return: l'étape est terminée.
+        @rtype: C{bool}
+        """
+        return phase in self.phases
+
+    @property
+    def next_phase(self):
+        """Première étape inachevée (C{None} si toutes sont terminées)."""
+        for phase in PHASES:
+            if phase not in self.phases:
+                return phase
+        return None
+
+    def complete(self, phase):
+        """
+        Enregistre la fin d'une étape.
+        @param phase: étape terminée (voir L{PHASES}).
+        @type  phase: C{str}
+        """
+        if phase not in self.phases:
+            self.phases.append(phase)
+        LOGGER.debug("Deployment checkpoint: %s complete", phase)
+        if self.enabled():
+            self.save()
+
+    def complete_generation(self, ventilation):
+        """
+        Enregistre la fin de la génération, avec l'empreinte de la
+        ventilation et celle de la configuration générée pour chaque serveur,
+        d'après les manifestes écrits lors de la génération (voir
+        L{GeneratorManager.write_manifests
+        <vigilo.vigiconf.lib.generators.manager.GeneratorManager>}).
+        @param ventilation: empreinte de la ventilation.
+        @type  ventilation: C{str}
+        """
+        self.ventilation = ventilation
+        self.manifests = {}
+        for server, manifest in self._generated().iteritems():
+            self.manifests[server] = manifest.tree_hash
+        self.complete("generation")
+
+    def complete_push(self, deployed):
+        """
+        Enregistre la fin du déploiement sur les serveurs.
+        @param deployed: noms des serveurs déployés.
+        @type  deployed: C{list}
+        """
+        self.deployed = sorted(deployed)
+        self.complete("push")
+
+    @staticmethod
+    def _generated(rebuild=False):
+        """
+        @param rebuild: reconstruire le manifeste des arborescences dont le
+            manifeste enregistré est absent ou illisible (elles sont sinon
+            ignorées).
+        @type  rebuild: C{bool}
+        @return: manifestes des arborescences générées, par serveur.
+        @rtype: C{dict}
+        """
+        basedir = Manifest.basedir()
+        manifests = {}
+        if not os.path.isdir(basedir):
+            return manifests
+        for server in os.listdir(basedir):
+            if not os.path.isdir(os.path.join(basedir, server)):
+                continue
+            manifest = Manifest.load(Manifest.generated_path(server))
+            if manifest is None and rebuild:
+                manifest = Manifest.build(server, basedir)
+            if manifest is not None:
+                manifests[server] = manifest
+        return manifests
+
+    def check(self, revision):
+        """
+        Vérifie que le déploiement peut être repris à partir de ce point.
+        @param revision: révision de la configuration à déployer.
+        @type  revision: C{int}
+        @return: la raison pour laquelle la reprise est impossible, ou
+            C{None} si elle est possible.
+        @rtype: C{unicode}
+        """
+        if self.revision != revision:
+            return _("the revision has changed (%(old)s -> %(new)s)") % {
+                        "old": self.revision, "new": revision}
+        if not self.is_complete("generation") or \
+                self.is_complete("commit"):
+            # les fichiers générés ne sont pas ou plus utilisés
+            return None
+        generated = self._generated(rebuild=True)
+        if set(generated) != set(self.manifests):
+            return _("the list of generated servers has changed")
+        for server, manifest in generated.iteritems():
+            if manifest.tree_hash != self.manifests[server]:
+                return _("the configuration generated for %s has changed") \
+                        % server
+        return None
+
+    def save(self):
+        """Enregistre le point de reprise (de façon atomique)."""
+        filename = self.path()
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "revision": self.revision,
+            "ventilation": self.ventilation,
+            "manifests": self.manifests,
+            "phases": self.phases,
+            "deployed": self.deployed,
+        }
+        tmpname = "%s.tmp" % filename
+        f = open(tmpname, "w")
+        try:
+            json.dump(data, f, sort_keys=True, indent=0)
+        finally:
+            f.close()
+        os.rename(tmpname, filename)
+
+    @classmethod
+    def load(cls):
+        """
+        Charge le point de reprise enregistré.
+        @return: le point de reprise, ou C{None} s'il n'existe pas ou est
+            illisible.
+        @rtype: L{Checkpoint}
+        """
+        filename = cls.path()
+        if not os.path.exists(filename):
+            return None
+        try:
+            f = open(filename)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+            if data.get("version") != CHECKPOINT_VERSION:
+                return None
+            phases = [ str(phase) for phase in data["phases"]
+                       if phase in PHASES ]
+            return cls(data["revision"], data.get("ventilation"),
+                       dict([ (str(server), tree) for server, tree
+                              in data.get("manifests", {}).iteritems() ]),
+                       phases,
+                       [ str(server) for server in data.get("deployed", []) ])
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            LOGGER.warning(_("Cannot read the checkpoint %(file)s: %(error)s"),
+                           {"file": filename, "error": e})
+            return None
+
+    @classmethod
+    def remove(cls):
+        """Supprime le point de reprise enregistré."""
+        try:
+            os.remove(cls.path())
+        except OSError:
+            pass
+
+    @staticmethod
+    def path():
+        """@return: chemin du fichier du point de reprise."""
+        return os.path.join(settings["vigiconf"].get("libdir"),
+                            "checkpoint.json")
+
+    @staticmethod
+    def enabled():
+        """
+        @return: les points de reprise sont enregistrés (ils ne le sont pas
+            en mode simulation).
+        @rtype: C{bool}
+        """
+        try:
+            return not settings["vigiconf"].as_bool("simulate")
+        except KeyError:
+            return True
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
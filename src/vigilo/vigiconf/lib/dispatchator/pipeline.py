@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+
+"""
+Déploiement au fil de la génération.
+
+Dès que la configuration d'un serveur Vigilo est entièrement générée, elle
+est validée localement puis transmise au serveur, pendant que la génération
+se poursuit pour les autres serveurs. L'enregistrement de la révision et le
+redémarrage des applications n'ont lieu, comme d'habitude, qu'une fois tous
+les serveurs déployés et qualifiés.
+"""
+
+from __future__ import absolute_import
+
+import os
+from threading import Thread, Lock, BoundedSemaphore
+
+from vigilo.common.conf import settings
+
+from vigilo.common.logging import get_logger, get_error_message
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from vigilo.vigiconf.lib.manifest import Manifest
+
+
+class DeployPipeline(object):
+    """
+    Validation et déploiement de la configuration de chaque serveur Vigilo,
+    dans un thread séparé, dès que sa génération est terminée.
+
+    @ivar deployed: noms des serveurs déployés.
+    @type deployed: C{list}
+    @ivar processed: noms des serveurs traités (déployés ou non).
+    @type processed: C{set}
+    @ivar errors: messages d'erreur, par serveur.
+    @type errors: C{dict}
+    @ivar invalid: noms des serveurs dont la configuration n'a pas pu être
+        validée (erreur de validation ou autre erreur avant celle-ci).
+    @type invalid: C{set}
+    """
+
+    def __init__(self, apps_mgr, srv_mgr, force=None, concurrency=0):
+        """
+        @param apps_mgr: Gestionnaire des applications
+        @type  apps_mgr: L{ApplicationManager
+            <vigilo.vigiconf.lib.application.ApplicationManager>}
+        @param srv_mgr: Gestionnaire des serveurs Vigilo
+        @type  srv_mgr: L{ServerManager
+            <vigilo.vigiconf.lib.server.manager.ServerManager>}
+        @param force: voir L{Dispatchator.force<base.Dispatchator>}.
+        @type  force: C{tuple}
+        @param concurrency: nombre maximum de serveurs traités simultanément
+            (0 : sans limite).
+        @type  concurrency: C{int}
+        """
+        self.apps_mgr = apps_mgr
+        self.srv_mgr = srv_mgr
+        self.force = force or ()
+        self.deployed = []
+        self.processed = set()
+        self.errors = {}
+        self.invalid = set()
+        self._threads = []
+        self._lock = Lock()
+        self._slots = None
+        if concurrency > 0:
+            self._slots = BoundedSemaphore(concurrency)
+
+    def server_ready(self, servername):
+        """
+        Lance le traitement d'un serveur dont la configuration est
+        entièrement générée (voir L{GeneratorManager.server_ready
+        <vigilo.vigiconf.lib.generators.manager.GeneratorManager>}).
+        @param servername: nom du serveur.
+        @type  servername: C{str}
+        """
+        if servername not in self.srv_mgr.servers:
+            return
+        LOGGER.debug("Configuration ready for %s", servername)
+        thread = Thread(target=self._process, args=[servername])
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _process(self, servername):
+        """
+        Écrit le manifeste, valide puis déploie la configuration d'un
+        serveur. Cette méthode est exécutée dans un thread séparé.
+        """
+        if self._slots is not None:
+            self._slots.acquire()
+        validated = False
+        try:
+            gendir = Manifest.basedir()
+            if os.path.isdir(os.path.join(gendir, servername)):
+                Manifest.build(servername, gendir).save(
+                        Manifest.generated_path(servername))
+            for app in self.apps_mgr.applications:
+                if servername in app.servers:
+                    app.validateServer(servername)
+            validated = True
+            deployed = self.srv_mgr.deploy([servername], self.force)
+        except Exception as e: # pylint: disable-msg=W0703
+            LOGGER.error(get_error_message(e))
+            with self._lock:
+                self.errors[servername] = get_error_message(e)
+                if not validated:
+                    self.invalid.add(servername)
+        else:
+            with self._lock:
+                self.deployed.extend(deployed)
+        finally:
+            with self._lock:
+                self.processed.add(servername)
+            if self._slots is not None:
+                self._slots.release()
+
+    def join(self):
+        """Attend la fin du traitement des serveurs."""
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    @staticmethod
+    def enabled():
+        """
+        @return: le déploiement au fil de la génération est activé (option
+            C{pipelined_deployment}).
+        @rtype: C{bool}
+        """
+        try:
+            return settings["vigiconf"].as_bool("pipelined_deployment")
+        except KeyError:
+            return False
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -9,5 +9,8 @@ from __future__ import absolute_import
 
 from .base import Generator
 from .file import FileGenerator
+from .bundle import BundleGenerator
+from .sqlitedb import SQLiteGenerator
+from .topology import TopologyIndex
 from .manager import GeneratorManager, GenerationError
 
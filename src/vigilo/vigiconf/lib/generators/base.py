@@ -12,6 +12,7 @@ from vigilo.common.gettext import translate
 _ = translate(__name__)
 
 from vigilo.vigiconf.lib.exceptions import VigiConfError
+from vigilo.vigiconf.lib.ventilation.index import VentilationIndex
 
 
 class SkipGenerator(VigiConfError):
@@ -24,8 +25,9 @@ class Generator(object):
 
     @ivar ventilation: correspondance entre les hôtes, les applications et les
         serveurs Vigilo
-    @type ventilation: C{dict}, voir la méthode
-        L{vigilo.vigiconf.lib.ventilation.Ventilator.ventilate}()
+    @type ventilation: L{VentilationIndex}. Un dictionnaire (voir la méthode
+        L{vigilo.vigiconf.lib.ventilation.Ventilator.ventilate}()) peut
+        également être passé au constructeur, il est alors indexé.
     @cvar deploy_only_on_first: Drapeau indiquant si l'on doit déployer
         uniquement sur le premier serveur Vigilo disponible (C{True})
         ou bien sur l'ensemble des serveurs disponibles (C{False}).
@@ -34,6 +36,8 @@ class Generator(object):
 
     def __init__(self, application, ventilation):
         self.application = application
+        if not isinstance(ventilation, VentilationIndex):
+            ventilation = VentilationIndex(ventilation)
         self.ventilation = ventilation
         self.baseDir = os.path.join(settings["vigiconf"].get("libdir"),
                                     "deploy")
@@ -47,12 +51,8 @@ class Generator(object):
         La méthode principale de génération. Peut-être réimplémentée par des
         sous-classes si besoin.
         """
-        for hostname in self.ventilation.keys():
-            if self.application.name not in self.ventilation[hostname]:
-                continue
-            vservers = self.ventilation[hostname][self.application.name]
-            if isinstance(vservers, basestring):
-                vservers = [vservers, ]
+        for hostname, vservers in \
+                self.ventilation.assignments(self.application.name):
             for vserver in vservers:
                 self.generate_host(hostname, vserver)
 
@@ -89,13 +89,17 @@ class Generator(object):
         """
         self.results["errors"].append( (element, msg) )
 
+    def close_files(self):
+        """
+        Ferme les fichiers laissés ouverts par la génération. Appelée à la fin
+        de la génération, avant que la configuration ne soit déployée.
+        @note: À réimplémenter dans les sous-classes qui écrivent des
+            fichiers
+        """
+        pass
+
     def get_vigilo_servers(self):
-        vservers = set()
-        for ventilation in self.ventilation.values():
-            if self.application.name not in ventilation:
-                continue
-            vservers.add(ventilation[self.application.name])
-        return vservers
+        return self.ventilation.servers_for_app(self.application.name)
 
     def write_scripts(self):
         self.application.write_startup_scripts(self.baseDir)
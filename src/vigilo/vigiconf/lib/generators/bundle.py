@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Générateurs produisant un module Perl par hôte, regroupés à la demande en
+quelques fichiers par serveur Vigilo.
+
+Lorsque l'option C{bundle_shards} de l'application vaut N (N > 0), la
+configuration des hôtes n'est plus écrite dans un fichier par hôte mais
+répartie dans au plus N fichiers C{bundle-<i>.pm} par serveur Vigilo. Chaque
+hôte y est décrit dans son propre bloc, et la table C{%Hosts} du paquetage
+Perl associe le nom de l'hôte à sa configuration. Le fichier C{bundles.index}
+indique, pour chaque hôte, le fichier qui le contient.
+
+La répartition dépend uniquement du nom de l'hôte : un hôte reste dans le
+même fichier d'un déploiement à l'autre.
+"""
+
+from __future__ import absolute_import
+
+import os.path
+import zlib
+
+from .file import FileGenerator
+
+
+__all__ = ("BundleGenerator", "bundle_shard")
+
+
+def bundle_shard(hostname, shards):
+    """
+    @return: numéro du fichier regroupant la configuration de l'hôte.
+    @rtype: C{int}
+    """
+    return (zlib.crc32(hostname.encode("utf-8")) & 0xffffffff) % shards
+
+
+class BundleGenerator(FileGenerator):
+    """
+    La classe de base pour les générateurs produisant un module Perl par
+    hôte, éventuellement regroupés (voir le module).
+
+    Les sous-classes écrivent la configuration d'un hôte entre les appels à
+    L{hostCreate}() et L{hostClose}(). En mode regroupé, l'application doit
+    fournir les modèles C{bundle-header} (en-tête de chaque fichier) et
+    C{bundle-host} (enregistrement de l'hôte dans la table C{%Hosts} et fin
+    du bloc).
+
+    @ivar shards: nombre de fichiers par serveur Vigilo, 0 pour un fichier
+        par hôte.
+    @type shards: C{int}
+    @ivar bundles: hôtes regroupés, par fichier.
+    @type bundles: C{dict}
+    """
+
+    BUNDLE_INDEX = "bundles.index"
+
+    def __init__(self, application, ventilation):
+        super(BundleGenerator, self).__init__(application, ventilation)
+        try:
+            shards = int(self.application.getConfig().get("bundle_shards", 0))
+        except (TypeError, ValueError):
+            shards = 0
+        self.shards = max(shards, 0)
+        self.bundles = {}
+
+    def generate(self):
+        self.bundles = {}
+        super(BundleGenerator, self).generate()
+        self.closeBundles()
+
+    def hostFile(self, hostname, vserver, filename):
+        """
+        @param filename: nom du fichier propre à l'hôte, relatif au dossier
+            de l'application.
+        @type  filename: C{str}
+        @return: chemin du fichier où écrire la configuration de l'hôte.
+        @rtype: C{str}
+        """
+        if self.shards:
+            filename = "bundle-%02d.pm" % bundle_shard(hostname, self.shards)
+        return os.path.join(self.baseDir, vserver, self.application.name,
+                            filename)
+
+    def hostCreate(self, filename, hostname, template, args):
+        """
+        Commence l'écriture de la configuration d'un hôte.
+        @param filename: chemin retourné par L{hostFile}().
+        @type  filename: C{str}
+        """
+        if not self.shards:
+            self.templateCreate(filename, template, args)
+            return
+        if filename not in self.bundles:
+            self.bundles[filename] = []
+            header = self.templates["bundle-header"]
+            self.templateCreate(filename, header, {"confid": args["confid"]})
+        self.bundles[filename].append(hostname)
+        self.templateAppend(filename, "{\n", {})
+        self.templateAppend(filename, template, args)
+
+    def hostClose(self, filename, hostname):
+        """
+        Termine l'écriture de la configuration d'un hôte.
+        @param filename: chemin retourné par L{hostFile}().
+        @type  filename: C{str}
+        """
+        if not self.shards:
+            self.templateAppend(filename, self.COMMON_PERL_LIB_FOOTER, {})
+            self.templateClose(filename)
+            return
+        self.templateAppend(filename, self.templates["bundle-host"],
+                            {"name": self.quote(hostname)})
+
+    def closeBundles(self):
+        """
+        Ferme les fichiers regroupés et écrit l'index de chaque dossier.
+        """
+        indexes = {}
+        for filename in sorted(self.bundles):
+            self.templateAppend(filename, self.COMMON_PERL_LIB_FOOTER, {})
+            self.templateClose(filename)
+            dirname, basename = os.path.split(filename)
+            index = indexes.setdefault(dirname, [])
+            for hostname in self.bundles[filename]:
+                index.append((hostname, basename))
+        for dirname, index in indexes.iteritems():
+            indexfile = open(os.path.join(dirname, self.BUNDLE_INDEX), "w")
+            for hostname, basename in sorted(index):
+                indexfile.write(("%s\t%s\n" % (hostname, basename))
+                                .encode("utf-8"))
+            indexfile.close()
+            self.results["files"] += 1
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
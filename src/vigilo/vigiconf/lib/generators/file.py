@@ -12,8 +12,7 @@ import os
 import os.path
 import shutil
 
-from pkg_resources import resource_listdir, resource_string, \
-        resource_stream, resource_exists
+from pkg_resources import resource_stream, resource_exists
 
 from vigilo.common.conf import settings
 
@@ -24,6 +23,7 @@ from vigilo.common.gettext import translate
 _ = translate(__name__)
 
 from .base import Generator
+from .templates import template_cache
 
 
 __all__ = ("FileGenerator",)
@@ -33,13 +33,13 @@ class FileGenerator(Generator):
     """
     La classe de base pour les générateurs qui produisent des fichiers
 
-    TODO: refactoring: utiliser le template engine Genshi ou Mako ?
-    voir http://genshi.edgewall.org/wiki/GenshiPerformance
-
     @ivar baseDir: répertoire de generation
     @type baseDir: C{str}
     @ivar openFiles: cache of the open template files
     @type openFiles: C{dict}
+    @ivar templates: modèles compilés de l'application, voir
+        L{vigilo.vigiconf.lib.generators.templates}
+    @type templates: C{dict}
     """
 
     COMMON_PERL_LIB_FOOTER = "1;\n"
@@ -106,7 +106,7 @@ class FileGenerator(Generator):
         @param filename: the path of the file to append to
         @type  filename: C{str}
         @param template: the string to append. May contain formatting items
-        @type  template: C{str}
+        @type  template: C{str} or compiled template
         @param args: the formatting elements, if needed
         @type  args: C{dict}
         """
@@ -121,13 +121,20 @@ class FileGenerator(Generator):
         self.openFiles[filename].close()
         del self.openFiles[filename]
 
+    def close_files(self):
+        """
+        Closes the files left open by the generation
+        """
+        for filename in self.openFiles.keys():
+            self.templateClose(filename)
+
     def templateCreate(self, filename, template, args):
         """
         Create a new template file
         @param filename: the path of the file to create
         @type  filename: C{str}
         @param template: the string to add. May contain formatting items
-        @type  template: C{str}
+        @type  template: C{str} or compiled template
         @param args: the formatting elements, if needed
         @type  args: C{dict}
         """
@@ -139,26 +146,11 @@ class FileGenerator(Generator):
     def loadTemplates(self):
         """
         Load the templates available in the configuration for the application.
+        The compiled templates are shared by all the generators of the
+        process (see L{template_cache}).
         """
-        if not resource_exists(self.application.__module__, "templates"):
-            return {}
-        templates = {}
-        for filename in resource_listdir(self.application.__module__,
-                                         "templates"):
-            if not filename.endswith(".tpl"):
-                continue
-            tplname = filename[:-4]
-            if os.path.exists(os.path.join(self.override_path, filename)):
-                LOGGER.debug("Using overridden template from %s"
-                             % os.path.join(self.override_path, filename))
-                t = open(os.path.join(self.override_path, filename))
-                tpl = t.read()
-                t.close()
-            else:
-                tpl = resource_string(self.application.__module__,
-                            "templates/%s" % filename)
-            templates[tplname] = tpl
-        return templates
+        return template_cache.get_templates(self.application.__module__,
+                                            self.override_path)
 
     def quote(self, s):
         """
@@ -31,9 +31,11 @@ _ = translate(__name__)
 from vigilo.vigiconf import conf
 from vigilo.vigiconf.lib import VigiConfError
 from vigilo.vigiconf.lib.generators.base import SkipGenerator
+from vigilo.vigiconf.lib.generators.templates import enable_genshi
 from vigilo.vigiconf.lib.validator import Validator
-from vigilo.vigiconf.lib.ventilation import get_ventilator
+from vigilo.vigiconf.lib.ventilation import get_ventilator, VentilationIndex
 from vigilo.vigiconf.lib.loaders.manager import LoaderManager
+from vigilo.vigiconf.lib.manifest import Manifest
 
 
 class GenerationError(VigiConfError):
@@ -53,6 +55,9 @@ class GeneratorManager(object):
     genshi_enabled = False
 
     def __init__(self, apps):
+        # fonction appelée avec le nom de chaque serveur Vigilo dont la
+        # configuration est entièrement générée (voir run_all_generators)
+        self.server_ready = None
         self.apps = apps
         self.ventilator = None
         try:
@@ -60,6 +65,9 @@ class GeneratorManager(object):
                                     'enable_genshi_generation')
         except KeyError:
             self.genshi_enabled = False
+        if self.genshi_enabled:
+            # Les modèles ".gtpl" seront compilés avec Genshi.
+            self.genshi_enabled = enable_genshi()
         self._ventilation = None
 
     def run_all_generators(self, validator):
@@ -67,13 +75,20 @@ class GeneratorManager(object):
         Execute la méthode I{generate()} de la classe pointée par l'attribut
         I{generate} de chaque application
         """
-        vba = self.ventilator.ventilation_by_appname(self._ventilation)
+        vba = self._ventilation
         LOGGER.debug("Generating configuration")
         results = {}
+        # d'abord on indique aux applications les serveurs où déployer
+        pending = {}
         for app in self.apps:
-            # d'abord on indique à l'application les serveurs où déployer
-            for srv in self.ventilator.servers_for_app(self._ventilation, app):
+            for srv in vba.servers_for_app(app):
                 app.add_server(srv)
+                pending.setdefault(srv, set())
+                if app.generator and not app.dbonly:
+                    pending[srv].add(app.name)
+        failed = set()
+        self._notify_ready(pending, failed)
+        for app in self.apps:
             if not app.generator:
                 continue
             validator.addAGenerator()
@@ -89,6 +104,15 @@ class GeneratorManager(object):
                 generator.write_scripts()
                 LOGGER.info(_("Generated configuration for %s"), app.name)
                 results[app.name] = generator.results
+                if generator.results.get("errors"):
+                    failed.update(vba.servers_for_app(app))
+            finally:
+                # les fichiers doivent être complets avant que les serveurs
+                # ne soient signalés (et déployés)
+                generator.close_files()
+            for srv in vba.servers_for_app(app):
+                pending[srv].discard(app.name)
+            self._notify_ready(pending, failed)
         for appname, result_data in results.items():
             for element, msg in result_data.get("errors", []):
                 validator.addError(appname, element, msg)
@@ -100,22 +124,45 @@ class GeneratorManager(object):
                 validator.addDirs(result_data["dirs"])
         LOGGER.debug("Configuration generated")
 
-    def generate(self, rev_mgr, nosyncdb=False):
+    def generate(self, rev_mgr, nosyncdb=False, reuse=None):
         """
         Méthode principale de la classe, qui charge les données en base et
         génère les fichiers de configuration.
         @param nosyncdb: si cet argument est vrai, on essaye pas de
             synchroniser la configuration du disque avec la base de données
         @type nosyncdb: C{boolean}
+        @param reuse: empreinte de la ventilation d'une génération précédente
+            (voir L{VentilationIndex.fingerprint}) : si la ventilation
+            calculée est identique, les fichiers déjà générés sont conservés
+            et les générateurs ne sont pas exécutés.
+        @type reuse: C{str}
+        @return: C{True} si les fichiers déjà générés ont été conservés.
+        @rtype: C{bool}
         @raise L{GenerationError}
         """
         validator = Validator()
         loader = LoaderManager(rev_mgr)
-        return self._generate(loader, validator, nosyncdb)
+        return self._generate(loader, validator, nosyncdb, reuse)
+
+    def _notify_ready(self, pending, failed):
+        """
+        Signale, à l'aide de L{server_ready}, les serveurs Vigilo dont la
+        configuration est entièrement générée, sans erreur.
+        @param pending: applications restant à générer pour chaque serveur.
+            Les serveurs signalés en sont retirés.
+        @type  pending: C{dict}
+        @param failed: serveurs dont la génération a produit des erreurs.
+        @type  failed: C{set}
+        """
+        for srv in sorted(pending):
+            if pending[srv]:
+                continue
+            del pending[srv]
+            if self.server_ready is not None and srv not in failed:
+                self.server_ready(srv)
 
-    def _generate(self, loader, validator, nosyncdb=False):
+    def _generate(self, loader, validator, nosyncdb=False, reuse=None):
         gendir = os.path.join(settings["vigiconf"].get("libdir"), "deploy")
-        shutil.rmtree(gendir, ignore_errors=True)
         if not nosyncdb:
             LOGGER.debug("Syncing with database")
             loader.load_apps_db(self.apps)
@@ -123,7 +170,7 @@ class GeneratorManager(object):
             loader.load_vigilo_servers_db()
         LOGGER.info(_("Computing ventilation"))
         self.ventilator = get_ventilator(self.apps)
-        self._ventilation = self.ventilator.ventilate()
+        self._ventilation = VentilationIndex(self.ventilator.ventilate())
         LOGGER.debug("Loading ventilation in DB")
         loader.load_ventilation_db(self._ventilation, self.apps)
 
@@ -134,6 +181,19 @@ class GeneratorManager(object):
                 LOGGER.error(errmsg)
             raise GenerationError("prevalidation")
 
+        if reuse is not None:
+            if reuse == self._ventilation.fingerprint():
+                LOGGER.info(_("Reusing the previously generated "
+                              "configuration"))
+                for app in self.apps:
+                    for srv in self._ventilation.servers_for_app(app):
+                        app.add_server(srv)
+                return True
+            LOGGER.warning(_("The ventilation has changed since the previous "
+                             "generation, the configuration will be "
+                             "generated again"))
+
+        shutil.rmtree(gendir, ignore_errors=True)
         LOGGER.info(_("Running generators"))
         self.run_all_generators(validator)
 
@@ -143,6 +203,35 @@ class GeneratorManager(object):
             raise GenerationError("validation")
         for msg in validator.getSummary(details=True, stats=True):
             LOGGER.info(msg)
+        self.write_manifests(gendir)
+        return False
+
+    def ventilation_fingerprint(self):
+        """
+        @return: empreinte de la dernière ventilation calculée (voir
+            L{VentilationIndex.fingerprint}), ou C{None}.
+        @rtype: C{str}
+        """
+        if self._ventilation is None:
+            return None
+        return self._ventilation.fingerprint()
+
+    def write_manifests(self, gendir): # pylint: disable-msg=R0201
+        """
+        Écrit le manifeste de la configuration générée pour chaque serveur
+        Vigilo (voir L{Manifest}).
+        @param gendir: dossier de génération.
+        @type  gendir: C{str}
+        """
+        if not os.path.isdir(gendir):
+            return
+        for server in sorted(os.listdir(gendir)):
+            if not os.path.isdir(os.path.join(gendir, server)):
+                continue
+            manifest = Manifest.build(server, gendir)
+            manifest.save(os.path.join(gendir, "%s.manifest" % server))
+            LOGGER.debug("Manifest for %s: %d files, tree hash %s", server,
+                         len(manifest.files), manifest.tree_hash)
 
     def generate_dbonly(self):
         """
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Construction en masse des bases SQLite produites par les générateurs
+(connector-metro.db, vigirrd.db, ...).
+
+La base est construite dans un fichier temporaire, sans journal ni
+synchronisation disque, les lignes sont insérées par lots et les index
+ne sont créés qu'une fois toutes les données chargées. Le fichier final
+est ensuite mis en place en une seule opération (renommage atomique).
+
+En mode incrémental (option C{incremental_db_generation}), la base est
+construite à partir de celle produite lors de la génération précédente :
+seules les lignes des hôtes modifiés ou supprimés sont mises à jour.
+"""
+
+from __future__ import absolute_import
+
+import os
+import os.path
+import stat
+import shutil
+import sqlite3
+import hashlib
+import json
+
+from vigilo.common.conf import settings
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from .base import Generator
+
+
+__all__ = ("SQLiteBuilder", "SQLiteGenerator")
+
+
+class SQLiteBuilder(object):
+    """
+    Construction d'une base SQLite par insertions groupées.
+
+    Les identifiants des lignes sont attribués par le générateur lui-même
+    (voir L{next_id}), ce qui permet de différer les insertions sans avoir
+    besoin de C{cursor.lastrowid}. La numérotation est identique à celle
+    qu'aurait produite SQLite (à partir de 1, sans trou).
+
+    @cvar batch_size: nombre de lignes mises en attente pour une table
+        avant leur insertion effective.
+    @type batch_size: C{int}
+    @ivar path: emplacement final de la base.
+    @type path: C{str}
+    """
+
+    batch_size = 5000
+
+    def __init__(self, path, schema, base=None):
+        """
+        @param path: emplacement final de la base.
+        @type  path: C{str}
+        @param schema: requêtes de création des tables.
+        @type  schema: C{list} of C{str}
+        @param base: base existante à partir de laquelle travailler
+            (mode incrémental), ou C{None} pour une nouvelle base.
+        @type  base: C{str}
+        """
+        self.path = path
+        self.tmp_path = "%s.tmp" % path
+        self.base = base
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        if base is not None:
+            shutil.copyfile(base, self.tmp_path)
+        self.db = sqlite3.connect(self.tmp_path)
+        # Le fichier n'est publié qu'une fois complet : la
+        # journalisation et les synchronisations sont inutiles.
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        if base is None:
+            for statement in schema:
+                self.db.execute(statement)
+        self._ids = {}
+        self._pending = {}
+
+    def next_id(self, table):
+        """
+        Retourne l'identifiant de la prochaine ligne de la table.
+        @param table: nom de la table.
+        @type  table: C{str}
+        @rtype: C{int}
+        """
+        if table not in self._ids:
+            if self.base is None:
+                self._ids[table] = 0
+            else:
+                # La clé primaire des tables est un alias du ROWID.
+                self._ids[table] = self.db.execute(
+                        "SELECT COALESCE(MAX(rowid), 0) FROM %s" % table
+                    ).fetchone()[0]
+        self._ids[table] += 1
+        return self._ids[table]
+
+    def execute(self, statement, params=()):
+        """
+        Exécute une requête, après insertion des lignes en attente.
+        @return: le curseur de la requête.
+        """
+        self.flush()
+        return self.db.execute(statement, params)
+
+    def insert(self, table, row):
+        """
+        Ajoute une ligne à insérer dans une table.
+        @param table: nom de la table.
+        @type  table: C{str}
+        @param row: valeurs de toutes les colonnes de la table,
+            dans l'ordre de leur déclaration.
+        @type  row: C{tuple}
+        """
+        rows = self._pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        """
+        Insère les lignes en attente.
+        @param table: table concernée, ou C{None} pour toutes les tables.
+        @type  table: C{str}
+        """
+        if table is None:
+            tables = self._pending.keys()
+        else:
+            tables = [table]
+        for table in tables:
+            rows = self._pending.pop(table, None)
+            if not rows:
+                continue
+            self.db.executemany("INSERT INTO %s VALUES (%s)" % (
+                                    table, ", ".join("?" * len(rows[0]))),
+                                rows)
+
+    def finalize(self, indexes=(), vacuum_ratio=None):
+        """
+        Termine le chargement, crée les index et met la base en place.
+        L'ensemble des modifications est validé en une seule transaction.
+        @param indexes: requêtes de création des index (ignorées
+            en mode incrémental, les index existant déjà).
+        @type  indexes: C{list} of C{str}
+        @param vacuum_ratio: en mode incrémental, proportion de pages
+            libres au-delà de laquelle la base est compactée.
+        @type  vacuum_ratio: C{float}
+        """
+        self.flush()
+        if self.base is None:
+            for statement in indexes:
+                self.db.execute(statement)
+        self.db.commit()
+        if self.base is not None and vacuum_ratio is not None:
+            free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+            total = self.db.execute("PRAGMA page_count").fetchone()[0]
+            if total and float(free) / total > vacuum_ratio:
+                LOGGER.debug("Vacuuming %s (%d free pages out of %d)",
+                             self.path, free, total)
+                self.db.execute("VACUUM")
+        self.db.close()
+        os.chmod(self.tmp_path, # chmod 644
+                 stat.S_IRUSR | stat.S_IWUSR |
+                 stat.S_IRGRP | stat.S_IROTH )
+        os.rename(self.tmp_path, self.path)
+        LOGGER.debug("Wrote %s", self.path)
+
+
+class SQLiteGenerator(Generator):
+    """
+    Classe de base pour les générateurs produisant une base SQLite
+    par serveur Vigilo.
+
+    Lorsque l'option C{incremental_db_generation} est activée, une copie
+    de chaque base générée est conservée dans le dossier C{dbcache} du
+    répertoire de travail, avec l'empreinte de la configuration de chaque
+    hôte. La génération suivante repart de cette copie et ne réécrit que
+    les lignes des hôtes dont l'empreinte a changé ou qui ont disparu.
+
+    Les sous-classes définissent L{db_name}, L{schema}, L{indexes} et
+    L{delete_host}, et appellent L{host_changed} avant d'écrire les lignes
+    d'un hôte. Les données communes à tous les hôtes (configuration de
+    l'application) sont représentées dans les empreintes par
+    L{config_digest}, calculée une seule fois par génération.
+
+    @cvar db_name: nom du fichier de la base.
+    @type db_name: C{str}
+    @cvar schema: requêtes de création des tables.
+    @type schema: C{list}
+    @cvar indexes: requêtes de création des index.
+    @type indexes: C{list}
+    @ivar databases: bases en cours de construction, par serveur Vigilo.
+    @type databases: C{dict} of L{SQLiteBuilder}
+    @ivar config_digest: empreinte de la configuration de l'application
+        (C{None} hors mode incrémental).
+    @type config_digest: C{str}
+    """
+
+    db_name = None
+    schema = []
+    indexes = []
+
+    def init_databases(self):
+        """Réinitialise l'état avant une nouvelle génération."""
+        # pylint: disable-msg=W0201
+        self.databases = {}
+        self._hashes = {}
+        self._previous = {}
+        try:
+            self.incremental = settings["vigiconf"].as_bool(
+                                    "incremental_db_generation")
+        except KeyError:
+            self.incremental = False
+        try:
+            self.vacuum_ratio = settings["vigiconf"].as_float(
+                                    "incremental_db_vacuum_ratio")
+        except KeyError:
+            self.vacuum_ratio = 0.25
+        self.cacheDir = os.path.join(settings["vigiconf"].get("libdir"),
+                                     "dbcache")
+        self.config_digest = None
+        if self.incremental:
+            self.config_digest = self.digest(self.application.getConfig())
+            if self.config_digest is None:
+                # Changements de configuration indétectables.
+                self.incremental = False
+
+    @staticmethod
+    def digest(data):
+        """
+        @param data: données sérialisables en JSON.
+        @return: empreinte des données, ou C{None} si elles ne sont pas
+            sérialisables.
+        @rtype: C{str}
+        """
+        try:
+            return hashlib.md5(json.dumps(data, sort_keys=True)).hexdigest()
+        except (TypeError, ValueError):
+            return None
+
+    def _schema_hash(self):
+        return hashlib.md5("\n".join(self.schema)).hexdigest()
+
+    def _cache_paths(self, vserver):
+        cachedir = os.path.join(self.cacheDir, vserver)
+        return (os.path.join(cachedir, self.db_name),
+                os.path.join(cachedir, "%s.hosts" % self.db_name))
+
+    def _load_cache(self, vserver):
+        """
+        @return: base précédente et empreintes de ses hôtes,
+            ou C{(None, {})} si elle est inutilisable.
+        """
+        db_path, hashes_path = self._cache_paths(vserver)
+        if not os.path.exists(db_path) or not os.path.exists(hashes_path):
+            return (None, {})
+        try:
+            hashes_file = open(hashes_path)
+            try:
+                cached = json.load(hashes_file)
+            finally:
+                hashes_file.close()
+        except (IOError, ValueError), e:
+            LOGGER.warning(_("Could not read %(file)s: %(error)s"),
+                           {"file": hashes_path, "error": e})
+            return (None, {})
+        if cached.get("schema") != self._schema_hash():
+            return (None, {})
+        return (db_path, cached.get("hosts", {}))
+
+    def _save_cache(self, vserver):
+        db_path, hashes_path = self._cache_paths(vserver)
+        try:
+            os.makedirs(os.path.dirname(db_path))
+        except OSError:
+            pass
+        # Les empreintes sont retirées en premier : en cas d'interruption,
+        # la base en cache est ignorée et la génération suivante est complète.
+        if os.path.exists(hashes_path):
+            os.remove(hashes_path)
+        shutil.copyfile(self.databases[vserver].path, "%s.tmp" % db_path)
+        os.rename("%s.tmp" % db_path, db_path)
+        hashes_file = open("%s.tmp" % hashes_path, "w")
+        try:
+            json.dump({"schema": self._schema_hash(),
+                       "hosts": self._hashes[vserver]}, hashes_file)
+        finally:
+            hashes_file.close()
+        os.rename("%s.tmp" % hashes_path, hashes_path)
+
+    def get_database(self, vserver):
+        """
+        Retourne la base en cours de construction pour un serveur Vigilo,
+        en la créant si nécessaire.
+        @rtype: L{SQLiteBuilder}
+        """
+        if vserver not in self.databases:
+            base = None
+            if self.incremental:
+                base, self._previous[vserver] = self._load_cache(vserver)
+            else:
+                self._previous[vserver] = {}
+            if base is not None:
+                LOGGER.debug("Updating %s for %s incrementally",
+                             self.db_name, vserver)
+            self._hashes[vserver] = {}
+            self.databases[vserver] = SQLiteBuilder(
+                    os.path.join(self.baseDir, vserver, self.db_name),
+                    self.schema, base)
+            self.open_database(vserver, self.databases[vserver])
+        return self.databases[vserver]
+
+    def open_database(self, vserver, db):
+        """
+        Appelée à l'ouverture de chaque base. Peut-être réimplémentée
+        par les sous-classes pour initialiser leurs caches.
+        """
+        pass
+
+    def host_changed(self, vserver, hostname, signature):
+        """
+        Indique si les lignes d'un hôte doivent être (ré)écrites dans la base.
+        En mode incrémental, les lignes obsolètes de l'hôte sont supprimées ;
+        sinon, l'empreinte n'est pas calculée.
+        @param signature: données dont dépendent les lignes de l'hôte
+            (sérialisables en JSON ; sinon, l'hôte est toujours réécrit).
+        @return: C{False} si la base contient déjà les lignes à jour.
+        @rtype: C{bool}
+        """
+        db = self.get_database(vserver)
+        if not self.incremental:
+            return True
+        digest = self.digest(signature)
+        previous = self._previous[vserver].get(hostname)
+        if digest is None:
+            # Empreinte vide : l'hôte sera réécrit à chaque génération.
+            self._hashes[vserver][hostname] = ""
+            if previous is not None:
+                self.delete_host(db, hostname)
+            return True
+        self._hashes[vserver][hostname] = digest
+        if previous is None:
+            return True
+        if previous == digest:
+            return False
+        self.delete_host(db, hostname)
+        return True
+
+    def delete_host(self, db, hostname):
+        """
+        Supprime de la base les lignes relatives à un hôte.
+        @note: À implémenter dans les sous-classes
+        """
+        raise NotImplementedError()
+
+    def finalize_databases(self):
+        for vserver, db in self.databases.iteritems():
+            removed = set(self._previous[vserver]) - set(self._hashes[vserver])
+            for hostname in removed:
+                self.delete_host(db, hostname)
+            db.finalize(self.indexes, self.vacuum_ratio)
+            if self.incremental:
+                self._save_cache(vserver)
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
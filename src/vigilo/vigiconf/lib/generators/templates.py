@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Gestion des modèles de documents utilisés par les générateurs.
+
+Les modèles sont compilés une seule fois par processus et partagés entre
+toutes les instances des générateurs. Les surcharges placées dans le dossier
+C{conf.d/filetemplates/<application>} sont prises en compte et le cache est
+invalidé dès que leur date de modification change.
+"""
+
+from __future__ import absolute_import
+
+import os
+import os.path
+import re
+
+from pkg_resources import resource_listdir, resource_string, resource_exists
+
+try:
+    from genshi.template import NewTextTemplate
+except ImportError:
+    NewTextTemplate = None
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+
+__all__ = ("Template", "GenshiTemplate", "TemplateCache", "template_cache",
+           "enable_genshi")
+
+
+# Champ de formatage Python : "%%", "%(clé)s" ou champ positionnel ("%s").
+FORMAT_FIELD = re.compile(r"%(?:(%)|(?:\(([^)]*)\))?"
+                          r"[#0\- +]*(?:\*|\d+)?(?:\.(?:\*|\d+))?[hlL]?"
+                          r"[diouxXeEfFgGcrs])")
+
+
+class BaseTemplate(object):
+    """
+    Classe de base pour les modèles compilés.
+
+    @ivar name: nom du fichier dont est issu le modèle.
+    @type name: C{str}
+    @ivar source: contenu brut du modèle.
+    @type source: C{str}
+    @ivar keys: ensemble des variables utilisées par le modèle,
+        ou C{None} si elles ne peuvent pas être déterminées.
+    @type keys: C{frozenset}
+    """
+
+    keys = None
+
+    def __init__(self, source, name=None):
+        self.source = source
+        self.name = name
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+    def __str__(self):
+        return self.source
+
+    def __mod__(self, args):
+        return self.render(args)
+
+    def render(self, args):
+        """
+        Effectue le rendu du modèle.
+        @param args: les valeurs des variables du modèle.
+        @type  args: C{dict}
+        @return: le document produit.
+        @rtype: C{basestring}
+        """
+        raise NotImplementedError()
+
+    def context(self, *sources, **extra):
+        """
+        Construit le dictionnaire des variables à passer au modèle.
+        Seules les clés réellement utilisées par le modèle sont recopiées
+        depuis les sources, ce qui évite de copier l'intégralité
+        de la configuration d'un hôte.
+
+        @param sources: dictionnaires dans lesquels chercher les valeurs,
+            les derniers ayant la priorité sur les premiers.
+        @type  sources: C{dict}
+        @param extra: valeurs supplémentaires, prioritaires sur les sources.
+        @return: les variables du modèle.
+        @rtype: C{dict}
+        """
+        ctx = {}
+        for source in sources:
+            if self.keys is None:
+                ctx.update(source)
+                continue
+            for key in self.keys:
+                if key in source:
+                    ctx[key] = source[key]
+        ctx.update(extra)
+        return ctx
+
+
+class Template(BaseTemplate):
+    """
+    Modèle utilisant le formatage Python (C{%(variable)s}), c'est-à-dire
+    les fichiers portant l'extension C{.tpl}.
+    """
+
+    def __init__(self, source, name=None):
+        super(Template, self).__init__(source, name)
+        keys = set()
+        for match in FORMAT_FIELD.finditer(source):
+            if match.group(1):
+                continue # "%%"
+            if match.group(2) is None:
+                # Champ positionnel : le modèle attend un objet complet.
+                keys = None
+                break
+            keys.add(match.group(2))
+        if keys is not None:
+            keys = frozenset(keys)
+        self.keys = keys
+
+    def render(self, args):
+        return self.source % args
+
+
+class GenshiTemplate(BaseTemplate):
+    """
+    Modèle textuel Genshi (syntaxe C{${variable}}), compilé au chargement.
+    Utilisé pour les fichiers portant l'extension C{.gtpl} lorsque l'option
+    C{enable_genshi_generation} est activée.
+    """
+
+    def __init__(self, source, name=None):
+        super(GenshiTemplate, self).__init__(source, name)
+        self._template = NewTextTemplate(source, filename=name,
+                                         encoding="utf-8")
+
+    def render(self, args):
+        return self._template.generate(**args).render(encoding=None)
+
+
+class TemplateCache(object):
+    """
+    Cache des modèles compilés, partagé par l'ensemble des générateurs.
+
+    @ivar engines: association entre une extension de fichier et la classe
+        chargée de compiler les modèles correspondants.
+    @type engines: C{dict}
+    """
+
+    def __init__(self):
+        self.engines = {".tpl": Template}
+        self._listings = {}
+        self._templates = {}
+
+    def register_engine(self, extension, factory):
+        """
+        Ajoute un moteur de modèles.
+        @param extension: extension des fichiers gérés (ex: C{.gtpl}).
+        @type  extension: C{str}
+        @param factory: classe compilant un modèle à partir de son contenu.
+        @type  factory: sous-classe de L{BaseTemplate}
+        """
+        self.engines[extension] = factory
+        self._templates.clear()
+
+    def clear(self):
+        """Vide le cache."""
+        self._listings.clear()
+        self._templates.clear()
+
+    def _split(self, filename):
+        name, ext = os.path.splitext(filename)
+        if ext not in self.engines:
+            return None
+        return name
+
+    def _list_resources(self, module):
+        if module not in self._listings:
+            if resource_exists(module, "templates"):
+                self._listings[module] = sorted(
+                        resource_listdir(module, "templates"))
+            else:
+                self._listings[module] = []
+        return self._listings[module]
+
+    def _override_stamp(self, override_path):
+        """
+        Empreinte des surcharges : noms et dates de modification
+        des fichiers présents dans le dossier de surcharge.
+        """
+        try:
+            filenames = os.listdir(override_path)
+        except OSError:
+            return ()
+        stamp = []
+        for filename in sorted(filenames):
+            if self._split(filename) is None:
+                continue
+            try:
+                mtime = os.stat(os.path.join(override_path, filename)).st_mtime
+            except OSError:
+                continue
+            stamp.append( (filename, mtime) )
+        return tuple(stamp)
+
+    def get_templates(self, module, override_path):
+        """
+        Retourne les modèles compilés d'une application.
+        @param module: module Python de l'application.
+        @type  module: C{str}
+        @param override_path: dossier contenant les éventuelles surcharges.
+        @type  override_path: C{str}
+        @return: dictionnaire associant le nom de chaque modèle
+            (sans extension) au modèle compilé.
+        @rtype: C{dict}
+        """
+        key = (module, override_path)
+        stamp = self._override_stamp(override_path)
+        cached = self._templates.get(key)
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, self._load(module, override_path))
+            self._templates[key] = cached
+        # Copie superficielle : un générateur peut modifier son dictionnaire
+        # de modèles sans altérer le cache.
+        return dict(cached[1])
+
+    def _load(self, module, override_path):
+        templates = {}
+        for filename in self._list_resources(module):
+            tplname = self._split(filename)
+            if tplname is None:
+                continue
+            override = os.path.join(override_path, filename)
+            if os.path.exists(override):
+                LOGGER.debug("Using overridden template from %s", override)
+                tplfile = open(override)
+                try:
+                    source = tplfile.read()
+                finally:
+                    tplfile.close()
+            else:
+                source = resource_string(module, "templates/%s" % filename)
+            factory = self.engines[filename[len(tplname):]]
+            templates[tplname] = factory(source, filename)
+        return templates
+
+
+template_cache = TemplateCache()
+
+
+def enable_genshi():
+    """
+    Active le moteur Genshi pour les modèles portant l'extension C{.gtpl}.
+    @return: C{True} si le moteur a pu être activé.
+    @rtype: C{bool}
+    """
+    if NewTextTemplate is None:
+        LOGGER.warning(_("Genshi generation was enabled but Genshi "
+                         "is not installed, ignoring"))
+        return False
+    if ".gtpl" not in template_cache.engines:
+        template_cache.register_engine(".gtpl", GenshiTemplate)
+    return True
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Index des parents topologiques des hôtes, pour les générateurs.
+"""
+
+from __future__ import absolute_import
+
+from sqlalchemy.orm import aliased
+
+from vigilo.models.session import DBSession
+from vigilo.models.tables import Host, Ventilation, VigiloServer, \
+                                    Dependency, DependencyGroup, Application
+
+__all__ = ("TopologyIndex", )
+
+
+class TopologyIndex(object):
+    """
+    Parents topologiques de chaque hôte ventilé sur le même serveur Vigilo
+    que lui.
+
+    Les dépendances sont chargées depuis la base de données en une seule
+    requête, limitée aux serveurs Vigilo concernés, lors du premier appel
+    à L{parents}().
+
+    @ivar index: parents de chaque hôte, sous la forme
+        C{{hôte: [parents triés]}}.
+    @type index: C{dict}
+    """
+
+    def __init__(self, ventilation, appname=u"nagios", vservers=None):
+        """
+        @param ventilation: index de la ventilation.
+        @type  ventilation: L{VentilationIndex
+            <vigilo.vigiconf.lib.ventilation.VentilationIndex>}
+        @param appname: application dont la ventilation est considérée.
+        @type  appname: C{unicode}
+        @param vservers: serveurs Vigilo concernés, tous les serveurs
+            de l'application par défaut.
+        @type  vservers: C{list}
+        """
+        self.ventilation = ventilation
+        self.appname = appname
+        if vservers is None:
+            vservers = ventilation.servers_for_app(appname)
+        self.vservers = sorted(vservers)
+        self.index = None
+
+    def load(self):
+        """Charge les dépendances topologiques depuis la base de données."""
+        self.index = {}
+        if not self.vservers:
+            return
+        # note: l'argument alias évite la création d'une sous-requête inutile
+        host1 = aliased(Host, alias=Host.__table__.alias())
+        host2 = aliased(Host, alias=Host.__table__.alias())
+        dependencies = DBSession.query(
+                            host1.name.label('host1'),
+                            host2.name.label('host2'),
+                            VigiloServer.name.label('vserver'),
+                        ).join(
+                            (Dependency, Dependency.idsupitem == host1.idhost),
+                            (DependencyGroup, DependencyGroup.idgroup ==
+                                Dependency.idgroup),
+                            (host2, host2.idhost == DependencyGroup.iddependent),
+                            (Ventilation, Ventilation.idhost ==
+                                Dependency.idsupitem),
+                            (VigiloServer, VigiloServer.idvigiloserver ==
+                                Ventilation.idvigiloserver),
+                            (Application, Application.idapp ==
+                                Ventilation.idapp),
+                        ).filter(DependencyGroup.role == u'topology'
+                        ).filter(Application.name == self.appname
+                        ).filter(VigiloServer.name.in_(self.vservers)
+                        ).all()
+
+        # Seuls les parents ventilés sur le même serveur que l'hôte
+        # sont conservés.
+        for dependency in dependencies:
+            vserver = self.ventilation.server_for(dependency.host2,
+                                                  self.appname)
+            if vserver != dependency.vserver:
+                continue
+            self.index.setdefault(dependency.host2, set()).add(
+                    dependency.host1)
+        for hostname in self.index:
+            self.index[hostname] = sorted(self.index[hostname])
+
+    def parents(self, hostname):
+        """
+        @param hostname: hôte à considérer
+        @type  hostname: C{str}
+        @return: Parents topologiques de l'hôte
+        @rtype: C{list}
+        """
+        if self.index is None:
+            self.load()
+        return self.index.get(hostname, [])
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Manifestes des configurations générées pour les serveurs Vigilo.
+
+Un manifeste recense les fichiers de l'arborescence générée pour un serveur
+(C{deploy/<serveur>}) avec leur taille et leur empreinte, ainsi qu'une
+empreinte globale pour chaque application (fichiers des dossiers
+C{<application>} et C{apps/<application>}). Il est écrit à côté de
+l'arborescence, dans le fichier C{deploy/<serveur>.manifest}, et conservé
+dans le dossier C{manifests} une fois la configuration déployée avec
+succès ; la comparaison des deux permet de déterminer ce qui a changé
+depuis le dernier déploiement.
+"""
+
+from __future__ import absolute_import
+
+import os
+import json
+import hashlib
+
+from vigilo.common.conf import settings
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+__all__ = ("Manifest", "file_hash")
+
+
+MANIFEST_VERSION = 1
+_BLOCK_SIZE = 64 * 1024
+
+
+def file_hash(path):
+    """
+    @return: empreinte MD5 du contenu d'un fichier.
+    @rtype: C{str}
+    """
+    md5 = hashlib.md5()
+    f = open(path, "rb")
+    try:
+        block = f.read(_BLOCK_SIZE)
+        while block:
+            md5.update(block)
+            block = f.read(_BLOCK_SIZE)
+    finally:
+        f.close()
+    return md5.hexdigest()
+
+def _tree_hash(entries):
+    """
+    @param entries: couples (chemin, empreinte du fichier).
+    @return: empreinte d'un ensemble de fichiers.
+    @rtype: C{str}
+    """
+    md5 = hashlib.md5()
+    for path, digest in sorted(entries):
+        md5.update(path.encode("utf-8"))
+        md5.update("\0%s\n" % digest)
+    return md5.hexdigest()
+
+def _app_name(path):
+    """
+    @return: nom de l'application dont relève un fichier, ou C{None}.
+    @rtype: C{unicode}
+    """
+    parts = path.split("/")
+    if parts[0] == "apps":
+        if len(parts) > 2:
+            return parts[1]
+        return None
+    if len(parts) > 1:
+        return parts[0]
+    return None
+
+
+class Manifest(object):
+    """
+    Manifeste de la configuration générée pour un serveur Vigilo.
+
+    @ivar server: nom du serveur Vigilo.
+    @type server: C{str}
+    @ivar files: taille et empreinte de chaque fichier, sous la forme
+        C{{chemin relatif: (taille, empreinte)}}.
+    @type files: C{dict}
+    @ivar apps: empreinte de la configuration de chaque application.
+    @type apps: C{dict}
+    @ivar revision: révision de la configuration, une fois déployée.
+    @type revision: C{int}
+    """
+
+    def __init__(self, server, files=None, revision=None):
+        self.server = server
+        self.files = files or {}
+        self.revision = revision
+        self.apps = {}
+        self._compute_apps()
+
+    def _compute_apps(self):
+        entries = {}
+        for path, (_size, digest) in self.files.iteritems():
+            appname = _app_name(path)
+            if appname is not None:
+                entries.setdefault(appname, []).append((path, digest))
+        self.apps = dict([ (appname, _tree_hash(app_entries))
+                           for appname, app_entries in entries.iteritems() ])
+
+    @property
+    def tree_hash(self):
+        """Empreinte de l'ensemble de l'arborescence."""
+        return _tree_hash([ (path, digest) for path, (_size, digest)
+                            in self.files.iteritems() ])
+
+    @property
+    def shared_hash(self):
+        """
+        Empreinte des fichiers ne relevant d'aucune application (par
+        exemple les bases SQLite écrites à la racine de l'arborescence).
+        """
+        return _tree_hash([ (path, digest) for path, (_size, digest)
+                            in self.files.iteritems()
+                            if _app_name(path) is None ])
+
+    @classmethod
+    def build(cls, server, basedir=None):
+        """
+        Construit le manifeste de l'arborescence générée pour un serveur.
+        @param basedir: dossier contenant les arborescences des serveurs,
+            C{deploy} dans le dossier C{libdir} par défaut.
+        @type  basedir: C{str}
+        @rtype: L{Manifest}
+        """
+        if basedir is None:
+            basedir = cls.basedir()
+        root = os.path.join(basedir, server)
+        files = {}
+        for dirpath, _dirnames, filenames in os.walk(unicode(root)):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, root).replace(os.sep, "/")
+                files[relpath] = (os.path.getsize(path), file_hash(path))
+        return cls(server, files)
+
+    def diff(self, previous):
+        """
+        Compare ce manifeste à un manifeste précédent.
+        @param previous: manifeste de référence (C{None} si inconnu : tous
+            les fichiers sont alors considérés comme nouveaux).
+        @type  previous: L{Manifest}
+        @return: fichiers ajoutés ou modifiés, et fichiers supprimés.
+        @rtype: C{tuple} de deux C{list} triées
+        """
+        if previous is None:
+            return (sorted(self.files), [])
+        changed = [ path for path, entry in self.files.iteritems()
+                    if previous.files.get(path) != entry ]
+        deleted = [ path for path in previous.files
+                    if path not in self.files ]
+        return (sorted(changed), sorted(deleted))
+
+    def changed_apps(self, previous):
+        """
+        @return: applications dont la configuration diffère de celle
+            du manifeste précédent (toutes si celui-ci est inconnu), ou
+            C{None} si un fichier modifié ou supprimé ne relève d'aucune
+            application (par exemple les bases SQLite écrites à la racine
+            de l'arborescence) : toutes les applications sont alors
+            concernées.
+        @rtype: C{set}
+        """
+        if previous is None:
+            return set(self.apps)
+        changed, deleted = self.diff(previous)
+        for path in changed + deleted:
+            if _app_name(path) is None:
+                return None
+        return set([ appname for appname in
+                     set(self.apps) | set(previous.apps)
+                     if self.apps.get(appname) != previous.apps.get(appname) ])
+
+    def save(self, filename):
+        """
+        Enregistre le manifeste (de façon atomique).
+        @type filename: C{str}
+        """
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        data = {
+            "version": MANIFEST_VERSION,
+            "server": self.server,
+            "revision": self.revision,
+            "tree": self.tree_hash,
+            "apps": self.apps,
+            "files": dict([ (path, list(entry)) for path, entry
+                            in self.files.iteritems() ]),
+        }
+        tmpname = "%s.tmp" % filename
+        f = open(tmpname, "w")
+        try:
+            json.dump(data, f, sort_keys=True, indent=0)
+        finally:
+            f.close()
+        os.rename(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Charge un manifeste enregistré.
+        @type filename: C{str}
+        @return: le manifeste, ou C{None} s'il n'existe pas ou est illisible.
+        @rtype: L{Manifest}
+        """
+        if not os.path.exists(filename):
+            return None
+        try:
+            f = open(filename)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+            if data.get("version") != MANIFEST_VERSION:
+                return None
+            files = dict([ (path, tuple(entry)) for path, entry
+                           in data["files"].iteritems() ])
+            return cls(str(data["server"]), files, data.get("revision"))
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            LOGGER.warning(_("Cannot read the manifest %(file)s: %(error)s"),
+                           {"file": filename, "error": e})
+            return None
+
+    @staticmethod
+    def basedir():
+        """@return: dossier des arborescences générées."""
+        return os.path.join(settings["vigiconf"].get("libdir"), "deploy")
+
+    @staticmethod
+    def generated_path(server):
+        """@return: chemin du manifeste de la dernière génération."""
+        return os.path.join(Manifest.basedir(), "%s.manifest" % server)
+
+    @staticmethod
+    def deployed_path(server):
+        """@return: chemin du manifeste du dernier déploiement réussi."""
+        return os.path.join(settings["vigiconf"].get("libdir"), "manifests",
+                            "%s.manifest" % server)
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
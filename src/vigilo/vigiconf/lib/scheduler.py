@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Ordonnancement des actions (arrêt, démarrage) des applications sur les
+serveurs Vigilo.
+
+Chaque couple (application, serveur) forme une tâche. Les priorités des
+applications ne contraignent que l'ordre des tâches d'un même serveur : une
+tâche attend la fin des tâches du niveau de priorité précédent sur son
+serveur, mais les serveurs progressent indépendamment les uns des autres.
+Le nombre de tâches exécutées simultanément peut être limité, et une tâche
+qui dépasse le délai imparti à son application est relancée après un délai
+qui double à chaque tentative. Si elle le dépasse encore à la dernière
+tentative, les tâches qui en dépendent ne sont pas exécutées.
+"""
+
+from __future__ import absolute_import
+
+import time
+from threading import Thread, Event, BoundedSemaphore
+
+from vigilo.common.logging import get_logger, get_error_message
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+__all__ = ("ActionTask", "ActionScheduler")
+
+
+class ActionTask(object):
+    """
+    Action d'une application sur un serveur Vigilo.
+
+    @ivar application: application concernée.
+    @type application: L{Application<vigilo.vigiconf.lib.application.Application>}
+    @ivar server: nom du serveur.
+    @type server: C{str}
+    @ivar action: action à effectuer (C{start} ou C{stop}).
+    @type action: C{str}
+    @ivar depends: tâches à terminer avant de commencer celle-ci.
+    @type depends: C{list} de L{ActionTask}
+    @ivar status: succès de l'action (C{None} tant qu'elle n'est pas
+        terminée).
+    @type status: C{bool}
+    @ivar timedout: l'action a dépassé le délai imparti lors de chaque
+        tentative.
+    @type timedout: C{bool}
+    @ivar skipped: l'action n'a pas été exécutée, car une tâche dont elle
+        dépend a dépassé le délai imparti (ou n'a pas été exécutée).
+    @type skipped: C{bool}
+    @ivar attempts: nombre de tentatives.
+    @type attempts: C{int}
+    """
+
+    def __init__(self, application, server, action, depends=None):
+        self.application = application
+        self.server = server
+        self.action = action
+        self.depends = depends or []
+        self.status = None
+        self.timedout = False
+        self.skipped = False
+        self.attempts = 0
+        self.done = Event()
+
+    def __repr__(self):
+        return "<ActionTask %s %s on %s>" % (self.action, self.application,
+                                             self.server)
+
+    def run(self):
+        """
+        Exécute l'action.
+        @raise ApplicationError: l'action a échoué.
+        """
+        getattr(self.application, "%sServer" % self.action)(self.server)
+
+
+class ActionScheduler(object):
+    """
+    Exécute un ensemble de tâches L{ActionTask} en respectant leurs
+    dépendances.
+
+    @ivar concurrency: nombre maximum de tâches exécutées simultanément
+        (0 : sans limite).
+    @type concurrency: C{int}
+    @ivar attempts: nombre de tentatives pour une tâche qui dépasse le délai
+        imparti.
+    @type attempts: C{int}
+    @ivar retry_delay: délai avant la deuxième tentative, doublé à chaque
+        tentative suivante.
+    @type retry_delay: C{float}
+    @ivar max_delay: délai maximum entre deux tentatives.
+    @type max_delay: C{float}
+    """
+
+    def __init__(self, concurrency=0, attempts=1, retry_delay=5,
+                 max_delay=60):
+        self.concurrency = concurrency
+        self.attempts = max(attempts, 1)
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self._slots = None
+
+    @staticmethod
+    def build(applications, action, servers, only=None):
+        """
+        Construit les tâches nécessaires pour effectuer une action sur des
+        serveurs. Sur chaque serveur, les applications sont traitées par
+        ordre de priorité décroissante.
+
+        @param applications: applications concernées.
+        @type  applications: C{list}
+        @param action: C{start} ou C{stop}
+        @type  action: C{str}
+        @param servers: noms des serveurs concernés.
+        @type  servers: C{list} de C{str}
+        @param only: applications concernées sur certains serveurs, sous la
+            forme C{{serveur: noms des applications}} (par défaut, toutes
+            les applications de chaque serveur).
+        @type  only: C{dict}
+        @return: les tâches à exécuter.
+        @rtype: C{list} de L{ActionTask}
+        """
+        levels = {}
+        for app in applications:
+            for server in sorted(app.filterServers(servers)):
+                if action not in app.actions.get(server, ()):
+                    continue
+                if only and server in only and app.name not in only[server]:
+                    continue
+                levels.setdefault(server, {}).setdefault(
+                        app.priority, []).append(app)
+        tasks = []
+        for server in sorted(levels):
+            previous = []
+            for priority in sorted(levels[server], reverse=True):
+                current = [ ActionTask(app, server, action, previous)
+                            for app in levels[server][priority] ]
+                tasks.extend(current)
+                previous = current
+        return tasks
+
+    def run(self, tasks):
+        """
+        Exécute les tâches et attend leur fin.
+        @param tasks: les tâches à exécuter.
+        @type  tasks: C{list} de L{ActionTask}
+        @return: C{True} si toutes les tâches ont réussi, C{False} sinon.
+        @rtype: C{bool}
+        """
+        if self.concurrency > 0:
+            self._slots = BoundedSemaphore(self.concurrency)
+        else:
+            self._slots = None
+        threads = []
+        for task in tasks:
+            thread = Thread(target=self._run_task, args=[task])
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for task in tasks:
+            task.done.wait()
+        return all([ task.status for task in tasks ])
+
+    def _run_task(self, task):
+        """
+        Attend la fin des dépendances de la tâche puis l'exécute, sauf si
+        l'une d'entre elles a dépassé le délai imparti. Cette méthode est
+        exécutée dans un thread séparé.
+        """
+        try:
+            for dependency in task.depends:
+                dependency.done.wait()
+            if [ d for d in task.depends if d.timedout or d.skipped ]:
+                LOGGER.error(_("%(app)s: action %(action)s skipped on "
+                               "%(server)s, a previous action timed out"), {
+                                "app": task.application.name,
+                                "action": task.action,
+                                "server": task.server,
+                            })
+                task.skipped = True
+                task.status = False
+                return
+            delay = self.retry_delay
+            while True:
+                task.attempts += 1
+                task.status, task.timedout = self._attempt(task)
+                if not task.timedout or task.attempts >= self.attempts:
+                    break
+                LOGGER.info(_("Next attempt for %(action)s action of "
+                              "%(app)s on %(server)s in %(delay)g second(s) "
+                              "(attempt #%(attempt)d)"), {
+                                "action": task.action,
+                                "app": task.application.name,
+                                "server": task.server,
+                                "delay": delay,
+                                "attempt": task.attempts + 1,
+                            })
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+        finally:
+            task.done.set()
+
+    def _attempt(self, task):
+        """
+        Exécute une tentative, dans la limite du délai imparti à
+        l'application.
+        @return: succès de la tentative, et dépassement du délai.
+        @rtype: C{tuple}
+        """
+        outcome = []
+        def run():
+            try:
+                task.run()
+            except Exception as e: # pylint: disable-msg=W0703
+                LOGGER.error(get_error_message(e))
+                outcome.append(False)
+            else:
+                outcome.append(True)
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            thread = Thread(target=run)
+            thread.daemon = True
+            thread.start()
+            thread.join(task.application.get_timeout())
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+        if thread.isAlive():
+            LOGGER.info(_("%(app)s: timeout while executing action "
+                          "%(action)s on %(server)s"), {
+                            "app": task.application.name,
+                            "action": task.action,
+                            "server": task.server,
+                        })
+            return (False, True)
+        return (outcome[0], False)
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
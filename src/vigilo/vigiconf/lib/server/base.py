@@ -11,6 +11,8 @@ import os
 import shutil
 import glob
 import re
+import json
+import tarfile
 
 from vigilo.common.conf import settings
 from vigilo.models import tables
@@ -25,6 +27,8 @@ _ = translate(__name__)
 from vigilo.vigiconf import conf
 from vigilo.vigiconf.lib import VigiConfError
 from vigilo.vigiconf.lib.systemcommand import SystemCommand, SystemCommandError
+from vigilo.vigiconf.lib.manifest import Manifest
+from vigilo.vigiconf.lib.archive import write_archive, ArchiveError
 
 
 class ServerError(VigiConfError):
@@ -42,6 +46,11 @@ class ServerError(VigiConfError):
         return repr("ServerError : %s%s" % (self.value, _srvStr))
 
 
+class BatchUnsupported(ServerError):
+    """Le serveur ne gère pas l'exécution d'un lot de commandes"""
+    pass
+
+
 class Server(object):
     """
     Un serveur Vigilo.
@@ -49,8 +58,20 @@ class Server(object):
     @type name: C{str}
     @ivar revisions: révisions des configurations déployées sur ce serveur.
     @type revisions: C{dict}
+    @cvar DELETED_LIST: nom du fichier recensant les fichiers supprimés,
+        dans une archive de déploiement différentiel.
+    @type DELETED_LIST: C{str}
+    @ivar unchanged: la configuration générée est identique à celle installée
+        sur le serveur (voir L{compute_changes}()).
+    @type unchanged: C{bool}
+    @ivar changed_apps: applications dont la configuration générée diffère
+        de celle installée sur le serveur, ou C{None} si elles ne peuvent
+        être déterminées (voir L{compute_changes}()).
+    @type changed_apps: C{set}
     """
 
+    DELETED_LIST = ".vigiconf-deleted"
+
     def __init__(self, name):
         self.name = name
         self._rev_filename = os.path.join(
@@ -61,6 +82,9 @@ class Server(object):
                           "installed": None,
                           "previous": None,
                           }
+        self._batch_supported = True
+        self.unchanged = False
+        self.changed_apps = None
 
     def getName(self):
         """@return: L{name}"""
@@ -71,8 +95,57 @@ class Server(object):
         Teste si le serveur nécessite un déploiement.
         @rtype: C{bool}
         """
+        if self.unchanged:
+            return False
         return self.revisions["conf"] != self.revisions["deployed"]
 
+    def isUnchanged(self):
+        """
+        Teste si la nouvelle révision peut être affectée au serveur sans
+        transmettre la configuration, celle-ci étant inchangée.
+        @rtype: C{bool}
+        """
+        return self.unchanged and \
+                self.revisions["conf"] != self.revisions["deployed"]
+
+    def compute_changes(self):
+        """
+        Compare le manifeste de la configuration générée à celui de la
+        configuration installée sur le serveur, si l'option
+        C{skip_unchanged} est activée, et met à jour L{unchanged} et
+        L{changed_apps}. Cette méthode doit être appelée avant
+        l'enregistrement de la nouvelle révision (voir L{keep_manifest}()).
+        """
+        self.unchanged = False
+        self.changed_apps = None
+        try:
+            if not settings["vigiconf"].as_bool("skip_unchanged"):
+                return
+        except KeyError:
+            return
+        previous = self.get_deployed_manifest()
+        manifest = self.get_manifest()
+        if previous is None or manifest is None:
+            return
+        # La configuration de référence doit être celle en production
+        # sur le serveur.
+        if previous.revision is None or \
+                previous.revision != self.revisions["deployed"] or \
+                previous.revision != self.revisions["installed"]:
+            return
+        self.changed_apps = manifest.changed_apps(previous)
+        self.unchanged = (manifest.tree_hash == previous.tree_hash)
+        if self.unchanged:
+            LOGGER.info(_("%s : the generated configuration is unchanged."),
+                        self.getName())
+        elif self.changed_apps is None:
+            LOGGER.debug("Changed files outside of any application on %s, "
+                         "every application will be restarted",
+                         self.getName())
+        else:
+            LOGGER.debug("Changed applications on %s: %s", self.getName(),
+                         ", ".join(sorted(self.changed_apps)))
+
     def needsRestart(self):
         """
         Teste si le serveur nécessite un redémarrage des applications.
@@ -132,30 +205,161 @@ class Server(object):
             }, self.getName())
         LOGGER.debug("Switched directories on %s", self.name)
 
-    def tarConf(self):
+    def get_tar_compression(self): # pylint: disable-msg=R0201
+        """
+        @return: compression des archives de déploiement (option
+            C{tar_compression}), aucune par défaut.
+        @rtype: C{str}
+        """
+        try:
+            return settings["vigiconf"]["tar_compression"]
+        except KeyError:
+            return ""
+
+    def writeTar(self, fileobj, files=None):
+        """
+        Écrit l'archive des fichiers de configuration au fil de l'eau,
+        par exemple directement vers la commande de transfert.
+        @param fileobj: destination de l'archive.
+        @type  fileobj: objet fichier
+        @param files: chemins (relatifs) des fichiers à archiver,
+            tous par défaut.
+        @type  files: C{list}
+        """
+        try:
+            write_archive(fileobj,
+                          os.path.join(self.getBaseDir(), self.getName()),
+                          files, self.get_tar_compression())
+        except (ArchiveError, IOError, OSError, tarfile.TarError) as e:
+            raise ServerError(_("Can't tar config for server "
+                                "%(server)s: %(error)s") % {
+                                    'server': self.getName(),
+                                    'error': getattr(e, "value", e),
+                                })
+
+    def tarConf(self, files=None):
         """
         I{Tarre} les fichiers de configuration, avant déploiement.
+        @param files: chemins (relatifs) des fichiers à archiver,
+            tous par défaut.
+        @type  files: C{list}
         """
-        cmd = ["tar", "-C",
-               os.path.join(self.getBaseDir(), self.getName()), "-cvf",
-               os.path.join(self.getBaseDir(), "%s.tar" % self.getName()), "."]
-        cmd = SystemCommand(cmd)
+        tar = os.path.join(self.getBaseDir(), "%s.tar" % self.getName())
         try:
-            cmd.execute()
-        except SystemCommandError as e:
+            _file = open(tar, "wb")
+        except IOError as e:
             raise ServerError(_("Can't tar config for server "
                                 "%(server)s: %(error)s") % {
                                     'server': self.getName(),
-                                    'error': e.value,
+                                    'error': e,
                                 })
+        try:
+            self.writeTar(_file, files)
+        finally:
+            _file.close()
 
     def deployTar(self):
         raise NotImplementedError
 
-    def deployFiles(self):
+    def deployDeltaTar(self, base_revision):
+        """
+        Transmet une archive différentielle, à appliquer sur la
+        configuration de la révision indiquée.
+        @note: À réimplémenter dans les sous-classes.
+        @param base_revision: révision de la configuration de référence.
+        @type  base_revision: C{int}
+        """
+        raise ServerError(_("Delta deployment is not supported"),
+                          self.getName())
+
+    def use_delta(self):
         """
-        Copie tous les fichiers de configuration.
+        @return: C{True} si le déploiement différentiel est activé
+            (option C{delta_deployment}).
+        @rtype: C{bool}
         """
+        try:
+            return settings["vigiconf"].as_bool("delta_deployment")
+        except KeyError:
+            return False
+
+    def get_delta(self):
+        """
+        Détermine les fichiers à transmettre, à partir des manifestes de la
+        configuration générée et de la dernière configuration déployée avec
+        succès.
+        @return: fichiers ajoutés ou modifiés, fichiers supprimés et
+            révision de référence, ou C{None} si un déploiement complet
+            est nécessaire.
+        @rtype: C{tuple}
+        """
+        previous = self.get_deployed_manifest()
+        manifest = self.get_manifest()
+        if previous is None or manifest is None:
+            return None
+        # La configuration de référence doit être celle présente
+        # sur le serveur.
+        if previous.revision is None or \
+                previous.revision != self.revisions["deployed"]:
+            return None
+        changed, deleted = manifest.diff(previous)
+        return (changed, deleted, previous.revision)
+
+    def deployDelta(self, changed, deleted, base_revision):
+        """
+        Copie les fichiers de configuration ajoutés ou modifiés depuis
+        la révision de référence, ainsi que la liste des fichiers supprimés
+        (fichier L{DELETED_LIST}).
+        """
+        root = os.path.join(self.getBaseDir(), self.getName())
+        # Les scripts de validation sont ajoutés au moment du déploiement
+        # et ne figurent donc pas dans les manifestes.
+        files = list(changed)
+        validation_dir = self.getValidationDir()
+        if os.path.isdir(validation_dir):
+            files.extend([ "validation/%s" % f
+                           for f in sorted(os.listdir(validation_dir)) ])
+        deleted_list = os.path.join(root, self.DELETED_LIST)
+        _file = open(deleted_list, "wb")
+        _file.write("".join([ "%s\n" % f.encode("utf-8") for f in deleted ]))
+        _file.close()
+        files.append(self.DELETED_LIST)
+        try:
+            self.tarConf(files)
+        finally:
+            os.remove(deleted_list)
+        self.deployDeltaTar(base_revision)
+        LOGGER.info(_("%(server)s : %(changed)d files sent, %(deleted)d "
+                      "files deleted since revision %(revision)s."), {
+                        "server": self.getName(),
+                        "changed": len(changed),
+                        "deleted": len(deleted),
+                        "revision": base_revision,
+                     })
+
+    def deployFiles(self, full=False):
+        """
+        Copie tous les fichiers de configuration, ou seulement ceux
+        modifiés depuis le dernier déploiement si le déploiement
+        différentiel est activé.
+        @param full: force le déploiement de tous les fichiers.
+        @type  full: C{bool}
+        """
+        delta = None
+        if not full and self.use_delta():
+            delta = self.get_delta()
+        if delta is not None:
+            try:
+                self.deployDelta(*delta)
+            except ServerError as e:
+                LOGGER.warning(_("%(server)s : delta deployment failed "
+                                 "(%(error)s), deploying all the files."), {
+                                    "server": self.getName(),
+                                    "error": e.value,
+                               })
+            else:
+                LOGGER.info(_("%s : deployment successful."), self.getName())
+                return
         self.tarConf()
         self.deployTar()
         LOGGER.info(_("%s : deployment successful."), self.getName())
@@ -196,19 +400,171 @@ class Server(object):
         for validation_script in glob.glob(validation_scripts):
             shutil.copy(validation_script, validation_dir)
 
-    def deploy(self):
+    def deploy(self, full=False):
         # insert the "validation" directory in the deployment directory
         self.insertValidationDir()
         # now, the deployment directory is complete.
-        self.deployFiles()
+        self.deployFiles(full)
 
-    def set_revision(self, rev):
+    def set_revision(self, rev, remote=True):
+        """
+        Affecte la révision de la configuration déployée.
+        @param rev: révision déployée.
+        @type  rev: C{int}
+        @param remote: transmettre la révision au serveur. Si ce paramètre
+            vaut C{False}, la révision doit lui être transmise par une étape
+            C{set-revision} d'un lot de commandes (voir L{run_steps}()).
+        @type  remote: C{bool}
+        """
         # update local revision files
         self.revisions["conf"] = rev
         self.revisions["deployed"] = rev
         self.write_revisions()
-        cmd = self.createCommand(["vigiconf-local", "set-revision", str(rev)])
-        cmd.execute()
+        if remote:
+            cmd = self.createCommand(["vigiconf-local", "set-revision",
+                                      str(rev)])
+            cmd.execute()
+        self.keep_manifest(rev)
+
+    @staticmethod
+    def use_batch():
+        """
+        @return: C{True} si les commandes destinées à un serveur doivent
+            être regroupées en lots (option C{batch_commands}).
+        @rtype: C{bool}
+        """
+        try:
+            return settings["vigiconf"].as_bool("batch_commands")
+        except KeyError:
+            return False
+
+    def run_steps(self, steps):
+        """
+        Exécute une suite de commandes C{vigiconf-local}, en une seule fois
+        si les lots de commandes sont activés (voir L{run_batch}()), ou
+        l'une après l'autre sinon. L'exécution s'arrête à la première
+        commande en échec.
+        @param steps: commandes à exécuter, chacune sous la forme d'une liste
+            d'arguments de C{vigiconf-local} (par exemple
+            C{["start-app", "nagios"]}).
+        @type  steps: C{list} de C{list}
+        @raise ServerError: une commande a échoué.
+        """
+        if not steps:
+            return
+        if self.use_batch() and self._batch_supported:
+            try:
+                self.run_batch(steps)
+                return
+            except BatchUnsupported as e:
+                LOGGER.warning(_("%(server)s : batched commands are not "
+                                 "supported (%(error)s), running them one "
+                                 "by one."), {
+                                    "server": self.getName(),
+                                    "error": e.value,
+                               })
+                self._batch_supported = False
+        for step in steps:
+            cmd = self.createCommand(["vigiconf-local"] + list(step))
+            try:
+                cmd.execute()
+            except SystemCommandError as e:
+                raise ServerError(_("%(server)s : step \"%(step)s\" failed: "
+                                    "%(reason)s") % {
+                                        "server": self.getName(),
+                                        "step": " ".join(step),
+                                        "reason": e.value,
+                                    }, self.getName())
+
+    def run_batch(self, steps):
+        """
+        Exécute une suite de commandes en un seul appel à
+        C{vigiconf-local batch}. Chaque étape est passée en argument sous la
+        forme C{commande:argument} ; la commande retourne une ligne JSON par
+        étape exécutée (clés C{step}, C{status} valant C{ok} ou C{error}, et
+        C{output}) et s'arrête à la première étape en échec.
+        @param steps: voir L{run_steps}().
+        @type  steps: C{list} de C{list}
+        @return: le résultat de chaque étape exécutée.
+        @rtype: C{list} de C{dict}
+        @raise BatchUnsupported: la commande n'a produit aucun résultat
+            exploitable.
+        @raise ServerError: une étape a échoué.
+        """
+        cmd = self.createCommand(["vigiconf-local", "batch"] +
+                                 [ ":".join(step) for step in steps ])
+        error = None
+        try:
+            cmd.execute()
+        except SystemCommandError as e:
+            error = e
+        if self.is_simulation():
+            return []
+        results = []
+        for line in cmd.getResult(stderr=False).split("\n"):
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(result, dict) and "step" in result:
+                results.append(result)
+        if not results:
+            raise BatchUnsupported(error is not None and error.value or
+                                   _("no result"), self.getName())
+        for result in results:
+            if result.get("status") != "ok":
+                raise ServerError(_("%(server)s : step \"%(step)s\" failed: "
+                                    "%(reason)s") % {
+                                        "server": self.getName(),
+                                        "step": result["step"],
+                                        "reason": result.get("output", ""),
+                                    }, self.getName())
+        if error is not None or len(results) < len(steps):
+            raise ServerError(_("%(server)s : only %(done)d of %(total)d "
+                                "batched steps were executed") % {
+                                    "server": self.getName(),
+                                    "done": len(results),
+                                    "total": len(steps),
+                                }, self.getName())
+        return results
+
+    def get_manifest(self):
+        """
+        @return: le manifeste de la configuration générée pour ce serveur,
+            ou C{None}.
+        @rtype: L{Manifest<vigilo.vigiconf.lib.manifest.Manifest>}
+        """
+        return Manifest.load(Manifest.generated_path(self.name))
+
+    def get_deployed_manifest(self):
+        """
+        @return: le manifeste de la dernière configuration déployée avec
+            succès sur ce serveur, ou C{None}.
+        @rtype: L{Manifest<vigilo.vigiconf.lib.manifest.Manifest>}
+        """
+        return Manifest.load(Manifest.deployed_path(self.name))
+
+    def keep_manifest(self, rev):
+        """
+        Conserve le manifeste de la configuration générée, qui vient d'être
+        déployée avec succès.
+        @param rev: révision de la configuration déployée.
+        @type  rev: C{int}
+        """
+        if self.is_simulation():
+            return
+        manifest = self.get_manifest()
+        if manifest is None:
+            return
+        manifest.revision = rev
+        try:
+            manifest.save(Manifest.deployed_path(self.name))
+        except (IOError, OSError) as e:
+            LOGGER.warning(_("Cannot save the manifest for %(server)s: "
+                             "%(error)s"), {"server": self.name, "error": e})
 
     def update_revisions(self):
         cmd = self.createCommand(["vigiconf-local", "get-revisions"])
@@ -240,8 +596,18 @@ class Server(object):
         except Exception as e: # pylint: disable-msg=W0703
             LOGGER.exception(_("Cannot write the revision file: %s"), e)
 
-    def get_state_text(self, last_revision):
-        self.update_revisions()
+    def get_state_text(self, last_revision, update=True):
+        """
+        @param last_revision: dernière révision de la configuration.
+        @type  last_revision: C{int}
+        @param update: récupérer les révisions déployées sur le serveur
+            (C{False} si elles viennent d'être récupérées).
+        @type  update: C{bool}
+        @return: description de l'état du serveur.
+        @rtype: C{unicode}
+        """
+        if update:
+            self.update_revisions()
         self.revisions["conf"] = last_revision
         state = ( _("Server %(server)s:\n"
                     "    deployed: %(deployed)d\n"
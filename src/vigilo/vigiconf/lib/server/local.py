@@ -54,4 +54,17 @@ class ServerLocal(Server):
                                     'error': e.value,
                                 })
 
+    def deployDeltaTar(self, base_revision):
+        tar = os.path.join(self.getBaseDir(), "%s.tar" % self.getName())
+        cmd = self.createCommand(["vigiconf-local", "receive-conf", "--delta",
+                                  str(base_revision), tar])
+        try:
+            cmd.execute()
+        except SystemCommandError as e:
+            raise ServerError(_("Can't deploy the delta archive for server "
+                                "%(server)s: %(error)s") % {
+                                    'server': self.getName(),
+                                    'error': e.value,
+                                })
+
 # vim:set expandtab tabstop=4 shiftwidth=4:
@@ -8,9 +8,12 @@ un parc de serveurs Vigilo.
 
 from __future__ import absolute_import
 
+import time
 import Queue
 from threading import Thread
 
+from vigilo.common.conf import settings
+
 from vigilo.common.logging import get_logger
 LOGGER = get_logger(__name__)
 
@@ -20,6 +23,64 @@ _ = translate(__name__)
 from vigilo.vigiconf.lib.exceptions import VigiConfError, DispatchatorError
 
 
+class ActionResult(object):
+    """
+    Résultat d'une action exécutée sur un serveur Vigilo.
+
+    @ivar server: nom du serveur.
+    @type server: C{str}
+    @ivar success: succès de l'action.
+    @type success: C{bool}
+    @ivar error: message d'erreur en cas d'échec.
+    @type error: C{unicode}
+    @ivar timeout: l'échec est dû à un dépassement du délai imparti.
+    @type timeout: C{bool}
+    @ivar attempts: nombre de tentatives.
+    @type attempts: C{int}
+    @ivar duration: durée totale (en secondes).
+    @type duration: C{float}
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.success = False
+        self.error = None
+        self.timeout = False
+        self.attempts = 0
+        self.duration = 0.0
+
+    def __repr__(self):
+        return "<ActionResult %s: %s>" % (self.server,
+                    self.success and "OK" or (self.error or "not run"))
+
+
+class ActionResults(dict):
+    """
+    Résultats d'une action exécutée sur plusieurs serveurs Vigilo,
+    indexés par le nom du serveur. Le dictionnaire est évalué à C{True}
+    si l'action a réussi sur tous les serveurs.
+    """
+
+    def __nonzero__(self):
+        for result in self.itervalues():
+            if not result.success:
+                return False
+        return True
+
+    @property
+    def failed(self):
+        """Noms des serveurs sur lesquels l'action a échoué."""
+        return sorted([ server for server, result in self.iteritems()
+                        if not result.success ])
+
+
+def _get_option(name, default, convert=float):
+    try:
+        return convert(settings["vigiconf"][name])
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
 class ServerManager(object):
     """
     Gestionnaire de serveurs Vigilo. Maintient une liste des serveurs
@@ -36,56 +97,244 @@ class ServerManager(object):
 
     def __init__(self, factory):
         self.servers = {}
-        self.commands_queue = None # will be initialized as Queue.Queue later
-        self.returns_queue = None # will be initialized as Queue.Queue later
         self.factory = factory
+        # date de la dernière interrogation des révisions de chaque serveur
+        self._polled = {}
 
     def get(self, servername):
         return self.servers[servername]
 
     def prepare(self, revision):
+        results = self.poll_revisions()
+        if not results:
+            raise DispatchatorError(_("Cannot get the revisions from the "
+                    "following servers: %s") % ", ".join(results.failed))
         for server_obj in self.servers.values():
-            server_obj.update_revisions()
             server_obj.revisions["conf"] = revision
 
-    def run_in_thread(self, servers, action, args=None):
+    def poll_revisions(self, servers=None):
         """
-        Exécute une action sur des serveurs, en parallèle avec un thread par
-        serveur.
+        Récupère en parallèle les révisions déployées sur les serveurs (voir
+        L{Server.update_revisions<base.Server.update_revisions>}). Les
+        révisions d'un serveur interrogé depuis moins de
+        C{revision_cache_ttl} secondes, sans action depuis, ne sont pas
+        récupérées à nouveau.
+        @param servers: Liste de noms de serveurs (par défaut : tous).
+        @type  servers: C{list} de C{str}
+        @return: résultat de l'interrogation de chaque serveur (voir
+            L{run_in_thread}()) ; les révisions des serveurs en échec sont
+            inconnues.
+        @rtype: L{ActionResults}
+        """
+        if servers is None:
+            servers = self.servers.keys()
+        ttl = _get_option("revision_cache_ttl", 30.0)
+        now = time.time()
+        cached = [ s for s in servers
+                   if now - self._polled.get(s, -ttl) < ttl ]
+        todo = [ s for s in servers if s not in cached ]
+        options = self.get_pool_options()
+        options.update({
+            "concurrency": _get_option("revision_concurrency", 10, int),
+            "timeout": _get_option("revision_timeout", 60.0),
+            "retries": 0,
+        })
+        results = self.run_in_thread(todo, "update_revisions",
+                                     options=options)
+        for servername in cached:
+            results[servername] = ActionResult(servername)
+            results[servername].success = True
+        for servername in todo:
+            if results[servername].success:
+                self._polled[servername] = now
+            else:
+                self._polled.pop(servername, None)
+        return results
+
+    def get_pool_options(self): # pylint: disable-msg=R0201
+        """
+        @return: paramètres de l'exécution des actions sur les serveurs
+            (voir L{run_in_thread}()).
+        @rtype: C{dict}
+        """
+        return {
+            # Nombre maximum de serveurs traités simultanément (0 : aucune
+            # limite).
+            "concurrency": _get_option("server_concurrency", 0, int),
+            # Délai imparti à une tentative sur un serveur, et à l'ensemble
+            # des serveurs, en secondes (0 : aucune limite).
+            "timeout": _get_option("server_timeout", 0.0),
+            "total_timeout": _get_option("server_total_timeout", 0.0),
+            # Nouvelles tentatives en cas d'échec, et délai avant la
+            # première d'entre elles (doublé à chaque tentative).
+            "retries": _get_option("server_retries", 0, int),
+            "retry_delay": _get_option("server_retry_delay", 5.0),
+        }
+
+    def run_in_thread(self, servers, action, args=None, options=None,
+                      retry=False):
+        """
+        Exécute une action sur des serveurs, en parallèle.
+
+        Le nombre de serveurs traités simultanément, les délais impartis et
+        les nouvelles tentatives en cas d'échec sont paramétrables (voir
+        L{get_pool_options}()). Une action qui dépasse son délai est
+        considérée en échec ; elle n'est pas interrompue mais n'empêche pas
+        le traitement des autres serveurs.
+
+        Seules les actions idempotentes sont retentées : une action qui a
+        abouti sur le serveur peut être signalée en échec par le transport,
+        et la relancer (bascule des dossiers par exemple) écarterait la
+        configuration en production.
+
         @param servers: Liste de noms de serveurs
         @type  servers: C{list} de C{str}
         @param action: l'action à effectuer, doit correspondre à une méthode de
             L{Server<base.Server>}.
         @type  action: C{str}
+        @param args: arguments de l'action, ou arguments propres à chaque
+            serveur sous la forme C{{nom du serveur: arguments}}.
+        @type  args: C{list} ou C{dict}
+        @param options: paramètres de l'exécution (par défaut, ceux
+            retournés par L{get_pool_options}()).
+        @type  options: C{dict}
+        @param retry: l'action est idempotente et peut être retentée en cas
+            d'échec.
+        @type  retry: C{bool}
+        @return: résultat de l'action sur chaque serveur, évalué à C{True}
+            si elle a réussi partout.
+        @rtype: L{ActionResults}
         """
         if args is None:
             args = []
-        self.commands_queue = Queue.Queue()
-        self.returns_queue = Queue.Queue()
+        if options is None:
+            options = self.get_pool_options()
+        if not retry:
+            options = dict(options, retries=0)
+        if action != "update_revisions":
+            # les révisions de ces serveurs vont changer
+            for srv in servers:
+                self._polled.pop(srv, None)
+        results = ActionResults()
+        tasks = Queue.Queue()
         for srv in servers:
-            self.commands_queue.put(srv)
-            t = Thread(target=self._threaded_action, args=[action, args])
+            results[srv] = ActionResult(srv)
+            tasks.put(srv)
+        deadline = None
+        if options["total_timeout"] > 0:
+            deadline = time.time() + options["total_timeout"]
+        nb_workers = len(servers)
+        if options["concurrency"] > 0:
+            nb_workers = min(nb_workers, options["concurrency"])
+        workers = []
+        for _i in range(nb_workers):
+            t = Thread(target=self._worker,
+                       args=[tasks, action, args, results, options, deadline])
+            t.daemon = True
             t.start()
-        self.commands_queue.join()
-        result = True # we suppose there is no error (empty queue)
-        while not self.returns_queue.empty(): # syslog each item of the queue
-            result = False
-            error = self.returns_queue.get()
-            LOGGER.error(error)
-        return result
+            workers.append(t)
+        for t in workers:
+            if deadline is None:
+                t.join()
+            else:
+                t.join(max(deadline - time.time(), 0))
+        for srv in servers:
+            result = results[srv]
+            if not result.success and result.error is None:
+                result.timeout = True
+                result.error = _("%(action)s on %(server)s: global timeout "
+                                 "exceeded") % {"action": action,
+                                                "server": srv}
+            if not result.success:
+                LOGGER.error(result.error)
+            LOGGER.debug("%s on %s: %s after %d attempt(s) in %.1fs",
+                         action, srv, result.success and "OK" or "failed",
+                         result.attempts, result.duration)
+        return results
+
+    def _worker(self, tasks, action, args, results, options, deadline):
+        """
+        Traite les serveurs en attente. Cette méthode est prévue pour
+        s'exécuter dans un thread séparé.
+        """
+        while True:
+            try:
+                servername = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            if deadline is not None and time.time() >= deadline:
+                continue # sera signalé comme un dépassement du délai global
+            self._threaded_action(servername, action, args,
+                                  results[servername], options, deadline)
 
-    def _threaded_action(self, action, args):
+    def _threaded_action(self, servername, action, args, result, options,
+                         deadline):
         """
-        Exécute l'action avec les arguments donnés en paramètres. Cette méthode
-        est prévue pour s'exécuter dans un thread séparé.
+        Exécute l'action sur un serveur, avec de nouvelles tentatives en
+        cas d'échec.
+        """
+        delay = options["retry_delay"]
+        start = time.time()
+        while True:
+            timeout = options["timeout"] > 0 and options["timeout"] or None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+                timeout = timeout and min(timeout, remaining) or remaining
+            result.attempts += 1
+            error, timed_out = self._call(servername, action, args, timeout)
+            result.duration = time.time() - start
+            if error is None:
+                result.success = True
+                result.error = None
+                return
+            result.error = error
+            result.timeout = timed_out
+            # L'action est peut-être toujours en cours : on ne la relance pas.
+            if timed_out or result.attempts > options["retries"]:
+                return
+            if deadline is not None and time.time() + delay >= deadline:
+                return
+            LOGGER.warning(_("%(error)s, retrying in %(delay)gs"),
+                           {"error": error, "delay": delay})
+            time.sleep(delay)
+            delay *= 2
+
+    def _call(self, servername, action, args, timeout):
+        """
+        Appelle la méthode d'un serveur, avec un délai éventuel.
+        @return: le message d'erreur (ou C{None}), et un booléen indiquant
+            si le délai a été dépassé.
+        @rtype: C{tuple}
         """
-        servername = self.commands_queue.get()
         server = self.servers[servername]
-        try:
-            getattr(server, action)(*args)
-        except VigiConfError as e:
-            self.returns_queue.put(e.value)
-        self.commands_queue.task_done()
+        if isinstance(args, dict):
+            args = args.get(servername, [])
+        outcome = []
+        def run():
+            try:
+                getattr(server, action)(*args)
+            except VigiConfError as e:
+                outcome.append(e.value)
+            except Exception as e: # pylint: disable-msg=W0703
+                LOGGER.exception(e)
+                outcome.append(unicode(e) or e.__class__.__name__)
+            else:
+                outcome.append(None)
+        if timeout is None:
+            run()
+            return (outcome[0], False)
+        t = Thread(target=run)
+        t.daemon = True
+        t.start()
+        t.join(timeout)
+        if t.isAlive():
+            return (_("%(action)s on %(server)s: timeout exceeded "
+                      "(%(timeout)gs)") % {
+                        "action": action,
+                        "server": servername,
+                        "timeout": timeout,
+                    }, True)
+        return (outcome[0], False)
 
     def filter_servers(self, method, servers=None, force=None):
         if force is None:
@@ -93,9 +342,8 @@ class ServerManager(object):
         if servers is None:
             servers = self.servers.keys()
         if 'deploy' not in force:
-            for server, server_obj in self.servers.items():
-                if not getattr(server_obj, method)():
-                    servers.remove(server)
+            servers = [ server for server in servers
+                        if getattr(self.servers[server], method)() ]
         return servers
 
     def deploy(self, servers=None, force=None):
@@ -109,20 +357,67 @@ class ServerManager(object):
         """
         if force is None:
             force = ()
+        if servers is None:
+            servers = self.servers.keys()
+        for servername in servers:
+            server_obj = self.servers[servername]
+            if "deploy" in force:
+                server_obj.unchanged = False
+                server_obj.changed_apps = None
+            else:
+                server_obj.compute_changes()
         servers = self.filter_servers("needsDeployment", servers, force)
         if not servers:
             LOGGER.info(_("All servers are up-to-date, no deployment needed."))
             return []
         for server in servers:
             LOGGER.debug("Server %s should be deployed.", server)
-        result = self.run_in_thread(servers, "deploy")
+        # Un déploiement forcé transmet l'ensemble des fichiers.
+        result = self.run_in_thread(servers, "deploy",
+                                    args=["deploy" in force], retry=True)
         if not result:
             raise DispatchatorError(_("The configurations files have not "
                     "been transfered on every server. See above for "
                     "more information."))
         return servers
 
-    def set_revision(self, revision, servers):
+    def unchanged_servers(self):
+        """
+        @return: noms des serveurs dont la configuration générée est
+            identique à celle installée, et qui n'ont donc pas été déployés
+            (voir L{Server.compute_changes<base.Server.compute_changes>}).
+        @rtype: C{list}
+        """
+        return sorted([ name for name, server_obj in self.servers.items()
+                        if server_obj.isUnchanged() ])
+
+    def changed_apps(self, servers, appnames):
+        """
+        @param servers: noms des serveurs concernés.
+        @type  servers: C{list} de C{str}
+        @param appnames: noms des applications gérées.
+        @type  appnames: C{list} de C{str}
+        @return: applications à redémarrer sur chaque serveur dont les
+            changements sont connus, sous la forme C{{serveur: set()}}.
+            Les serveurs absents doivent redémarrer toutes leurs
+            applications.
+        @rtype: C{dict}
+        """
+        changes = {}
+        for servername in servers:
+            changed = self.servers[servername].changed_apps
+            # Changements inconnus, ou fichiers ne relevant d'aucune
+            # application (bases SQLite à la racine de l'arborescence).
+            if changed is None:
+                continue
+            # Un dossier ne correspondant à aucune application : on ne peut
+            # savoir laquelle est concernée, elles seront toutes redémarrées.
+            if not changed <= set(appnames):
+                continue
+            changes[servername] = changed
+        return changes
+
+    def set_revision(self, revision, servers, remote=True):
         """
         Affecte le numéro de révision dans les fichiers de configuration des
         serveurs, avec un thread par serveur.
@@ -130,15 +425,37 @@ class ServerManager(object):
         @type  revision: C{int}
         @param servers: Liste de noms de serveurs
         @type  servers: C{list} of C{str}
+        @param remote: transmettre la révision aux serveurs (voir
+            L{Server.set_revision<base.Server.set_revision>}).
+        @type  remote: C{bool}
         """
         if not servers:
             return
-        result = self.run_in_thread(servers, "set_revision", args=[revision])
+        result = self.run_in_thread(servers, "set_revision",
+                                    args=[revision, remote])
         if not result:
             raise DispatchatorError(_("The revision has not "
                     "been set on every server. See above for "
                     "more information."))
 
+    def run_steps(self, steps, message):
+        """
+        Exécute une suite de commandes sur chaque serveur, avec un thread
+        par serveur (voir L{Server.run_steps<base.Server.run_steps>}).
+        @param steps: commandes à exécuter sur chaque serveur, sous la forme
+            C{{nom du serveur: [commandes]}}.
+        @type  steps: C{dict}
+        @param message: message d'erreur en cas d'échec.
+        @type  message: C{unicode}
+        """
+        servers = sorted([ s for s in steps if steps[s] ])
+        if not servers:
+            return
+        args = dict([ (s, [steps[s]]) for s in servers ])
+        result = self.run_in_thread(servers, "run_steps", args=args)
+        if not result:
+            raise DispatchatorError(message)
+
     def switch_directories(self, servers=None):
         """
         Permute les répertoires C{prod -> old} et C{new -> prod}, avec un
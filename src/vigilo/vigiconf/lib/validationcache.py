@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Cache des validations locales des configurations générées.
+
+Une validation réussie est enregistrée sous une clé calculée à partir de
+l'empreinte de la configuration de l'application (voir L{Manifest}) et du
+script de validation. Une configuration identique, qu'elle ait été générée
+pour un autre serveur ou lors d'un déploiement précédent, n'est donc validée
+qu'une seule fois. Seuls les succès sont enregistrés.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import hashlib
+from threading import Lock
+
+from vigilo.common.conf import settings
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+__all__ = ("ValidationCache", )
+
+
+class ValidationCache(object):
+    """
+    Cache des validations réussies, sous la forme d'un fichier par clé
+    dans le dossier C{validation-cache} du dossier C{libdir}.
+
+    @cvar max_entries: nombre maximum d'entrées conservées, les moins
+        récemment utilisées étant supprimées au-delà.
+    @type max_entries: C{int}
+    """
+
+    max_entries = 1000
+
+    _locks = {}
+    _locks_lock = Lock()
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(settings["vigiconf"].get("libdir"),
+                                     "validation-cache")
+        self.directory = directory
+
+    @staticmethod
+    def enabled():
+        """
+        @return: le cache est activé (option C{validation_cache}).
+        @rtype: C{bool}
+        """
+        try:
+            return settings["vigiconf"].as_bool("validation_cache")
+        except KeyError:
+            return False
+
+    @staticmethod
+    def key(appname, app_hash, script):
+        """
+        @param appname: nom de l'application.
+        @type  appname: C{str}
+        @param app_hash: empreinte de la configuration de l'application.
+        @type  app_hash: C{str}
+        @param script: contenu du script de validation.
+        @type  script: C{str}
+        @return: clé de la validation.
+        @rtype: C{str}
+        """
+        md5 = hashlib.md5()
+        md5.update(appname.encode("utf-8"))
+        md5.update("\0%s\0" % app_hash)
+        md5.update(script)
+        return md5.hexdigest()
+
+    def lock(self, key):
+        """
+        @return: verrou propre à une clé, pour qu'une même configuration
+            ne soit pas validée simultanément par plusieurs threads.
+        @rtype: C{threading.Lock}
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(key, Lock())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def has(self, key):
+        """
+        @return: une validation réussie est enregistrée pour cette clé.
+        @rtype: C{bool}
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return True
+
+    def add(self, key, description=""):
+        """
+        Enregistre une validation réussie.
+        @param description: informations sur la validation (application,
+            serveur), pour le débogage.
+        @type  description: C{str}
+        """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # créé entre-temps par un autre thread
+                if not os.path.isdir(self.directory):
+                    raise
+        tmpname = "%s.tmp" % self._path(key)
+        entry = open(tmpname, "w")
+        try:
+            entry.write("%s %s\n" % (int(time.time()), description))
+        finally:
+            entry.close()
+        os.rename(tmpname, self._path(key))
+
+    def prune(self):
+        """Supprime les entrées les moins récemment utilisées."""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(reverse=True)
+        for _mtime, path in entries[self.max_entries:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        LOGGER.debug("Pruned %d entries from the validation cache",
+                     len(entries) - self.max_entries)
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -19,11 +19,14 @@ _ = translate(__name__)
 from vigilo.models.session import DBSession
 from vigilo.models import tables
 
+from .ventilation import VentilationIndex
+from .capacity import CapacityReport
+
 class Validator(object):
     """
     Used by the generators to validate the configuration.
     @ivar ventilation: the ventilation mapping
-    @type ventilation: C{dict}, see the
+    @type ventilation: L{VentilationIndex} or C{dict}, see the
         L{vigilo.vigiconf.lib.ventilation.Ventilator.ventilate}() method
     @ivar _warnings: the list of warnings
     @type _warnings: C{list}
@@ -92,18 +95,17 @@ class Validator(object):
         @return: The result of validation
         @rtype: C{boolean}
         """
+        if not isinstance(self.ventilation, VentilationIndex):
+            self.ventilation = VentilationIndex(self.ventilation)
         self._stats["nbHosts"] = len(conf.hostsConf)
-        apps = set()
-        servers = set()
-        for hostVentilation in self.ventilation.values():
-            for (app, vservers) in hostVentilation.iteritems():
-                apps.add(app)
-                servers.update(set(vservers))
+        apps = set(self.ventilation.apps())
+        servers = self.ventilation.servers()
         self._stats["nbServers"] = len(servers)
         self._stats["nbApps"] = len(apps)
         if not onlydb:
             self.prevalidate_hosts()
             self.prevalidate_services()
+            self.prevalidate_capacity()
         self.prevalidate_applications()
         self.prevalidate_ventilation(apps)
         if len(servers) == 0:
@@ -156,6 +158,28 @@ class Validator(object):
             LOGGER.debug("Services: difference between conf and DB: %s",
                          ", ".join(set(svc_db_detail) ^ set(svc_conf_detail)))
 
+    def prevalidate_capacity(self):
+        """
+        Estime la charge de chaque serveur Vigilo et la compare aux seuils
+        définis dans C{capacityLimits}.
+        """
+        report = CapacityReport(self.ventilation)
+        report.compute()
+        for line in report.format():
+            LOGGER.debug(line)
+        for level, server, appname, metric, value, limit in report.check():
+            msg = _("Estimated %(metric)s for %(app)s on this server: "
+                    "%(value)d (limit: %(limit)d)") % {
+                        "metric": metric,
+                        "app": appname,
+                        "value": value,
+                        "limit": limit,
+                    }
+            if level == "error":
+                self.addError("Capacity", server, msg)
+            else:
+                self.addWarning("Capacity", server, msg)
+
     def prevalidate_applications(self):
         apps_db = DBSession.query(tables.Application).count()
         if apps_db != self._stats["nbApps"]:
@@ -167,10 +191,7 @@ class Validator(object):
                 % {"db": apps_db, "deploy": self._stats["nbApps"]})
             apps_db = set([a.name for a in
                            DBSession.query(tables.Application).all()])
-            apps_conf = set()
-            for hostVentilation in self.ventilation.values():
-                for app in hostVentilation:
-                    apps_conf.add(app.name)
+            apps_conf = set(self.ventilation.apps())
             LOGGER.debug("Applications: difference between conf and DB: %s",
                          " ".join(apps_db ^ apps_conf))
 
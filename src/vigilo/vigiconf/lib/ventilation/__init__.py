@@ -9,9 +9,12 @@ from __future__ import absolute_import
 
 from pkg_resources import working_set
 
+from vigilo.common.conf import settings
+
 from vigilo.vigiconf import conf
+from .index import VentilationIndex
 
-__all__ = ("Ventilator", "get_ventilator")
+__all__ = ("Ventilator", "VentilationIndex", "get_ventilator")
 
 
 class Ventilator(object):
@@ -24,29 +27,27 @@ class Ventilator(object):
         raise NotImplementedError
 
     def ventilation_by_appname(self, ventilation): # pylint: disable-msg=R0201
-        vba = {}
-        for host in ventilation:
-            vba[host] = {}
-            for app, vserver in ventilation[host].iteritems():
-                vba[host][app.name] = vserver
-        return vba
+        """
+        @return: l'index de la ventilation, qui se comporte comme
+            un dictionnaire hôte -> {nom de l'application -> serveur(s)}.
+        @rtype: L{VentilationIndex}
+        """
+        if isinstance(ventilation, VentilationIndex):
+            return ventilation
+        return VentilationIndex(ventilation)
 
     def servers_for_app(self, ventilation, app): # pylint: disable-msg=R0201
-        servers = set()
-        for host in ventilation:
-            if app not in ventilation[host]:
-                continue
-            vsrvs = ventilation[host][app]
-            if isinstance(vsrvs, basestring):
-                vsrv = vsrvs
-            else:
-                vsrv = vsrvs[0]
-            servers.add(vsrv)
-        return servers
+        return self.ventilation_by_appname(ventilation).servers_for_app(app)
 
 
-def get_ventilator(apps):
-    """Ventilation factory"""
+def _get_base_ventilator(apps):
+    try:
+        weighted = settings["vigiconf"].as_bool("weighted_ventilation")
+    except KeyError:
+        weighted = False
+    if weighted:
+        from .weighted import WeightedVentilator
+        return WeightedVentilator(apps)
     if getattr(conf, "appsGroupsByServer", None):
         for entry in working_set.iter_entry_points(
                         "vigilo.vigiconf.extensions", "ventilator"):
@@ -56,3 +57,24 @@ def get_ventilator(apps):
     from .local import VentilatorLocal
     return VentilatorLocal(apps)
 
+def get_ventilator(apps):
+    """
+    Ventilation factory
+
+    With the C{weighted_ventilation} option, the hosts are spread according
+    to their estimated load by a
+    L{WeightedVentilator<vigilo.vigiconf.lib.ventilation.weighted.WeightedVentilator>}.
+    With the C{sticky_ventilation} option, the ventilator is wrapped in a
+    L{StickyVentilator<vigilo.vigiconf.lib.ventilation.sticky.StickyVentilator>}
+    which keeps the hosts on their previous servers.
+    """
+    ventilator = _get_base_ventilator(apps)
+    try:
+        sticky = settings["vigiconf"].as_bool("sticky_ventilation")
+    except KeyError:
+        sticky = False
+    if sticky:
+        from .sticky import StickyVentilator
+        return StickyVentilator(apps, ventilator)
+    return ventilator
+
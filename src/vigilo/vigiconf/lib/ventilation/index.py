@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Index de la ventilation des hôtes sur les serveurs Vigilo
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+
+__all__ = ("VentilationIndex", )
+
+
+class VentilationIndex(object):
+    """
+    Index de la ventilation, partagé par les générateurs, les chargeurs et
+    le validateur.
+
+    Les affectations sont stockées par application, sous forme de tuples
+    de serveurs (serveur nominal en premier, puis serveurs de secours),
+    ces tuples étant partagés entre les hôtes ayant la même affectation.
+    Des index inverses permettent de répondre directement aux questions
+    « quels serveurs pour cette application ? » et « quels hôtes pour cette
+    application sur ce serveur ? ».
+
+    Pour la compatibilité, l'index se comporte comme le dictionnaire
+    retourné par L{Ventilator.ventilation_by_appname
+    <vigilo.vigiconf.lib.ventilation.Ventilator.ventilation_by_appname>} :
+    C{index[hostname][appname]} retourne le nom du serveur, ou la liste
+    des serveurs s'il y en a plusieurs.
+    """
+
+    def __init__(self, ventilation=None):
+        """
+        @param ventilation: ventilation à indexer, voir la méthode
+            L{vigilo.vigiconf.lib.ventilation.Ventilator.ventilate}().
+            Les applications peuvent être données par leur instance
+            ou par leur nom.
+        @type  ventilation: C{dict}
+        """
+        # nom de l'application -> {nom de l'hôte -> tuple de serveurs}
+        self._by_app = {}
+        # nom de l'application -> {nom du serveur -> noms des hôtes}
+        self._by_server = {}
+        # nom de l'application -> {serveur nominal -> nombre d'hôtes}
+        self._nominal = {}
+        # nom de l'hôte -> noms des applications
+        self._hosts = {}
+        self._apps = {}
+        self._interned = {}
+        if ventilation is not None:
+            for hostname, servers_by_app in ventilation.iteritems():
+                for app, servers in servers_by_app.iteritems():
+                    self.assign(hostname, app, servers)
+
+    def _intern(self, servers):
+        if isinstance(servers, basestring):
+            servers = (servers, )
+        else:
+            servers = tuple(servers)
+        return self._interned.setdefault(servers, servers)
+
+    def assign(self, hostname, app, servers):
+        """
+        Affecte un hôte à un ou plusieurs serveurs pour une application.
+        @param hostname: nom de l'hôte.
+        @type  hostname: C{str}
+        @param app: application ou nom de l'application.
+        @type  app: L{Application<lib.application.Application>} ou C{str}
+        @param servers: serveur ou liste de serveurs (nominal en premier).
+        @type  servers: C{str} ou C{list}
+        """
+        appname = getattr(app, "name", app)
+        if appname not in self._apps or not isinstance(app, basestring):
+            self._apps[appname] = app
+        servers = self._intern(servers)
+        if not servers:
+            return
+        self.unassign(hostname, appname)
+        self._by_app.setdefault(appname, {})[hostname] = servers
+        by_server = self._by_server.setdefault(appname, {})
+        for server in servers:
+            by_server.setdefault(server, set()).add(hostname)
+        nominal = self._nominal.setdefault(appname, {})
+        nominal[servers[0]] = nominal.get(servers[0], 0) + 1
+        self._hosts.setdefault(hostname, set()).add(appname)
+
+    def unassign(self, hostname, app):
+        """
+        Retire l'affectation d'un hôte pour une application.
+        @param hostname: nom de l'hôte.
+        @type  hostname: C{str}
+        @param app: application ou nom de l'application.
+        @type  app: L{Application<lib.application.Application>} ou C{str}
+        """
+        appname = getattr(app, "name", app)
+        servers = self._by_app.get(appname, {}).pop(hostname, None)
+        if servers is None:
+            return
+        by_server = self._by_server[appname]
+        for server in servers:
+            by_server[server].discard(hostname)
+            if not by_server[server]:
+                del by_server[server]
+        nominal = self._nominal[appname]
+        nominal[servers[0]] -= 1
+        if not nominal[servers[0]]:
+            del nominal[servers[0]]
+        self._hosts[hostname].discard(appname)
+        if not self._hosts[hostname]:
+            del self._hosts[hostname]
+
+    # Requêtes
+
+    def apps(self):
+        """
+        @return: noms des applications ventilées.
+        @rtype: C{list}
+        """
+        return [ a for a in self._by_app if self._by_app[a] ]
+
+    def app(self, appname):
+        """
+        @return: l'instance de l'application si elle est connue,
+            sinon son nom.
+        """
+        return self._apps.get(appname, appname)
+
+    def servers(self):
+        """
+        @return: ensemble de tous les serveurs utilisés
+            (nominaux et de secours).
+        @rtype: C{set}
+        """
+        servers = set()
+        for by_server in self._by_server.itervalues():
+            servers.update(by_server)
+        return servers
+
+    def servers_for_app(self, app, backups=False):
+        """
+        @param app: application ou nom de l'application.
+        @param backups: inclure les serveurs de secours.
+        @type  backups: C{bool}
+        @return: ensemble des serveurs de l'application.
+        @rtype: C{set}
+        """
+        appname = getattr(app, "name", app)
+        if backups:
+            return set(self._by_server.get(appname, ()))
+        return set(self._nominal.get(appname, ()))
+
+    def hosts_for(self, app, server):
+        """
+        @param app: application ou nom de l'application.
+        @param server: nom du serveur.
+        @return: ensemble des hôtes affectés à ce serveur (en nominal ou
+            en secours) pour l'application.
+        @rtype: C{set}
+        """
+        appname = getattr(app, "name", app)
+        return set(self._by_server.get(appname, {}).get(server, ()))
+
+    def servers_for(self, hostname, app):
+        """
+        @return: tuple des serveurs de l'hôte pour l'application,
+            serveur nominal en premier (vide si l'hôte n'est pas ventilé).
+        @rtype: C{tuple}
+        """
+        appname = getattr(app, "name", app)
+        return self._by_app.get(appname, {}).get(hostname, ())
+
+    def server_for(self, hostname, app):
+        """
+        @return: serveur nominal de l'hôte pour l'application, ou C{None}.
+        @rtype: C{str}
+        """
+        servers = self.servers_for(hostname, app)
+        if not servers:
+            return None
+        return servers[0]
+
+    def assignments(self, app):
+        """
+        Itère sur les affectations d'une application.
+        @return: couples (nom de l'hôte, tuple des serveurs).
+        @rtype: C{iterator}
+        """
+        appname = getattr(app, "name", app)
+        return self._by_app.get(appname, {}).iteritems()
+
+    def iter_assignments(self):
+        """
+        Itère sur toutes les affectations.
+        @return: triplets (nom de l'hôte, nom de l'application,
+            tuple des serveurs).
+        @rtype: C{iterator}
+        """
+        for appname, hosts in self._by_app.iteritems():
+            for hostname, servers in hosts.iteritems():
+                yield (hostname, appname, servers)
+
+    def fingerprint(self):
+        """
+        @return: empreinte de l'ensemble des affectations, indépendante de
+            l'ordre dans lequel elles ont été faites.
+        @rtype: C{str}
+        """
+        md5 = hashlib.md5()
+        for hostname, appname, servers in sorted(self.iter_assignments()):
+            line = u"%s\0%s\0%s\n" % (hostname, appname, u"\0".join(servers))
+            md5.update(line.encode("utf-8"))
+        return md5.hexdigest()
+
+    # Compatibilité avec le dictionnaire hôte -> {application -> serveurs}
+
+    def __getitem__(self, hostname):
+        result = {}
+        for appname in self._hosts[hostname]:
+            servers = self._by_app[appname][hostname]
+            if len(servers) == 1:
+                result[appname] = servers[0]
+            else:
+                result[appname] = list(servers)
+        return result
+
+    def get(self, hostname, default=None):
+        if hostname not in self._hosts:
+            return default
+        return self[hostname]
+
+    def __contains__(self, hostname):
+        return hostname in self._hosts
+
+    def __iter__(self):
+        return iter(self._hosts)
+
+    def __len__(self):
+        return len(self._hosts)
+
+    def keys(self):
+        return self._hosts.keys()
+
+    def iterkeys(self):
+        return self._hosts.iterkeys()
+
+    def values(self):
+        return [ self[h] for h in self._hosts ]
+
+    def items(self):
+        return [ (h, self[h]) for h in self._hosts ]
+
+    def iteritems(self):
+        for hostname in self._hosts:
+            yield (hostname, self[hostname])
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Ventilation incrémentale (« collante »).
+
+Les hôtes déjà ventilés restent sur leur serveur Vigilo d'après la
+ventilation enregistrée en base lors du déploiement précédent. Seuls les
+nouveaux hôtes et ceux dont le serveur n'est plus utilisable (retiré de la
+configuration ou désactivé) sont placés, sur le serveur le moins chargé.
+Un rééquilibrage n'a lieu que lorsqu'un serveur est ajouté ou qu'un serveur
+dépasse le seuil de surcharge.
+"""
+
+from __future__ import absolute_import
+
+from vigilo.common.conf import settings
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from vigilo.models.session import DBSession
+from vigilo.models.tables import Host, Application, Ventilation, VigiloServer
+
+from vigilo.vigiconf import conf
+from . import Ventilator
+from .index import VentilationIndex
+from .weighted import host_cost
+
+__all__ = ("StickyVentilator", )
+
+
+class StickyVentilator(Ventilator):
+    """
+    Ventilateur conservant la ventilation précédente.
+
+    La ventilation calculée par le ventilateur sous-jacent sert à
+    déterminer, pour chaque hôte, l'ensemble des serveurs utilisables
+    (le I{pool}) et les serveurs de secours. Les applications d'un même
+    groupe logique (voir L{Application.group
+    <vigilo.vigiconf.lib.application.Application>}) sont ventilées ensemble.
+
+    @ivar moves: hôtes ayant changé de serveur nominal, sous la forme
+        (hôte, groupe, ancien serveur, nouveau serveur).
+    @type moves: C{list}
+    @ivar placed: nombre d'hôtes nouvellement placés.
+    @type placed: C{int}
+    """
+
+    def __init__(self, apps, ventilator, overload_ratio=None):
+        """
+        @param apps: applications à ventiler.
+        @type  apps: C{list}
+        @param ventilator: ventilateur sous-jacent.
+        @type  ventilator: L{Ventilator}
+        @param overload_ratio: rapport entre la charge d'un serveur et la
+            charge moyenne de son I{pool} au-delà duquel le I{pool} est
+            rééquilibré. Lu dans l'option C{ventilation_overload_ratio}
+            si absent.
+        @type  overload_ratio: C{float}
+        """
+        super(StickyVentilator, self).__init__(apps)
+        self.ventilator = ventilator
+        if overload_ratio is None:
+            try:
+                overload_ratio = settings["vigiconf"].as_float(
+                                    "ventilation_overload_ratio")
+            except KeyError:
+                overload_ratio = 1.5
+        self.overload_ratio = overload_ratio
+        self.moves = []
+        self.placed = 0
+        self._costs = {}
+
+    def load_previous(self):
+        """
+        @return: ventilation enregistrée en base, sous la forme
+            {(nom de l'hôte, nom de l'application): nom du serveur}.
+        @rtype: C{dict}
+        """
+        previous = {}
+        entries = DBSession.query(
+                Host.name, Application.name, VigiloServer.name,
+            ).join(
+                (Ventilation, Ventilation.idhost == Host.idhost),
+                (Application, Application.idapp == Ventilation.idapp),
+                (VigiloServer, VigiloServer.idvigiloserver ==
+                    Ventilation.idvigiloserver),
+            ).all()
+        for hostname, appname, servername in entries:
+            previous[(hostname, appname)] = servername
+        return previous
+
+    def load_disabled(self): # pylint: disable-msg=R0201
+        """
+        @return: noms des serveurs Vigilo désactivés.
+        @rtype: C{set}
+        """
+        return set([ s.name for s in DBSession.query(VigiloServer.name
+                        ).filter(VigiloServer.disabled == True).all() ])
+
+    def host_cost(self, hostname):
+        """
+        @return: charge représentée par un hôte, voir
+            L{vigilo.vigiconf.lib.ventilation.weighted.host_cost}.
+        @rtype: C{float}
+        """
+        if hostname not in self._costs:
+            self._costs[hostname] = host_cost(conf.hostsConf.get(hostname, {}))
+        return self._costs[hostname]
+
+    def _pools(self, fresh, groups, disabled):
+        """
+        Détermine les serveurs utilisables pour chaque hôte.
+        @return: {(groupe, hôte): (clé du pool, serveurs du pool,
+            tuple des serveurs calculés par le ventilateur sous-jacent)}
+        """
+        by_servergroup = {}
+        candidates = {}
+        for group, apps in groups.iteritems():
+            for hostname, servers in fresh.assignments(apps[0]):
+                servergroup = conf.hostsConf.get(hostname, {}).get(
+                                "serverGroup")
+                configured = getattr(conf, "appsGroupsByServer", {}).get(
+                                group, {}).get(servergroup)
+                key = (group, servergroup)
+                if configured:
+                    by_servergroup[key] = set(configured)
+                else:
+                    by_servergroup.setdefault(key, set()).add(servers[0])
+                candidates[(group, hostname)] = (key, servers)
+        result = {}
+        for (group, hostname), (key, servers) in candidates.iteritems():
+            pool = by_servergroup[key] - disabled
+            if not pool:
+                pool = set([servers[0]])
+            result[(group, hostname)] = (key, frozenset(pool), servers)
+        return result
+
+    def ventilate(self):
+        fresh = self.ventilator.ventilate()
+        if not isinstance(fresh, VentilationIndex):
+            fresh = VentilationIndex(fresh)
+        previous = self.load_previous()
+        disabled = self.load_disabled()
+        self.moves = []
+        self.placed = 0
+
+        # Applications regroupées par groupe logique.
+        groups = {}
+        for app in self.apps:
+            groups.setdefault(app.group or app.name, []).append(app)
+        for apps in groups.itervalues():
+            apps.sort(key=lambda a: a.name)
+
+        pools = self._pools(fresh, groups, disabled)
+        # Serveur nominal retenu pour chaque (groupe, hôte)
+        nominal = {}
+        # Ancien serveur nominal de chaque (groupe, hôte)
+        old = {}
+        # (groupe, clé du pool) -> {serveur -> charge}
+        loads = {}
+        # (groupe, clé du pool) -> ensemble des serveurs utilisés auparavant
+        used_before = {}
+        to_place = []
+        for (group, hostname), (key, pool, servers) in pools.iteritems():
+            load = loads.setdefault(key, {})
+            for server in pool:
+                load.setdefault(server, 0)
+            prev = None
+            for app in groups[group]:
+                prev = previous.get((hostname, app.name))
+                if prev is not None:
+                    break
+            if prev is not None:
+                old[(group, hostname)] = prev
+                used_before.setdefault(key, set()).add(prev)
+            if prev in pool:
+                nominal[(group, hostname)] = prev
+                load[prev] += self.host_cost(hostname)
+            else:
+                to_place.append((group, hostname))
+
+        # Placement des nouveaux hôtes (et de ceux dont le serveur a
+        # disparu), les plus coûteux en premier.
+        to_place.sort(key=lambda gh: (-self.host_cost(gh[1]), gh))
+        for group, hostname in to_place:
+            key, pool = pools[(group, hostname)][:2]
+            load = loads[key]
+            server = min(pool, key=lambda s: (load[s], s))
+            nominal[(group, hostname)] = server
+            load[server] += self.host_cost(hostname)
+
+        # Rééquilibrage des pools ayant un nouveau serveur ou
+        # un serveur surchargé.
+        members = {}
+        for (group, hostname), (key, pool, servers) in pools.iteritems():
+            members.setdefault(key, []).append((group, hostname))
+        for key, load in loads.iteritems():
+            added = used_before.get(key) and \
+                    set(load) - used_before[key]
+            self._rebalance(key, load, members[key], nominal,
+                            added and 1.0 or self.overload_ratio)
+
+        # Construction de la ventilation finale.
+        result = VentilationIndex()
+        for (group, hostname), (key, pool, servers) in pools.iteritems():
+            server = nominal[(group, hostname)]
+            # Le serveur nominal calculé par le ventilateur sous-jacent
+            # reste un secours si l'hôte est maintenu sur un autre serveur.
+            backups = [ s for s in servers if s != server ]
+            for app in groups[group]:
+                if fresh.servers_for(hostname, app):
+                    result.assign(hostname, app, [server] + backups)
+            prev = old.get((group, hostname))
+            if prev is None:
+                self.placed += 1
+            elif prev != server:
+                self.moves.append((hostname, group, prev, server))
+
+        self.moves.sort()
+        for hostname, group, prev, server in self.moves:
+            LOGGER.debug("Ventilation: %s (%s) moved from %s to %s",
+                         hostname, group, prev, server)
+        LOGGER.info(_("Ventilation: %(moved)d host(s) moved, "
+                      "%(placed)d new host(s) placed"),
+                    {"moved": len(self.moves), "placed": self.placed})
+        return result
+
+    def _rebalance(self, key, load, members, nominal, ratio):
+        """
+        Déplace des hôtes du serveur le plus chargé vers le moins chargé
+        du pool tant qu'un serveur dépasse le seuil de surcharge (ou reste
+        en deçà du seuil inverse) et que le déplacement réduit l'écart.
+        """
+        if len(load) < 2:
+            return
+        hosts_by_server = {}
+        for group, hostname in members:
+            hosts_by_server.setdefault(nominal[(group, hostname)], []
+                                       ).append((group, hostname))
+        average = float(sum(load.values())) / len(load)
+        while True:
+            busiest = max(load, key=lambda s: (load[s], s))
+            idlest = min(load, key=lambda s: (load[s], s))
+            if load[busiest] <= average * ratio and \
+                    load[idlest] * ratio >= average:
+                break
+            gap = load[busiest] - load[idlest]
+            # Hôte le plus coûteux dont le déplacement réduit l'écart.
+            movable = [ (self.host_cost(gh[1]), gh)
+                        for gh in hosts_by_server.get(busiest, [])
+                        if self.host_cost(gh[1]) < gap ]
+            if not movable:
+                break
+            cost, member = max(movable)
+            hosts_by_server[busiest].remove(member)
+            hosts_by_server.setdefault(idlest, []).append(member)
+            nominal[member] = idlest
+            load[busiest] -= cost
+            load[idlest] += cost
+            LOGGER.debug("Ventilation: rebalancing %s from %s to %s",
+                         member[1], busiest, idlest)
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2007-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Ventilation pondérée par la charge des hôtes.
+
+Chaque hôte se voit attribuer un coût estimé à partir de sa configuration
+(services actifs et passifs, requêtes SNMP du Collector, sources de données
+de métrologie), pondéré par la fréquence de ses vérifications. Les hôtes
+sont ensuite répartis sur les serveurs de leur groupe de ventilation
+(C{appsGroupsByServer}) en plaçant les plus coûteux en premier sur le
+serveur le moins chargé. Les serveurs désactivés ne reçoivent aucun hôte.
+"""
+
+from __future__ import absolute_import
+
+from vigilo.common.logging import get_logger
+LOGGER = get_logger(__name__)
+
+from vigilo.common.gettext import translate
+_ = translate(__name__)
+
+from vigilo.models.session import DBSession
+from vigilo.models.tables import VigiloServer
+
+from vigilo.vigiconf import conf
+from . import Ventilator
+from .index import VentilationIndex
+
+__all__ = ("WeightedVentilator", "host_cost")
+
+
+# Intervalle de vérification (en minutes) correspondant au coût unitaire.
+DEFAULT_CHECK_INTERVAL = 5.0
+
+# Coût de chaque élément de la configuration d'un hôte.
+COSTS = {
+    "host": 1.0,        # vérification de l'état de l'hôte
+    "active": 1.0,      # service actif, exécuté par Nagios
+    "passive": 0.1,     # service passif, simple réception d'un résultat
+    "SNMPJobs": 0.5,    # requête SNMP du Collector
+    "dataSources": 0.2, # mise à jour d'une base RRD
+}
+
+
+def _frequency(host, service=None):
+    """
+    @return: fréquence des vérifications d'un service (ou de l'hôte),
+        relativement à L{DEFAULT_CHECK_INTERVAL}.
+    @rtype: C{float}
+    """
+    directives = host.get("nagiosDirectives", {})
+    if service is None:
+        interval = directives.get("host", {}).get("check_interval")
+    else:
+        interval = host.get("nagiosSrvDirs", {}).get(service, {}).get(
+                        "check_interval",
+                        directives.get("services", {}).get("check_interval"))
+    try:
+        interval = float(interval)
+    except (TypeError, ValueError):
+        return 1.0
+    if interval <= 0:
+        return 1.0
+    return DEFAULT_CHECK_INTERVAL / interval
+
+def host_cost(host):
+    """
+    Estime la charge de supervision représentée par un hôte.
+    @param host: configuration de l'hôte (entrée de C{conf.hostsConf}).
+    @type  host: C{dict}
+    @return: coût de l'hôte (au moins L{COSTS}C{["host"]}).
+    @rtype: C{float}
+    """
+    cost = COSTS["host"] * _frequency(host)
+    for service, definition in host.get("services", {}).iteritems():
+        if definition.get("type") == "active":
+            cost += COSTS["active"] * _frequency(host, service)
+        else:
+            cost += COSTS["passive"]
+    # Les requêtes SNMP sont envoyées à chaque exécution du Collector.
+    cost += COSTS["SNMPJobs"] * len(host.get("SNMPJobs", {})) * \
+            _frequency(host, "Collector")
+    cost += COSTS["dataSources"] * len(host.get("dataSources", {}))
+    return cost
+
+
+class WeightedVentilator(Ventilator):
+    """
+    Ventilateur équilibrant la charge des serveurs Vigilo.
+
+    Les applications d'un même groupe logique (voir L{Application.group
+    <vigilo.vigiconf.lib.application.Application>}) sont ventilées ensemble
+    et la charge est comptabilisée par groupe : un serveur présent dans
+    plusieurs groupes de serveurs voit sa charge totale prise en compte.
+
+    @ivar loads: charge de chaque serveur, par groupe logique
+        d'applications, après la ventilation.
+    @type loads: C{dict}
+    """
+
+    def __init__(self, apps):
+        super(WeightedVentilator, self).__init__(apps)
+        self.loads = {}
+
+    def load_disabled(self): # pylint: disable-msg=R0201
+        """
+        @return: noms des serveurs Vigilo désactivés.
+        @rtype: C{set}
+        """
+        return set([ s.name for s in DBSession.query(VigiloServer.name
+                        ).filter(VigiloServer.disabled == True).all() ])
+
+    def candidates(self, group, hostname, disabled=()):
+        """
+        @param disabled: noms des serveurs désactivés, exclus des
+            candidats. Si tous les serveurs nominaux sont désactivés, le
+            premier serveur de secours actif les remplace.
+        @type  disabled: C{set}
+        @return: serveurs pouvant accueillir l'hôte pour un groupe
+            logique d'applications, et serveurs de secours.
+        @rtype: C{tuple} de deux C{list}
+        """
+        by_server = getattr(conf, "appsGroupsByServer", None)
+        if not by_server:
+            # Community Edition
+            return (["localhost"], [])
+        servergroup = conf.hostsConf[hostname].get("serverGroup")
+        servers = by_server.get(group, {}).get(servergroup)
+        if not servers:
+            # Groupe de serveurs non configuré pour ce groupe
+            # d'applications : tous les serveurs du groupe conviennent.
+            servers = set()
+            for group_servers in by_server.get(group, {}).itervalues():
+                servers.update(group_servers)
+            servers = sorted(servers)
+        backups = getattr(conf, "appsGroupsBackup", {}).get(group, {}).get(
+                        servergroup, [])
+        servers = [ s for s in servers if s not in disabled ]
+        backups = [ b for b in backups if b not in disabled ]
+        if not servers and backups:
+            servers = backups[:1]
+            backups = backups[1:]
+        return (servers, backups)
+
+    def ventilate(self):
+        groups = {}
+        for app in self.apps:
+            groups.setdefault(app.group or app.name, []).append(app)
+        costs = {}
+        for hostname, host in conf.hostsConf.iteritems():
+            costs[hostname] = host_cost(host)
+        # Les hôtes les plus coûteux sont placés en premier
+        # (algorithme LPT, « longest processing time »).
+        ordered = sorted(costs, key=lambda h: (-costs[h], h))
+
+        disabled = self.load_disabled()
+        result = VentilationIndex()
+        self.loads = {}
+        for group, apps in groups.iteritems():
+            load = self.loads.setdefault(group, {})
+            for hostname in ordered:
+                servers, backups = self.candidates(group, hostname,
+                                                   disabled)
+                if not servers:
+                    LOGGER.warning(_("No Vigilo server available for "
+                                     "host %(host)s and application "
+                                     "group %(group)s"),
+                                   {"host": hostname, "group": group})
+                    continue
+                server = min(servers, key=lambda s: (load.get(s, 0), s))
+                load[server] = load.get(server, 0) + costs[hostname]
+                backups = [ b for b in backups if b != server ]
+                for app in apps:
+                    result.assign(hostname, app, [server] + backups)
+        for group, load in self.loads.iteritems():
+            for server in sorted(load):
+                LOGGER.debug("Ventilation: estimated load of %s for %s: %.1f",
+                             server, group, load[server])
+        return result
+
+# vim:set expandtab tabstop=4 shiftwidth=4:
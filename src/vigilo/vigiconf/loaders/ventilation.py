@@ -13,6 +13,7 @@ from vigilo.models.session import DBSession
 from vigilo.models.tables import Host, Application, Ventilation, VigiloServer
 
 from vigilo.vigiconf.lib.loaders import DBLoader
+from vigilo.vigiconf.lib.ventilation import VentilationIndex
 
 __docformat__ = "epytext"
 
@@ -27,8 +28,9 @@ class VentilationLoader(DBLoader):
     def __init__(self, ventilation, applications):
         """
         @param ventilation: dictionnaire généré par le
-            L{ventilator<vigilo.vigiconf.lib.ventilator.Ventilator>}
-        @type  ventilation: C{dict}
+            L{ventilator<vigilo.vigiconf.lib.ventilator.Ventilator>},
+            ou son index
+        @type  ventilation: C{dict} ou L{VentilationIndex}
         @param applications: les applications gérées par le
             L{dispatchator<vigilo.vigiconf.lib.dispatchator>}
         @type  applications: C{list}
@@ -46,6 +48,8 @@ class VentilationLoader(DBLoader):
           }
         """
         super(VentilationLoader, self).__init__(Ventilation)
+        if not isinstance(ventilation, VentilationIndex):
+            ventilation = VentilationIndex(ventilation)
         self.ventilation = ventilation
         self.applications = applications
 
@@ -74,11 +78,18 @@ class VentilationLoader(DBLoader):
             applications[application.name] = application
             applications[application.idapp] = application
 
+        # Identifiants de tous les hôtes, récupérés en une seule requête.
+        hosts = dict(DBSession.query(Host.name, Host.idhost).all())
+
         new_apps_location = {}
-        for hostname, serversbyapp in self.ventilation.iteritems():
-            idhost = DBSession.query(Host.idhost).filter(
-                Host.name == unicode(hostname)).scalar()
+        missing = set()
+        for hostname, appname, servernames in \
+                self.ventilation.iter_assignments():
+            idhost = hosts.get(unicode(hostname))
             if idhost is None:
+                if hostname in missing:
+                    continue
+                missing.add(hostname)
                 # on continue sans erreur pour être cohérent avec le
                 # comportement du chargeur d'hôtes en cas de problème dans les
                 # groupes (l.155)
@@ -88,24 +99,21 @@ class VentilationLoader(DBLoader):
                                  "the host %s is not in database yet"),
                                hostname)
                 continue
-            for app_obj, servernames in serversbyapp.iteritems():
-                if isinstance(servernames, basestring):
-                    servernames = [servernames, ]
-                # on ne met en base que le serveur nominal
-                servername = servernames[0]
-                vigiloserver = vigiloservers[unicode(servername)]
-                application =  applications[unicode(app_obj.name)]
-                key = (idhost, vigiloserver.idvigiloserver,
-                       application.idapp)
-                if key in current:
-                    del current[key]
-                else:
-                    v = Ventilation(idhost=idhost,
-                                idvigiloserver=vigiloserver.idvigiloserver,
-                                idapp=application.idapp)
-                    DBSession.add(v)
-                new_apps_location.setdefault(application.idapp, set()
-                                        ).add(vigiloserver.idvigiloserver)
+            # on ne met en base que le serveur nominal
+            servername = servernames[0]
+            vigiloserver = vigiloservers[unicode(servername)]
+            application =  applications[unicode(appname)]
+            key = (idhost, vigiloserver.idvigiloserver,
+                   application.idapp)
+            if key in current:
+                del current[key]
+            else:
+                v = Ventilation(idhost=idhost,
+                            idvigiloserver=vigiloserver.idvigiloserver,
+                            idapp=application.idapp)
+                DBSession.add(v)
+            new_apps_location.setdefault(application.idapp, set()
+                                    ).add(vigiloserver.idvigiloserver)
         #DBSession.flush()
         # et maintenant on supprime ce qui reste
         LOGGER.debug("Obsolete ventilation entries: %d" % len(current))
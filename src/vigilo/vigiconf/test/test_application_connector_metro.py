@@ -13,9 +13,13 @@ import shutil
 import unittest
 import sqlite3
 
+from mock import patch
+
+from vigilo.common.conf import settings
 from vigilo.vigiconf.applications.connector_metro import ConnectorMetro
 import vigilo.vigiconf.conf as conf
 from vigilo.vigiconf.lib.confclasses.host import Host
+from vigilo.vigiconf.lib.generators.sqlitedb import SQLiteGenerator
 
 from .helpers import setup_tmpdir
 
@@ -76,3 +80,96 @@ class ConnectorMetroTest(unittest.TestCase):
             (1, 3, 2),
             (1, 4, 3),
             ])
+
+    def test_shared_rras(self):
+        """Les définitions de RRA identiques sont partagées"""
+        self.host.add_perfdata("dummy2", "dummy")
+        self.host.add_perfdata("dummy3", "dummy", rra_template="discrete")
+        app = ConnectorMetro()
+        ventilation = {"testserver1":
+                {"connector-metro": "localhost"}
+            }
+        app.generate(ventilation)
+        db_path = os.path.join(self.basedir, "localhost",
+                               "connector-metro.db")
+        db = sqlite3.connect(db_path)
+        cur = db.cursor()
+        cur.execute("SELECT * FROM rra")
+        rra = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM pdsrra")
+        pdsrra_count = cur.fetchone()[0]
+        cur.close()
+        db.close()
+        # "basic" (4 RRA) + le seul RRA propre à "discrete".
+        self.assertEqual(len(rra), 5)
+        self.assertTrue((5, 'LAST', 0.5, 1, 600) in rra)
+        self.assertEqual(pdsrra_count, 12)
+
+    def test_not_incremental(self):
+        """Sans mise à jour incrémentale, aucune empreinte n'est calculée"""
+        ventilation = {"testserver1": {"connector-metro": "localhost"}}
+        with patch.object(SQLiteGenerator, "digest") as digest:
+            ConnectorMetro().generate(ventilation)
+        self.assertFalse(digest.called)
+        self.assertTrue(os.path.exists(os.path.join(self.basedir,
+                        "localhost", "connector-metro.db")))
+
+    def test_incremental(self):
+        """Mise à jour incrémentale de la base"""
+        settings["vigiconf"]["incremental_db_generation"] = "True"
+        try:
+            Host(conf.hostsConf, "dummy.xml", "testserver2",
+                 "192.168.1.2", "Servers").add_perfdata("dummy", "dummy")
+            ventilation = {
+                "testserver1": {"connector-metro": "localhost"},
+                "testserver2": {"connector-metro": "localhost"},
+            }
+            ConnectorMetro().generate(ventilation)
+            # Seul testserver1 est modifié, testserver2 est supprimé.
+            self.host.add_perfdata("dummy2", "dummy")
+            del ventilation["testserver2"]
+            ConnectorMetro().generate(ventilation)
+        finally:
+            del settings["vigiconf"]["incremental_db_generation"]
+        db_path = os.path.join(self.basedir, "localhost",
+                               "connector-metro.db")
+        db = sqlite3.connect(db_path)
+        cur = db.cursor()
+        cur.execute("SELECT name, hostname FROM perfdatasource ORDER BY name")
+        pds = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM rra")
+        rra_count = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM pdsrra")
+        pdsrra_count = cur.fetchone()[0]
+        cur.close()
+        db.close()
+        self.assertEqual(pds, [("dummy", "testserver1"),
+                               ("dummy2", "testserver1")])
+        self.assertEqual(rra_count, 4)
+        self.assertEqual(pdsrra_count, 8)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "dbcache",
+                        "localhost", "connector-metro.db")))
+
+    def test_incremental_config_digest(self):
+        """La configuration de l'application n'est hachée qu'une fois"""
+        Host(conf.hostsConf, "dummy.xml", "testserver2",
+             "192.168.1.2", "Servers").add_perfdata("dummy", "dummy")
+        ventilation = {
+            "testserver1": {"connector-metro": "localhost"},
+            "testserver2": {"connector-metro": "localhost"},
+        }
+        app = ConnectorMetro()
+        settings["vigiconf"]["incremental_db_generation"] = "True"
+        try:
+            with patch.object(SQLiteGenerator, "digest",
+                              wraps=SQLiteGenerator.digest) as digest:
+                app.generate(ventilation)
+        finally:
+            del settings["vigiconf"]["incremental_db_generation"]
+        # une empreinte pour la configuration, puis une par hôte
+        self.assertEqual(digest.call_count, 3)
+        args = [ call[0][0] for call in digest.call_args_list ]
+        self.assertEqual(args[0], app.getConfig())
+        # les hôtes ne référencent que l'empreinte de la configuration
+        self.assertEqual([ a[-1] for a in args[1:] ],
+                         [SQLiteGenerator.digest(args[0])] * 2)
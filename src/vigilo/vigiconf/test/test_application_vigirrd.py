@@ -67,3 +67,29 @@ class VigiRRDTest(unittest.TestCase):
         ds_in_graph_2 = [ r[0] for r in c.fetchall() ]
         self.assertEqual(ds_in_graph_2,
                          [ "test_ds_%d" % i for i in range(6, -1, -1) ])
+
+    def test_bulk_load(self):
+        """La base est publiée en une seule fois, index compris"""
+        for i in range(3):
+            self.host.add_perfdata("test_ds_%d" % i, "dummy")
+        self.host.add_graph("test graph 1",
+                [ "test_ds_%d" % i for i in range(3) ],
+                "lines", "dummy")
+        self.generator.generate()
+        db_path = os.path.join(self.tmpdir, "deploy", "sup.example.com",
+                               "vigirrd.db")
+        self.assertFalse(os.path.exists("%s.tmp" % db_path))
+        self.assertEqual(os.stat(db_path).st_mode & 0777, 0644)
+        db = sqlite3.connect(db_path)
+        c = db.cursor()
+        c.execute("SELECT idhost, name FROM host")
+        self.assertEqual(c.fetchall(), [(1, "testserver1")])
+        c.execute("SELECT idperfdatasource, name FROM perfdatasource "
+                  "ORDER BY idperfdatasource")
+        self.assertEqual(c.fetchall(),
+                         [ (i + 1, "test_ds_%d" % i) for i in range(3) ])
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                  "AND name LIKE 'ix_%' ORDER BY name")
+        self.assertEqual([ r[0] for r in c.fetchall() ],
+                         ["ix_graph_name", "ix_host_name",
+                          "ix_perfdatasource_name"])
@@ -0,0 +1,71 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests de la création des archives de déploiement.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from vigilo.vigiconf.lib.archive import write_archive, ArchiveError, \
+                                        ARCHIVE_MTIME
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test-vigiconf-archive-")
+        for path in ("nagios/nagios.cfg", "collector/b.pm", "collector/a.pm"):
+            path = os.path.join(self.tmpdir, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            f = open(path, "w")
+            f.write(path)
+            f.close()
+        os.mkdir(os.path.join(self.tmpdir, "empty"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _archive(self, files=None, compression=""):
+        output = StringIO()
+        write_archive(output, self.tmpdir, files, compression)
+        return output.getvalue()
+
+    def test_content(self):
+        """Archive: contenu ordonné et dates fixes"""
+        tar = tarfile.open(fileobj=StringIO(self._archive()))
+        self.assertEqual(tar.getnames(), [
+            "collector", "collector/a.pm", "collector/b.pm",
+            "empty", "nagios", "nagios/nagios.cfg"])
+        for member in tar.getmembers():
+            self.assertEqual(member.mtime, ARCHIVE_MTIME)
+        self.assertEqual(tar.extractfile("nagios/nagios.cfg").read(),
+                         os.path.join(self.tmpdir, "nagios/nagios.cfg"))
+
+    def test_files(self):
+        """Archive: sélection de fichiers"""
+        tar = tarfile.open(fileobj=StringIO(self._archive(
+                            [u"nagios/nagios.cfg", "collector/a.pm"])))
+        self.assertEqual(tar.getnames(),
+                         ["collector/a.pm", "nagios/nagios.cfg"])
+
+    def test_compression(self):
+        """Archive: compression reproductible"""
+        for compression, magic in (("gz", "\x1f\x8b"), ("bz2", "BZh")):
+            data = self._archive(compression=compression)
+            self.assertTrue(data.startswith(magic))
+            # Le contenu ne dépend pas de la date de création.
+            os.utime(os.path.join(self.tmpdir, "collector", "a.pm"),
+                     (0, 0))
+            self.assertEqual(data, self._archive(compression=compression))
+            tar = tarfile.open(fileobj=StringIO(data))
+            self.assertEqual(len(tar.getnames()), 6)
+        self.assertRaises(ArchiveError, self._archive, compression="xz")
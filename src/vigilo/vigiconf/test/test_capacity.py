@@ -0,0 +1,130 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests de l'estimation de la charge des serveurs Vigilo.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+import vigilo.vigiconf.conf as conf
+from vigilo.vigiconf.lib.capacity import CapacityReport, host_metrics, \
+                                         rrd_size, oids_per_pdu, \
+                                         DEFAULT_OIDS_PER_PDU
+from vigilo.vigiconf.applications.collector.generator import \
+    snmp_request_plan
+from vigilo.vigiconf.lib.ventilation import VentilationIndex
+
+
+class DummyGenerator(object):
+    deploy_only_on_first = False
+
+
+class DummyMetro(object):
+    name = "connector-metro"
+    generator = DummyGenerator
+
+    def getConfig(self):
+        return {"rra": {
+            "basic": {"rras": [{"rows": 100}, {"rows": 50}]},
+            "small": {"rras": [{"rows": 10}]},
+        }}
+
+
+def make_host(name, oids_per_pdu=2):
+    conf.hostsConf[name] = {
+        "name": name,
+        "snmpOIDsPerPDU": oids_per_pdu,
+        "services": {
+            "Collector": {"type": "active"},
+            "UpTime": {"type": "passive"},
+            "Load": {"type": "passive"},
+        },
+        "SNMPJobs": {
+            ("UpTime", "service"): {"vars": ["GET/.1.3.6.1.2.1.1.3.0"]},
+            ("Load", "service"): {"vars": ["GET/.1.3.6.1.4.1.2021.10.1.5.1",
+                                           "GET/.1.3.6.1.4.1.2021.10.1.5.2",
+                                           "GET/.1.3.6.1.4.1.2021.10.1.5.3"]},
+            ("Load 01", "perfData"): {"vars": [
+                                           "GET/.1.3.6.1.4.1.2021.10.1.5.1"]},
+            ("Interfaces", "service"): {"vars": ["WALK/.1.3.6.1.2.1.2.2.1.2",
+                                                 "WALK/.1.3.6.1.2.1.2.2.1.8"]},
+        },
+        "dataSources": {
+            "Load 01": {"rra_template": None},
+            "Users": {"rra_template": "small"},
+        },
+    }
+
+
+class CapacityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        conf.load_general_conf()
+        self.metro = DummyMetro()
+
+    def tearDown(self):
+        conf.load_general_conf()
+
+    def test_host_metrics(self):
+        """Capacité: charge d'un hôte"""
+        make_host("host1")
+        metrics = host_metrics(conf.hostsConf["host1"],
+                               self.metro.getConfig())
+        self.assertEqual(metrics["active_services"], 1)
+        self.assertEqual(metrics["passive_services"], 2)
+        self.assertEqual(metrics["snmp_jobs"], 4)
+        # 4 OID distincts par groupes de 2, plus 2 parcours
+        self.assertEqual(metrics["snmp_pdus"], 4)
+        self.assertEqual(metrics["datasources"], 2)
+        self.assertEqual(metrics["rrd_bytes"],
+                         rrd_size({"rras": [{"rows": 100}, {"rows": 50}]}) +
+                         rrd_size({"rras": [{"rows": 10}]}))
+
+    def test_default_oids_per_pdu(self):
+        """Capacité: nombre d'OID par PDU par défaut, comme le Collector"""
+        make_host("host1")
+        host = conf.hostsConf["host1"]
+        del host["snmpOIDsPerPDU"]
+        pdus, walks = snmp_request_plan(host)
+        self.assertEqual(oids_per_pdu(host), DEFAULT_OIDS_PER_PDU)
+        self.assertEqual(host_metrics(host)["snmp_pdus"],
+                         len(pdus) + len(walks))
+
+    def test_report(self):
+        """Capacité: agrégation par serveur et par application"""
+        make_host("host1")
+        make_host("host2")
+        ventilation = VentilationIndex({
+            "host1": {"nagios": "sup1", self.metro: ["sup1", "sup2"]},
+            "host2": {"nagios": "sup2", self.metro: ["sup2", "sup1"]},
+        })
+        report = CapacityReport(ventilation)
+        loads = report.compute()
+        self.assertEqual(loads["sup1"]["nagios"]["hosts"], 1)
+        self.assertEqual(loads["sup2"]["nagios"]["active_services"], 1)
+        # Les bases RRD sont déployées sur les serveurs de secours.
+        self.assertEqual(loads["sup1"]["connector-metro"]["hosts"], 2)
+        self.assertEqual(len(report.format()), 6)
+
+    def test_limits(self):
+        """Capacité: seuils par défaut et propres à un serveur"""
+        make_host("host1")
+        make_host("host2")
+        ventilation = VentilationIndex({
+            "host1": {"nagios": "sup1"},
+            "host2": {"nagios": "sup1"},
+            "host3": {"nagios": "sup2"},
+        })
+        conf.capacityLimits = {
+            "default": {"nagios": {"passive_services": (3, 10)}},
+            "sup1": {"nagios": {"snmp_pdus": (None, 5)}},
+        }
+        report = CapacityReport(ventilation)
+        report.compute()
+        self.assertEqual(report.check(), [
+            ("warning", "sup1", "nagios", "passive_services", 4, 3),
+            ("error", "sup1", "nagios", "snmp_pdus", 8, 5),
+        ])
@@ -0,0 +1,63 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests des tables de correspondance au format CDB.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vigilo.vigiconf.lib.cdb import CDBWriter, CDBReader, cdb_hash
+
+
+class CDBTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test-vigiconf-cdb-")
+        self.filename = os.path.join(self.tmpdir, "test.cdb")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hash(self):
+        """CDB: fonction de hachage"""
+        self.assertEqual(cdb_hash(""), 5381)
+        self.assertEqual(cdb_hash("a"), (5381 * 33) ^ ord("a"))
+
+    def test_lookup(self):
+        """CDB: recherche de clés"""
+        writer = CDBWriter(self.filename)
+        for i in range(1000):
+            writer.add("key%d" % i, "value%d" % i)
+        writer.close()
+        self.assertFalse(os.path.exists("%s.tmp" % self.filename))
+        reader = CDBReader(self.filename)
+        for i in range(1000):
+            self.assertEqual(reader.get("key%d" % i), "value%d" % i)
+        self.assertEqual(reader.get("missing"), None)
+        self.assertEqual(reader.get("missing", "default"), "default")
+        reader.close()
+
+    def test_duplicates(self):
+        """CDB: clés multiples et caractères unicode"""
+        writer = CDBWriter(self.filename)
+        writer.add(u"hôte\0service", u"é1")
+        writer.add(u"hôte\0service", u"é2")
+        writer.close()
+        reader = CDBReader(self.filename)
+        self.assertEqual(reader.getall(u"hôte\0service"),
+                         [u"é1".encode("utf-8"), u"é2".encode("utf-8")])
+        reader.close()
+
+    def test_empty(self):
+        """CDB: table vide"""
+        CDBWriter(self.filename).close()
+        self.assertEqual(os.path.getsize(self.filename), 2048)
+        reader = CDBReader(self.filename)
+        self.assertEqual(reader.getall("key"), [])
+        reader.close()
@@ -0,0 +1,187 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+
+"""
+Tests des points de reprise du déploiement
+"""
+
+import os
+import shutil
+import unittest
+
+from mock import Mock, patch
+
+from vigilo.common.conf import settings
+
+from vigilo.vigiconf.lib.application import ApplicationError
+from vigilo.vigiconf.lib.exceptions import DispatchatorError
+from vigilo.vigiconf.lib.dispatchator.base import Dispatchator
+from vigilo.vigiconf.lib.dispatchator.checkpoint import Checkpoint
+from vigilo.vigiconf.lib.manifest import Manifest
+from vigilo.vigiconf.lib.ventilation import VentilationIndex
+
+from .helpers import setup_tmpdir
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = setup_tmpdir()
+        self.old_libdir = settings["vigiconf"]["libdir"]
+        settings["vigiconf"]["libdir"] = self.tmpdir
+        self._write("server1", "nagios/nagios.cfg", "a")
+
+    def tearDown(self):
+        settings["vigiconf"]["libdir"] = self.old_libdir
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, server, path, content, manifest=True):
+        path = os.path.join(self.tmpdir, "deploy", server, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+        if manifest:
+            # comme GeneratorManager.write_manifests
+            Manifest.build(server).save(Manifest.generated_path(server))
+
+    def test_save_load(self):
+        """Le point de reprise est enregistré à chaque étape terminée"""
+        checkpoint = Checkpoint(42)
+        self.assertEqual(checkpoint.next_phase, "generation")
+        checkpoint.complete_generation("abc")
+        checkpoint.complete_push(["server1"])
+        loaded = Checkpoint.load()
+        self.assertEqual(loaded.revision, 42)
+        self.assertEqual(loaded.ventilation, "abc")
+        self.assertEqual(list(loaded.manifests), ["server1"])
+        self.assertEqual(loaded.deployed, ["server1"])
+        self.assertEqual(loaded.next_phase, "commit")
+        Checkpoint.remove()
+        self.assertTrue(Checkpoint.load() is None)
+
+    def test_check(self):
+        """La reprise est possible si rien n'a changé"""
+        checkpoint = Checkpoint(42)
+        checkpoint.complete_generation("abc")
+        self.assertTrue(Checkpoint.load().check(42) is None)
+
+    def test_check_revision(self):
+        """La reprise est impossible si la révision a changé"""
+        checkpoint = Checkpoint(42)
+        checkpoint.complete_generation("abc")
+        self.assertFalse(Checkpoint.load().check(43) is None)
+
+    def test_check_generated(self):
+        """La reprise est impossible si les fichiers générés ont changé"""
+        checkpoint = Checkpoint(42)
+        checkpoint.complete_generation("abc")
+        self._write("server1", "nagios/nagios.cfg", "b")
+        self.assertFalse(Checkpoint.load().check(42) is None)
+        self._write("server1", "nagios/nagios.cfg", "a")
+        self._write("server2", "nagios/nagios.cfg", "a")
+        self.assertFalse(Checkpoint.load().check(42) is None)
+
+    def test_saved_manifests(self):
+        """Les empreintes sont lues dans les manifestes de la génération"""
+        checkpoint = Checkpoint(42)
+        with patch.object(Manifest, "build") as build:
+            checkpoint.complete_generation("abc")
+            self.assertTrue(Checkpoint.load().check(42) is None)
+        self.assertFalse(build.called)
+
+    def test_check_missing_manifest(self):
+        """Sans manifeste enregistré, l'arborescence est à nouveau analysée"""
+        checkpoint = Checkpoint(42)
+        checkpoint.complete_generation("abc")
+        os.remove(Manifest.generated_path("server1"))
+        self.assertTrue(Checkpoint.load().check(42) is None)
+        self._write("server1", "nagios/nagios.cfg", "b", manifest=False)
+        self.assertFalse(Checkpoint.load().check(42) is None)
+
+    def test_simulate(self):
+        """Aucun point de reprise n'est enregistré en mode simulation"""
+        settings["vigiconf"]["simulate"] = True
+        try:
+            Checkpoint(42).complete_generation("abc")
+        finally:
+            del settings["vigiconf"]["simulate"]
+        self.assertFalse(os.path.exists(Checkpoint.path()))
+
+    def test_ventilation_fingerprint(self):
+        """L'empreinte de la ventilation ne dépend que des affectations"""
+        index1 = VentilationIndex()
+        index1.assign("host1", "nagios", ["sup1"])
+        index1.assign("host2", "nagios", ["sup2", "sup1"])
+        index2 = VentilationIndex()
+        index2.assign("host2", "nagios", ["sup2", "sup1"])
+        index2.assign("host1", "nagios", ["sup1"])
+        self.assertEqual(index1.fingerprint(), index2.fingerprint())
+        index2.assign("host1", "nagios", ["sup2"])
+        self.assertNotEqual(index1.fingerprint(), index2.fingerprint())
+
+
+class PipelinedResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = setup_tmpdir()
+        self.old_libdir = settings["vigiconf"]["libdir"]
+        settings["vigiconf"]["libdir"] = self.tmpdir
+        settings["vigiconf"]["pipelined_deployment"] = "True"
+        os.makedirs(os.path.join(self.tmpdir, "deploy", "server1", "nagios"))
+        Manifest.build("server1").save(Manifest.generated_path("server1"))
+        self.app = Mock()
+        self.app.servers = {"server1": None}
+        apps_mgr = Mock()
+        apps_mgr.applications = [self.app]
+        rev_mgr = Mock()
+        rev_mgr.deploy_revision = 42
+        srv_mgr = Mock()
+        srv_mgr.servers = {"server1": None}
+        srv_mgr.deploy.side_effect = lambda servers, force: servers
+        srv_mgr.filter_servers.return_value = []
+        srv_mgr.unchanged_servers.return_value = []
+        self.gen_mgr = Mock()
+        self.gen_mgr.ventilation_fingerprint.return_value = "abc"
+        def generate(rev_mgr, nosyncdb, reuse):
+            if self.gen_mgr.server_ready is not None:
+                self.gen_mgr.server_ready("server1")
+            return reuse == "abc"
+        self.gen_mgr.generate.side_effect = generate
+        self.dispatchator = Dispatchator(apps_mgr, rev_mgr, srv_mgr,
+                                         self.gen_mgr)
+
+    def tearDown(self):
+        del settings["vigiconf"]["pipelined_deployment"]
+        settings["vigiconf"]["libdir"] = self.old_libdir
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume_invalid(self):
+        """Une configuration invalide n'est pas réutilisée à la reprise"""
+        self.app.validateServer.side_effect = ApplicationError("invalid")
+        self.assertRaises(DispatchatorError, self.dispatchator.run,
+                          with_dbonly=False)
+        checkpoint = Checkpoint.load()
+        self.assertFalse(checkpoint is not None and
+                         checkpoint.is_complete("generation"))
+        # à la reprise, la configuration est générée et validée à nouveau
+        self.app.validateServer.side_effect = None
+        self.app.validateServer.reset_mock()
+        self.dispatchator.run(with_dbonly=False, resume=True)
+        self.assertEqual(self.gen_mgr.generate.call_args[1]["reuse"], None)
+        self.app.validateServer.assert_called_once_with("server1")
+        self.assertTrue(Checkpoint.load() is None)
+
+    def test_resume_valid(self):
+        """Une configuration validée est réutilisée à la reprise"""
+        self.dispatchator.srv_mgr.deploy.side_effect = DispatchatorError("")
+        self.assertRaises(DispatchatorError, self.dispatchator.run,
+                          with_dbonly=False)
+        self.assertEqual(Checkpoint.load().phases, ["generation"])
+        self.dispatchator.srv_mgr.deploy.side_effect = None
+        self.dispatchator.srv_mgr.deploy.return_value = ["server1"]
+        self.dispatchator.run(with_dbonly=False, resume=True)
+        self.assertEqual(self.gen_mgr.generate.call_args[1]["reuse"], "abc")
+        self.assertTrue(Checkpoint.load() is None)
@@ -6,6 +6,9 @@ from __future__ import absolute_import, print_function
 
 import os
 from vigilo.vigiconf.applications.collector import Collector
+from vigilo.vigiconf.applications.collector.generator import \
+    snmp_request_plan
+import vigilo.vigiconf.conf as conf
 from .helpers import GeneratorBaseTestCase
 
 class CollectorGeneratorTestCase(GeneratorBaseTestCase):
@@ -32,3 +35,57 @@ class CollectorGeneratorTestCase(GeneratorBaseTestCase):
         cfg = open(cfgfile).read()
         print(cfg)
         self.assertFalse("\\" in cfg)
+
+    def test_request_plan(self):
+        """Collector: plan des requêtes SNMP"""
+        self.host.set_attribute("snmpOIDsPerPDU", 2)
+        self.host.add_collector_service("Load", "simple_factor",
+                ["WARN", "CRIT", 1],
+                ["GET/.1.3.6.1.4.1.2021.10.1.5.10",
+                 "GET/.1.3.6.1.4.1.2021.10.1.5.2",
+                 "GET/.1.3.6.1.4.1.2021.10.1.5.1"])
+        self.host.add_collector_metro("Load 01", "directValue", [],
+                ["GET/.1.3.6.1.4.1.2021.10.1.5.1"], "GAUGE")
+        self.host.add_collector_service("Interfaces", "ifOperStatus", [],
+                ["WALK/.1.3.6.1.2.1.2.2.1.8", "WALK/.1.3.6.1.2.1.2.2.1.2"])
+        pdus, walks = snmp_request_plan(conf.hostsConf["testserver1"])
+        # OID partagés interrogés une seule fois, dans l'ordre numérique.
+        self.assertEqual(pdus, [[".1.3.6.1.4.1.2021.10.1.5.1",
+                                 ".1.3.6.1.4.1.2021.10.1.5.2"],
+                                [".1.3.6.1.4.1.2021.10.1.5.10"]])
+        self.assertEqual(walks, [".1.3.6.1.2.1.2.2.1.2",
+                                 ".1.3.6.1.2.1.2.2.1.8"])
+        self._generate()
+        self._validate()
+        cfgfile = os.path.join(self.basedir, "localhost", "collector",
+                               "testserver1.pm")
+        cfg = open(cfgfile).read()
+        print(cfg)
+        self.assertTrue("$Host{requests} = {get => "
+                        "[['.1.3.6.1.4.1.2021.10.1.5.1', "
+                        "'.1.3.6.1.4.1.2021.10.1.5.2'], "
+                        "['.1.3.6.1.4.1.2021.10.1.5.10']], "
+                        "walk => ['.1.3.6.1.2.1.2.2.1.2', "
+                        "'.1.3.6.1.2.1.2.2.1.8']};" in cfg)
+
+    def test_bundles(self):
+        """Collector: regroupement des hôtes dans quelques fichiers"""
+        conf.apps_conf["collector"] = {"bundle_shards": 2}
+        try:
+            test_list = self.testfactory.get_test("all.Interface")
+            self.host.add_tests(test_list, {"label": u"eth0",
+                                            "ifname": u"eth0"})
+            self._generate()
+            self._validate()
+        finally:
+            del conf.apps_conf["collector"]
+        collectordir = os.path.join(self.basedir, "localhost", "collector")
+        self.assertFalse(os.path.exists(os.path.join(collectordir,
+                                                     "testserver1.pm")))
+        index = open(os.path.join(collectordir, "bundles.index")).read()
+        hostname, bundle = index.strip().split("\t")
+        self.assertEqual(hostname, "testserver1")
+        self.assertTrue(bundle in ("bundle-00.pm", "bundle-01.pm"))
+        cfg = open(os.path.join(collectordir, bundle)).read()
+        print(cfg)
+        self.assertTrue("$Hosts{'testserver1'} = {%Host};" in cfg)
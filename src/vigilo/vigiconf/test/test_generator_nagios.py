@@ -6,9 +6,11 @@ from __future__ import absolute_import, print_function
 
 import os
 import re
+import hashlib
 import vigilo.vigiconf.conf as conf
 from vigilo.vigiconf.lib.confclasses.host import Host
 from vigilo.vigiconf.applications.nagios import Nagios
+from vigilo.vigiconf.lib.generators.topology import TopologyIndex
 from vigilo.models.demo.functions import add_host, add_dependency_group, \
                                          add_dependency
 from vigilo.models.tables import ConfFile
@@ -190,3 +192,71 @@ class NagiosGeneratorTestCase(GeneratorBaseTestCase):
         print(nagiosconf)
         self.assertTrue(re.search("^\s*parents\s+testserver2\s*$",
                         nagiosconf, re.M))
+
+    def test_topology_index(self):
+        """Nagios: index des parents topologiques"""
+        Host(conf.hostsConf, "host/localhost.xml", u"testserver2",
+                     "192.168.1.2", "Servers")
+        add_host("testserver2", ConfFile.get_or_create("dummy.xml"))
+        dep_group = add_dependency_group('testserver1', None, 'topology')
+        add_dependency(dep_group, ("testserver2", None))
+        self._generate()
+        ventilation = self.genmanager._ventilation
+        index = TopologyIndex(ventilation)
+        self.assertEqual(index.parents("testserver1"), ["testserver2"])
+        self.assertEqual(index.parents("testserver2"), [])
+        # Seuls les serveurs Vigilo demandés sont pris en compte.
+        index = TopologyIndex(ventilation, vservers=["otherserver"])
+        self.assertEqual(index.parents("testserver1"), [])
+
+    def test_spread_checks(self):
+        """Nagios: répartition des vérifications sur leur intervalle"""
+        conf.apps_conf["nagios"] = {"spread_checks": True}
+        try:
+            for i in range(4):
+                self.host.add_external_sup_service("service%d" % i,
+                                                   "check_dummy")
+            self._generate()
+        finally:
+            del conf.apps_conf["nagios"]
+        schedulefile = os.path.join(self.basedir, "localhost",
+                                    "nagios", "schedule")
+        self.assertTrue(os.path.exists(schedulefile),
+                        "Schedule file was not generated")
+        schedule = [ l.split(";") for l in
+                     open(schedulefile).read().splitlines() ]
+        print(schedule)
+        # 4 services vérifiés toutes les 5 minutes : un toutes les 75s.
+        self.assertEqual(sorted(int(l[2]) for l in schedule),
+                         [0, 75, 150, 225])
+        nagiosconffile = os.path.join(self.basedir, "localhost",
+                                      "nagios", "nagios.cfg")
+        nagiosconf = open(nagiosconffile).read()
+        self.assertEqual(len(re.findall(r"^\s*_SCHEDULE_OFFSET\s+\d+$",
+                                        nagiosconf, re.M)), 4)
+
+    def test_per_host_files(self):
+        """Nagios: un fichier par hôte"""
+        Host(conf.hostsConf, "host/localhost.xml", u"testserver2",
+                     "192.168.1.2", "Servers")
+        add_host("testserver2", ConfFile.get_or_create("dummy.xml"))
+        conf.apps_conf["nagios"] = {"per_host_files": True}
+        try:
+            self._generate()
+        finally:
+            del conf.apps_conf["nagios"]
+        nagiosdir = os.path.join(self.basedir, "localhost", "nagios")
+        self.assertTrue(os.path.exists(os.path.join(nagiosdir, "nagios.cfg")))
+        for hostname in ("testserver1", "testserver2"):
+            hostconf = open(os.path.join(nagiosdir, "hosts",
+                                         "%s.cfg" % hostname)).read()
+            print(hostconf)
+            self.assertTrue(re.search(r"^\s*host_name\s+%s\s*$" % hostname,
+                                      hostconf, re.M))
+        index = [ l.split() for l in
+                  open(os.path.join(nagiosdir, "hosts.index")) ]
+        self.assertEqual([ l[1] for l in index ],
+                         ["hosts/testserver1.cfg", "hosts/testserver2.cfg"])
+        for md5, filename in index:
+            content = open(os.path.join(nagiosdir, filename)).read()
+            self.assertEqual(md5, hashlib.md5(content).hexdigest())
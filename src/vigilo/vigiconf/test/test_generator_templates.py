@@ -0,0 +1,82 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests du cache des modèles de documents utilisés par les générateurs.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vigilo.vigiconf.lib.generators.templates import Template, TemplateCache
+
+
+class TemplateTestCase(unittest.TestCase):
+
+    def test_keys(self):
+        """Modèles: détection des variables utilisées"""
+        tpl = Template("%(name)s %%(notakey)s %(port)d %(name)s 100%%")
+        self.assertEqual(tpl.keys, frozenset(["name", "port"]))
+
+    def test_positional(self):
+        """Modèles: champ positionnel"""
+        tpl = Template("%(name)s %s")
+        self.assertTrue(tpl.keys is None)
+
+    def test_context(self):
+        """Modèles: seules les variables nécessaires sont recopiées"""
+        tpl = Template("%(name)s %(address)s %(extra)s")
+        host = {"name": "host1", "address": "127.0.0.1", "other": 42}
+        ctx = tpl.context(host, {"address": "::1"}, extra="x")
+        self.assertEqual(ctx, {"name": "host1", "address": "::1",
+                               "extra": "x"})
+        self.assertEqual(tpl.render(ctx), "host1 ::1 x")
+        self.assertEqual(tpl % ctx, "host1 ::1 x")
+
+
+class TemplateCacheTestCase(unittest.TestCase):
+
+    module = "vigilo.vigiconf.applications.nagios"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tests-vigiconf-")
+        self.cache = TemplateCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _override(self, content, mtime):
+        filename = os.path.join(self.tmpdir, "hostgroup.tpl")
+        tplfile = open(filename, "w")
+        tplfile.write(content)
+        tplfile.close()
+        os.utime(filename, (mtime, mtime))
+
+    def test_shared(self):
+        """Modèles: compilation unique par processus"""
+        tpls1 = self.cache.get_templates(self.module, self.tmpdir)
+        tpls2 = self.cache.get_templates(self.module, self.tmpdir)
+        self.assertTrue("host" in tpls1)
+        self.assertTrue(tpls1["host"] is tpls2["host"])
+        # Modifier le dictionnaire d'un générateur n'altère pas le cache.
+        del tpls1["host"]
+        self.assertTrue("host" in
+                        self.cache.get_templates(self.module, self.tmpdir))
+
+    def test_override(self):
+        """Modèles: surcharge et invalidation sur la date de modification"""
+        self._override("group %(hostgroupName)s\n", 1000)
+        tpls = self.cache.get_templates(self.module, self.tmpdir)
+        self.assertEqual(tpls["hostgroup"].source, "group %(hostgroupName)s\n")
+        self.assertEqual(tpls["hostgroup"].keys,
+                         frozenset(["hostgroupName"]))
+        self._override("alias %(hostgroupAlias)s\n", 2000)
+        tpls = self.cache.get_templates(self.module, self.tmpdir)
+        self.assertEqual(tpls["hostgroup"].source, "alias %(hostgroupAlias)s\n")
+        os.remove(os.path.join(self.tmpdir, "hostgroup.tpl"))
+        tpls = self.cache.get_templates(self.module, self.tmpdir)
+        self.assertTrue("hostgroup_name" in tpls["hostgroup"].source)
@@ -0,0 +1,92 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests des manifestes des configurations générées.
+"""
+from __future__ import absolute_import
+
+import os
+import shutil
+import unittest
+
+from vigilo.vigiconf.lib.manifest import Manifest, file_hash
+
+from .helpers import setup_tmpdir
+
+
+def write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    f = open(path, "w")
+    f.write(content)
+    f.close()
+
+
+class ManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = setup_tmpdir()
+        self.basedir = os.path.join(self.tmpdir, "deploy")
+        self.root = os.path.join(self.basedir, "sup1")
+        write(os.path.join(self.root, "nagios", "nagios.cfg"), "hosts")
+        write(os.path.join(self.root, "apps", "nagios", "start.sh.in"), "go")
+        write(os.path.join(self.root, "collector", "host1.pm"), "1;\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build(self):
+        """Manifeste: recensement des fichiers générés"""
+        manifest = Manifest.build("sup1", self.basedir)
+        self.assertEqual(sorted(manifest.files), [
+            "apps/nagios/start.sh.in", "collector/host1.pm",
+            "nagios/nagios.cfg"])
+        path = os.path.join(self.root, "collector", "host1.pm")
+        self.assertEqual(manifest.files["collector/host1.pm"],
+                         (3, file_hash(path)))
+        self.assertEqual(sorted(manifest.apps), ["collector", "nagios"])
+
+    def test_save_load(self):
+        """Manifeste: enregistrement et chargement"""
+        manifest = Manifest.build("sup1", self.basedir)
+        filename = Manifest.deployed_path("sup1")
+        manifest.save(filename)
+        loaded = Manifest.load(filename)
+        self.assertEqual(loaded.server, "sup1")
+        self.assertEqual(loaded.files, manifest.files)
+        self.assertEqual(loaded.apps, manifest.apps)
+        self.assertEqual(loaded.tree_hash, manifest.tree_hash)
+        self.assertEqual(Manifest.load(filename + ".missing"), None)
+
+    def test_diff(self):
+        """Manifeste: comparaison avec le déploiement précédent"""
+        previous = Manifest.build("sup1", self.basedir)
+        write(os.path.join(self.root, "collector", "host1.pm"), "2;\n")
+        write(os.path.join(self.root, "collector", "host2.pm"), "1;\n")
+        os.remove(os.path.join(self.root, "apps", "nagios", "start.sh.in"))
+        manifest = Manifest.build("sup1", self.basedir)
+        self.assertEqual(manifest.diff(previous), (
+            ["collector/host1.pm", "collector/host2.pm"],
+            ["apps/nagios/start.sh.in"]))
+        self.assertEqual(manifest.changed_apps(previous),
+                         set(["collector", "nagios"]))
+        self.assertEqual(manifest.changed_apps(manifest), set())
+        self.assertNotEqual(manifest.tree_hash, previous.tree_hash)
+        # Sans manifeste précédent, tout est nouveau.
+        self.assertEqual(manifest.diff(None)[0], sorted(manifest.files))
+
+    def test_changed_root_file(self):
+        """Manifeste: fichier modifié ne relevant d'aucune application"""
+        write(os.path.join(self.root, "vigirrd.db"), "a")
+        previous = Manifest.build("sup1", self.basedir)
+        write(os.path.join(self.root, "vigirrd.db"), "b")
+        manifest = Manifest.build("sup1", self.basedir)
+        self.assertEqual(manifest.changed_apps(previous), None)
+        self.assertNotEqual(manifest.shared_hash, previous.shared_hash)
+        self.assertEqual(manifest.apps, previous.apps)
+        os.remove(os.path.join(self.root, "vigirrd.db"))
+        manifest = Manifest.build("sup1", self.basedir)
+        self.assertEqual(manifest.changed_apps(previous), None)
@@ -0,0 +1,112 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+
+"""
+Tests du déploiement au fil de la génération
+"""
+
+import os
+import shutil
+import unittest
+
+from mock import Mock
+
+from vigilo.common.conf import settings
+
+from vigilo.vigiconf.lib.application import ApplicationError
+from vigilo.vigiconf.lib.generators import GeneratorManager, FileGenerator
+from vigilo.vigiconf.lib.dispatchator.pipeline import DeployPipeline
+from vigilo.vigiconf.lib.manifest import Manifest
+from vigilo.vigiconf.lib.ventilation import VentilationIndex
+
+from .helpers import setup_tmpdir
+
+
+class OpenFileGenerator(FileGenerator):
+    """Générateur qui ne ferme pas ses fichiers"""
+
+    def loadTemplates(self):
+        return {}
+
+    def generate_host(self, hostname, vserver):
+        self.templateCreate(os.path.join(self.baseDir, vserver, "app.cfg"),
+                            "%(host)s\n", {"host": hostname})
+
+
+class DeployPipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = setup_tmpdir()
+        self.old_libdir = settings["vigiconf"]["libdir"]
+        settings["vigiconf"]["libdir"] = self.tmpdir
+        os.makedirs(os.path.join(self.tmpdir, "deploy", "server1", "nagios"))
+        self.app = Mock()
+        self.app.servers = {"server1": None, "server2": None}
+        self.apps_mgr = Mock()
+        self.apps_mgr.applications = [self.app]
+        self.srv_mgr = Mock()
+        self.srv_mgr.servers = {"server1": None, "server2": None}
+        self.srv_mgr.deploy.side_effect = lambda servers, force: servers
+        self.pipeline = DeployPipeline(self.apps_mgr, self.srv_mgr,
+                                       ("deploy", ))
+
+    def tearDown(self):
+        settings["vigiconf"]["libdir"] = self.old_libdir
+        shutil.rmtree(self.tmpdir)
+
+    def test_server_ready(self):
+        """Un serveur prêt est validé puis déployé"""
+        self.pipeline.server_ready("server1")
+        self.pipeline.join()
+        self.app.validateServer.assert_called_once_with("server1")
+        self.srv_mgr.deploy.assert_called_once_with(["server1"],
+                                                    ("deploy", ))
+        self.assertEqual(self.pipeline.deployed, ["server1"])
+        self.assertEqual(self.pipeline.processed, set(["server1"]))
+        self.assertTrue(os.path.exists(Manifest.generated_path("server1")))
+
+    def test_validation_error(self):
+        """Un serveur dont la validation échoue n'est pas déployé"""
+        self.app.validateServer.side_effect = ApplicationError("invalid")
+        self.pipeline.server_ready("server1")
+        self.pipeline.server_ready("unknown")
+        self.pipeline.join()
+        self.assertFalse(self.srv_mgr.deploy.called)
+        self.assertEqual(self.pipeline.deployed, [])
+        self.assertEqual(list(self.pipeline.errors), ["server1"])
+        self.assertEqual(self.pipeline.invalid, set(["server1"]))
+
+    def test_notify_ready(self):
+        """Un serveur est signalé quand toutes ses applications sont générées"""
+        gen_mgr = GeneratorManager([])
+        ready = []
+        gen_mgr.server_ready = ready.append
+        pending = {"server1": set(), "server2": set(["nagios"]),
+                   "server3": set()}
+        gen_mgr._notify_ready(pending, set(["server3"]))
+        self.assertEqual(ready, ["server1"])
+        self.assertEqual(pending, {"server2": set(["nagios"])})
+        pending["server2"].discard("nagios")
+        gen_mgr._notify_ready(pending, set(["server3"]))
+        self.assertEqual(ready, ["server1", "server2"])
+
+    def test_ready_files_closed(self):
+        """Les fichiers générés sont complets quand un serveur est signalé"""
+        app = Mock()
+        app.name = "app"
+        app.generator = OpenFileGenerator
+        app.dbonly = False
+        gen_mgr = GeneratorManager([app])
+        gen_mgr._ventilation = VentilationIndex()
+        gen_mgr._ventilation.assign("host1", app, ["server1"])
+        contents = []
+        def server_ready(servername):
+            filename = os.path.join(self.tmpdir, "deploy", servername,
+                                    "app.cfg")
+            with open(filename) as f:
+                contents.append(f.read())
+        gen_mgr.server_ready = server_ready
+        gen_mgr.run_all_generators(Mock())
+        self.assertEqual(contents, ["host1\n"])
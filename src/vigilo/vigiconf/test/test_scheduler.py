@@ -0,0 +1,141 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+
+"""
+Tests de l'ordonnancement des actions des applications
+"""
+
+import time
+import unittest
+import threading
+
+from vigilo.vigiconf.lib.scheduler import ActionScheduler
+
+
+class FakeApplication(object):
+
+    def __init__(self, name, priority, servers, duration=0, timeout=None,
+                 log=None):
+        self.name = name
+        self.priority = priority
+        self.servers = dict([ (s, None) for s in servers ])
+        self.actions = dict([ (s, ["start", "stop"]) for s in servers ])
+        self.duration = duration
+        self.timeout = timeout
+        self.log = log if log is not None else []
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def filterServers(self, servers):
+        return set(servers) & set(self.servers)
+
+    def get_timeout(self):
+        return self.timeout
+
+    def startServer(self, servername):
+        with self.lock:
+            self.calls += 1
+            duration = self.duration
+            if isinstance(duration, list):
+                duration = duration.pop(0)
+        time.sleep(duration)
+        self.log.append((self.name, servername, time.time()))
+
+
+class ActionSchedulerTest(unittest.TestCase):
+
+    def test_build(self):
+        """Les priorités ne lient que les tâches d'un même serveur"""
+        app1 = FakeApplication("app1", 10, ["srv1", "srv2"])
+        app2 = FakeApplication("app2", 5, ["srv1"])
+        app3 = FakeApplication("app3", 5, ["srv2"])
+        tasks = ActionScheduler.build([app1, app2, app3], "start",
+                                      ["srv1", "srv2", "srv3"])
+        deps = dict([ ((t.application.name, t.server),
+                       [(d.application.name, d.server) for d in t.depends])
+                      for t in tasks ])
+        self.assertEqual(deps, {
+            ("app1", "srv1"): [],
+            ("app1", "srv2"): [],
+            ("app2", "srv1"): [("app1", "srv1")],
+            ("app3", "srv2"): [("app1", "srv2")],
+        })
+
+    def test_build_only(self):
+        """Seules les applications modifiées sont redémarrées"""
+        app1 = FakeApplication("app1", 10, ["srv1", "srv2"])
+        app2 = FakeApplication("app2", 5, ["srv1", "srv2"])
+        tasks = ActionScheduler.build([app1, app2], "start",
+                                      ["srv1", "srv2"],
+                                      only={"srv1": set(["app2"])})
+        self.assertEqual(sorted([ (t.application.name, t.server)
+                                  for t in tasks ]),
+                         [("app1", "srv2"), ("app2", "srv1"),
+                          ("app2", "srv2")])
+
+    def test_order(self):
+        """Les serveurs progressent indépendamment les uns des autres"""
+        log = []
+        slow = FakeApplication("slow", 10, ["srv1"], duration=0.3, log=log)
+        fast = FakeApplication("fast", 10, ["srv2"], duration=0, log=log)
+        last = FakeApplication("last", 5, ["srv1", "srv2"], log=log)
+        tasks = ActionScheduler.build([slow, fast, last], "start",
+                                      ["srv1", "srv2"])
+        self.assertTrue(ActionScheduler().run(tasks))
+        order = [ (name, server) for name, server, _t in log ]
+        # srv2 n'attend pas le serveur le plus lent
+        self.assertTrue(order.index(("last", "srv2")) <
+                        order.index(("slow", "srv1")))
+        self.assertTrue(order.index(("slow", "srv1")) <
+                        order.index(("last", "srv1")))
+
+    def test_concurrency(self):
+        """Le nombre d'actions simultanées est limité"""
+        log = []
+        app = FakeApplication("app", 10, ["srv%d" % i for i in range(4)],
+                              duration=0.1, log=log)
+        tasks = ActionScheduler.build([app], "start", list(app.servers))
+        start = time.time()
+        self.assertTrue(ActionScheduler(concurrency=2).run(tasks))
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_timeout_retry(self):
+        """Une action qui dépasse le délai imparti est relancée"""
+        app = FakeApplication("app", 10, ["srv1"], duration=[1, 0],
+                              timeout=0.1)
+        tasks = ActionScheduler.build([app], "start", ["srv1"])
+        scheduler = ActionScheduler(attempts=2, retry_delay=0.01)
+        self.assertTrue(scheduler.run(tasks))
+        self.assertEqual(app.calls, 2)
+        self.assertFalse(tasks[0].timedout)
+
+    def test_timeout(self):
+        """Une action toujours trop lente est signalée"""
+        app = FakeApplication("app", 10, ["srv1"], duration=[1, 1],
+                              timeout=0.05)
+        tasks = ActionScheduler.build([app], "start", ["srv1"])
+        scheduler = ActionScheduler(attempts=2, retry_delay=0.01)
+        self.assertFalse(scheduler.run(tasks))
+        self.assertTrue(tasks[0].timedout)
+        self.assertEqual(tasks[0].attempts, 2)
+
+    def test_timeout_dependencies(self):
+        """Les actions suivantes ne sont pas exécutées après un time out"""
+        slow = FakeApplication("slow", 10, ["srv1"], duration=1, timeout=0.05)
+        next1 = FakeApplication("next1", 5, ["srv1", "srv2"])
+        next2 = FakeApplication("next2", 1, ["srv1"])
+        tasks = ActionScheduler.build([slow, next1, next2], "start",
+                                      ["srv1", "srv2"])
+        self.assertFalse(ActionScheduler().run(tasks))
+        status = dict([ ((t.application.name, t.server),
+                         (t.status, t.skipped)) for t in tasks ])
+        self.assertEqual(status, {
+            ("slow", "srv1"): (False, False),
+            ("next1", "srv1"): (False, True),
+            ("next2", "srv1"): (False, True),
+            ("next1", "srv2"): (True, False),
+        })
+        self.assertEqual(next1.calls, 1)
+        self.assertEqual(next2.calls, 0)
@@ -10,14 +10,21 @@ from __future__ import absolute_import, print_function
 
 import os
 import shutil
+import tarfile
 import unittest
 
+from mock import Mock
+
 from vigilo.common.conf import settings
 
 from vigilo.models import tables
 from vigilo.models.session import DBSession
 
+from vigilo.vigiconf.lib.server.base import Server, ServerError
 from vigilo.vigiconf.lib.server.local import ServerLocal
+from vigilo.vigiconf.lib.server.manager import ServerManager
+from vigilo.vigiconf.lib.manifest import Manifest
+from vigilo.vigiconf.lib.scheduler import ActionScheduler
 
 from .helpers import setup_tmpdir, LoggingCommand
 from .helpers import setup_db, teardown_db
@@ -94,3 +101,164 @@ class ServerTest(unittest.TestCase):
             self.server.enable()
         except Exception as e:
             self.fail(str(e))
+
+    def _generate(self, files):
+        """Génère une configuration et son manifeste"""
+        root = os.path.join(self.tmpdir, "deploy", "testserver")
+        if os.path.exists(root):
+            shutil.rmtree(root)
+        for path, content in files.iteritems():
+            path = os.path.join(root, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            f = open(path, "w")
+            f.write(content)
+            f.close()
+        Manifest.build("testserver").save(
+                Manifest.generated_path("testserver"))
+
+    def _deploy_delta(self):
+        settings["vigiconf"]["delta_deployment"] = "True"
+        try:
+            self.server.deploy()
+        finally:
+            del settings["vigiconf"]["delta_deployment"]
+        return os.path.join(self.tmpdir, "deploy", "testserver.tar")
+
+    def test_deploy_delta(self):
+        """Déploiement différentiel"""
+        self._generate({"nagios/a.cfg": "a", "nagios/b.cfg": "b",
+                        "collector/c.pm": "c"})
+        self.server.keep_manifest(42)
+        self.assertEqual(self.server.get_deployed_manifest().revision, 42)
+        self._generate({"nagios/a.cfg": "A", "collector/c.pm": "c"})
+        self.server.revisions["deployed"] = 42
+        tar = self._deploy_delta()
+        self.assertEqual(self.server.executed, [
+            ["vigiconf-local", "receive-conf", "--delta", "42", tar]])
+        archive = tarfile.open(tar)
+        names = archive.getnames()
+        self.assertTrue("nagios/a.cfg" in names)
+        self.assertFalse("collector/c.pm" in names)
+        self.assertEqual(archive.extractfile(Server.DELETED_LIST).read(),
+                         "nagios/b.cfg\n")
+        archive.close()
+
+    def test_deploy_delta_full(self):
+        """Déploiement différentiel: référence absente du serveur"""
+        self._generate({"nagios/a.cfg": "a"})
+        self.server.keep_manifest(42)
+        self._generate({"nagios/a.cfg": "A"})
+        self.server.revisions["deployed"] = 41
+        tar = self._deploy_delta()
+        self.assertEqual(self.server.executed, [
+            ["vigiconf-local", "receive-conf", tar]])
+
+    def _run_steps(self, steps):
+        settings["vigiconf"]["batch_commands"] = "True"
+        try:
+            self.server.run_steps(steps)
+        finally:
+            del settings["vigiconf"]["batch_commands"]
+
+    def test_run_steps_batch(self):
+        """Lot de commandes: un seul appel à vigiconf-local"""
+        self.server.command_result = (
+            '{"step": "set-revision:42", "status": "ok", "output": ""}\n'
+            '{"step": "activate-conf", "status": "ok", "output": ""}\n')
+        self._run_steps([["set-revision", "42"], ["activate-conf"]])
+        self.assertEqual(self.server.executed, [
+            ["vigiconf-local", "batch", "set-revision:42", "activate-conf"]])
+
+    def test_run_steps_fallback(self):
+        """Lot de commandes non géré: exécution commande par commande"""
+        self.server.command_result = "Unknown command: batch\n"
+        self._run_steps([["set-revision", "42"], ["activate-conf"]])
+        self.assertEqual(self.server.executed, [
+            ["vigiconf-local", "batch", "set-revision:42", "activate-conf"],
+            ["vigiconf-local", "set-revision", "42"],
+            ["vigiconf-local", "activate-conf"],
+        ])
+        # le lot n'est plus tenté pour ce serveur
+        self.server.executed = []
+        self._run_steps([["activate-conf"]])
+        self.assertEqual(self.server.executed,
+                         [["vigiconf-local", "activate-conf"]])
+
+    def test_run_steps_batch_error(self):
+        """Lot de commandes: une étape en échec est signalée"""
+        self.server.command_result = (
+            '{"step": "stop-app:nagios", "status": "ok", "output": ""}\n'
+            '{"step": "activate-conf", "status": "error", '
+            '"output": "no new conf"}\n')
+        self.assertRaises(ServerError, self._run_steps,
+                          [["stop-app", "nagios"], ["activate-conf"],
+                           ["start-app", "nagios"]])
+        self.assertEqual(len(self.server.executed), 1)
+
+    def _compute_changes(self):
+        settings["vigiconf"]["skip_unchanged"] = "True"
+        try:
+            self.server.compute_changes()
+        finally:
+            del settings["vigiconf"]["skip_unchanged"]
+
+    def test_unchanged(self):
+        """Configuration inchangée: pas de déploiement"""
+        self._generate({"nagios/a.cfg": "a", "collector/c.pm": "c"})
+        self.server.keep_manifest(42)
+        self._generate({"nagios/a.cfg": "a", "collector/c.pm": "c"})
+        self.server.revisions.update({"conf": 43, "deployed": 42,
+                                      "installed": 42})
+        self._compute_changes()
+        self.assertFalse(self.server.needsDeployment())
+        self.assertTrue(self.server.isUnchanged())
+        self.assertEqual(self.server.changed_apps, set())
+
+    def test_changed_apps(self):
+        """Configuration modifiée: applications concernées"""
+        self._generate({"nagios/a.cfg": "a", "collector/c.pm": "c"})
+        self.server.keep_manifest(42)
+        self._generate({"nagios/a.cfg": "A", "collector/c.pm": "c"})
+        self.server.revisions.update({"conf": 43, "deployed": 42,
+                                      "installed": 42})
+        self._compute_changes()
+        self.assertTrue(self.server.needsDeployment())
+        self.assertFalse(self.server.isUnchanged())
+        self.assertEqual(self.server.changed_apps, set(["nagios"]))
+
+    def test_changed_root_files(self):
+        """Fichier hors application modifié: tout est redémarré"""
+        self._generate({"vigirrd.db": "a", "vigirrd/vigirrd.ini": "i",
+                        "nagios/a.cfg": "a"})
+        self.server.keep_manifest(42)
+        self._generate({"vigirrd.db": "b", "vigirrd/vigirrd.ini": "i",
+                        "nagios/a.cfg": "a"})
+        self.server.revisions.update({"conf": 43, "deployed": 42,
+                                      "installed": 42})
+        self._compute_changes()
+        self.assertTrue(self.server.needsDeployment())
+        self.assertEqual(self.server.changed_apps, None)
+        srv_mgr = ServerManager(None)
+        srv_mgr.servers = {"testserver": self.server}
+        only = srv_mgr.changed_apps(["testserver"], ["nagios", "vigirrd"])
+        self.assertEqual(only, {})
+        vigirrd = Mock()
+        vigirrd.name = "vigirrd"
+        vigirrd.priority = 0
+        vigirrd.actions = {"testserver": ["stop", "start"]}
+        vigirrd.filterServers.return_value = set(["testserver"])
+        tasks = ActionScheduler.build([vigirrd], "start", ["testserver"],
+                                      only)
+        self.assertEqual([ (t.application.name, t.server) for t in tasks ],
+                         [("vigirrd", "testserver")])
+
+    def test_changes_not_installed(self):
+        """Configuration de référence non installée: tout est déployé"""
+        self._generate({"nagios/a.cfg": "a"})
+        self.server.keep_manifest(42)
+        self.server.revisions.update({"conf": 43, "deployed": 42,
+                                      "installed": 41})
+        self._compute_changes()
+        self.assertTrue(self.server.needsDeployment())
+        self.assertEqual(self.server.changed_apps, None)
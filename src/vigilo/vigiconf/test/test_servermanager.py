@@ -7,10 +7,15 @@
 Test de l'objet ServerManager
 """
 
+import time
 import unittest
+import threading
 
 from mock import Mock
 
+from vigilo.common.conf import settings
+
+from vigilo.vigiconf.lib.exceptions import VigiConfError, DispatchatorError
 from vigilo.vigiconf.lib.server.manager import ServerManager
 
 
@@ -33,3 +38,109 @@ class ServerManagerTest(unittest.TestCase):
                                               force=("deploy", ))
         self.assertEqual(filtered, ["server1", "server2"])
 
+    def _pool_options(self, **kw):
+        options = {"concurrency": 0, "timeout": 0, "total_timeout": 0,
+                   "retries": 0, "retry_delay": 0}
+        options.update(kw)
+        self.srvmgr.get_pool_options = lambda: options
+
+    def test_run_in_thread_concurrency(self):
+        """Le nombre de serveurs traités simultanément est limité"""
+        self._pool_options(concurrency=2)
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+        def action():
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.05)
+            with lock:
+                state["running"] -= 1
+        servers = ["server%d" % i for i in range(6)]
+        for name in servers:
+            srv = Mock(name=name)
+            srv.testAction.side_effect = action
+            self.srvmgr.servers[name] = srv
+        result = self.srvmgr.run_in_thread(servers, "testAction")
+        self.assertTrue(result)
+        self.assertEqual(state["max"], 2)
+        for name in servers:
+            self.assertEqual(self.srvmgr.servers[name].testAction.call_count,
+                             1)
+
+    def test_run_in_thread_retry(self):
+        """Une action en échec est retentée"""
+        self._pool_options(retries=2)
+        srv = self.srvmgr.servers["server1"]
+        srv.testAction.side_effect = [VigiConfError("failed"), None]
+        result = self.srvmgr.run_in_thread(["server1"], "testAction",
+                                           retry=True)
+        self.assertTrue(result)
+        self.assertEqual(result["server1"].attempts, 2)
+
+    def test_run_in_thread_no_retry(self):
+        """Une action non idempotente n'est pas retentée"""
+        self._pool_options(retries=2)
+        srv = self.srvmgr.servers["server1"]
+        srv.switch_directories.side_effect = [VigiConfError("failed"), None]
+        self.assertRaises(DispatchatorError,
+                          self.srvmgr.switch_directories, ["server1"])
+        self.assertEqual(srv.switch_directories.call_count, 1)
+
+    def test_run_in_thread_failure(self):
+        """Le résultat est faux si l'action échoue sur un serveur"""
+        self.srvmgr.servers["server1"].testAction.return_value = None
+        self.srvmgr.servers["server2"].testAction.side_effect = \
+                VigiConfError("failed")
+        self._pool_options(retries=1)
+        result = self.srvmgr.run_in_thread(["server1", "server2"],
+                                           "testAction", retry=True)
+        self.assertFalse(result)
+        self.assertEqual(result.failed, ["server2"])
+        self.assertEqual(result["server2"].attempts, 2)
+        self.assertEqual(result["server2"].error, "failed")
+
+    def test_run_in_thread_timeout(self):
+        """Un serveur trop lent ne bloque pas les autres"""
+        self._pool_options(timeout=0.1)
+        self.srvmgr.servers["server1"].testAction.side_effect = \
+                lambda: time.sleep(1)
+        self.srvmgr.servers["server2"].testAction.return_value = None
+        start = time.time()
+        result = self.srvmgr.run_in_thread(["server1", "server2"],
+                                           "testAction")
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertFalse(result)
+        self.assertEqual(result.failed, ["server1"])
+        self.assertTrue(result["server1"].timeout)
+        self.assertTrue(result["server2"].success)
+
+    def test_poll_revisions_unreachable(self):
+        """Un serveur injoignable ne bloque pas l'interrogation des autres"""
+        self.srvmgr.servers["server1"].update_revisions.side_effect = \
+                lambda: time.sleep(1)
+        settings["vigiconf"]["revision_timeout"] = "0.1"
+        try:
+            start = time.time()
+            result = self.srvmgr.poll_revisions()
+        finally:
+            del settings["vigiconf"]["revision_timeout"]
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(result.failed, ["server1"])
+        self.assertTrue(result["server2"].success)
+
+    def test_poll_revisions_cache(self):
+        """Les révisions récemment récupérées sont conservées"""
+        self.srvmgr.poll_revisions()
+        self.srvmgr.poll_revisions()
+        for name in ["server1", "server2"]:
+            self.assertEqual(
+                self.srvmgr.servers[name].update_revisions.call_count, 1)
+        # une action sur un serveur invalide le cache
+        self._pool_options()
+        self.srvmgr.run_in_thread(["server1"], "testMethod")
+        self.srvmgr.poll_revisions()
+        self.assertEqual(
+            self.srvmgr.servers["server1"].update_revisions.call_count, 2)
+        self.assertEqual(
+            self.srvmgr.servers["server2"].update_revisions.call_count, 1)
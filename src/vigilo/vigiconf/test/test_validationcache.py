@@ -0,0 +1,83 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+
+"""
+Tests du cache des validations locales
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from vigilo.common.conf import settings
+
+from vigilo.vigiconf.lib.validationcache import ValidationCache
+from vigilo.vigiconf.lib.manifest import Manifest
+from vigilo.vigiconf.applications.vigirrd import VigiRRD
+
+
+class ValidationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tests-vigiconf-")
+        self.cache = ValidationCache(os.path.join(self.tmpdir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        """La clé dépend de l'application, de sa configuration et du script"""
+        key = ValidationCache.key("nagios", "abc", "nagios -v")
+        self.assertEqual(key, ValidationCache.key("nagios", "abc",
+                                                  "nagios -v"))
+        self.assertNotEqual(key, ValidationCache.key("collector", "abc",
+                                                     "nagios -v"))
+        self.assertNotEqual(key, ValidationCache.key("nagios", "abd",
+                                                     "nagios -v"))
+        self.assertNotEqual(key, ValidationCache.key("nagios", "abc",
+                                                     "nagios -V"))
+
+    def test_add(self):
+        """Enregistrement d'une validation réussie"""
+        key = ValidationCache.key("nagios", "abc", "nagios -v")
+        self.assertFalse(self.cache.has(key))
+        self.cache.add(key, "nagios server1")
+        self.assertTrue(self.cache.has(key))
+        # le cache est persistant
+        self.assertTrue(ValidationCache(self.cache.directory).has(key))
+
+    def test_prune(self):
+        """Les entrées les moins récemment utilisées sont supprimées"""
+        self.cache.max_entries = 2
+        for i in range(3):
+            self.cache.add("key%d" % i)
+            os.utime(os.path.join(self.cache.directory, "key%d" % i),
+                     (1000 + i, 1000 + i))
+        self.cache.prune()
+        self.assertEqual(sorted(os.listdir(self.cache.directory)),
+                         ["key1", "key2"])
+
+    def test_key_root_files(self):
+        """La clé dépend des fichiers à la racine de l'arborescence"""
+        old_libdir = settings["vigiconf"]["libdir"]
+        settings["vigiconf"]["libdir"] = self.tmpdir
+        try:
+            root = os.path.join(self.tmpdir, "deploy", "sup1")
+            os.makedirs(os.path.join(root, "vigirrd"))
+            def generate(db):
+                for path, content in (("vigirrd/vigirrd.ini", "ini"),
+                                      ("vigirrd.db", db)):
+                    with open(os.path.join(root, path), "w") as f:
+                        f.write(content)
+                Manifest.build("sup1").save(Manifest.generated_path("sup1"))
+            app = VigiRRD()
+            generate("db1")
+            key = app._validation_cache_key("sup1")
+            self.assertFalse(key is None)
+            generate("db2")
+            self.assertNotEqual(key, app._validation_cache_key("sup1"))
+        finally:
+            settings["vigiconf"]["libdir"] = old_libdir
@@ -0,0 +1,76 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests de l'index de la ventilation.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+from vigilo.vigiconf.lib.ventilation import VentilationIndex
+
+
+class DummyApp(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class VentilationIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.nagios = DummyApp("nagios")
+        self.metro = DummyApp("connector-metro")
+        self.index = VentilationIndex({
+            "host1": {self.nagios: "sup1", self.metro: ["sup1", "sup2"]},
+            "host2": {self.nagios: ["sup2"], self.metro: ["sup2", "sup1"]},
+            "host3": {self.nagios: "sup1"},
+        })
+
+    def test_servers_for_app(self):
+        """Ventilation: serveurs d'une application"""
+        self.assertEqual(self.index.servers_for_app(self.nagios),
+                         set(["sup1", "sup2"]))
+        self.assertEqual(self.index.servers_for_app("connector-metro"),
+                         set(["sup1", "sup2"]))
+        self.assertEqual(self.index.servers_for_app("vigirrd"), set())
+        self.assertEqual(self.index.servers(), set(["sup1", "sup2"]))
+
+    def test_hosts_for(self):
+        """Ventilation: hôtes d'une application sur un serveur"""
+        self.assertEqual(self.index.hosts_for("nagios", "sup1"),
+                         set(["host1", "host3"]))
+        # Les serveurs de secours sont pris en compte.
+        self.assertEqual(self.index.hosts_for("connector-metro", "sup1"),
+                         set(["host1", "host2"]))
+
+    def test_server_for(self):
+        """Ventilation: serveur nominal d'un hôte"""
+        self.assertEqual(self.index.server_for("host2", "nagios"), "sup2")
+        self.assertEqual(self.index.server_for("host2", "connector-metro"),
+                         "sup2")
+        self.assertEqual(self.index.servers_for("host1", "connector-metro"),
+                         ("sup1", "sup2"))
+        self.assertTrue(self.index.server_for("host3", "connector-metro")
+                        is None)
+
+    def test_compat(self):
+        """Ventilation: compatibilité avec le dictionnaire par application"""
+        self.assertEqual(self.index["host1"],
+                         {"nagios": "sup1",
+                          "connector-metro": ["sup1", "sup2"]})
+        self.assertEqual(sorted(self.index.keys()),
+                         ["host1", "host2", "host3"])
+        self.assertTrue("host3" in self.index)
+        self.assertEqual(self.index.app("nagios"), self.nagios)
+
+    def test_reassign(self):
+        """Ventilation: réaffectation d'un hôte"""
+        self.index.assign("host3", self.nagios, "sup2")
+        self.assertEqual(self.index.hosts_for("nagios", "sup1"),
+                         set(["host1"]))
+        self.assertEqual(self.index.hosts_for("nagios", "sup2"),
+                         set(["host2", "host3"]))
+        self.index.unassign("host1", "nagios")
+        self.assertEqual(self.index.servers_for_app("nagios"), set(["sup2"]))
@@ -0,0 +1,164 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests de la ventilation incrémentale.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+import vigilo.vigiconf.conf as conf
+from vigilo.vigiconf.lib.ventilation import Ventilator
+from vigilo.vigiconf.lib.ventilation.sticky import StickyVentilator
+
+
+class DummyApp(object):
+    def __init__(self, name, group):
+        self.name = name
+        self.group = group
+
+
+class RoundRobinVentilator(Ventilator):
+    """Ventilateur recalculant tout, sans tenir compte de l'existant"""
+
+    def ventilate(self):
+        servers = conf.appsGroupsByServer["collect"]["Servers"]
+        mapping = {}
+        for i, hostname in enumerate(sorted(conf.hostsConf)):
+            mapping[hostname] = {}
+            for app in self.apps:
+                mapping[hostname][app] = servers[i % len(servers)]
+        return mapping
+
+
+class BackupVentilator(RoundRobinVentilator):
+    """Ventilateur affectant aussi le serveur suivant en secours"""
+
+    def ventilate(self):
+        servers = conf.appsGroupsByServer["collect"]["Servers"]
+        mapping = super(BackupVentilator, self).ventilate()
+        for apps in mapping.itervalues():
+            for app, server in apps.items():
+                index = servers.index(server)
+                apps[app] = [server, servers[(index + 1) % len(servers)]]
+        return mapping
+
+
+class TestStickyVentilator(StickyVentilator):
+
+    def __init__(self, apps, previous, disabled=(),
+                 ventilator=RoundRobinVentilator):
+        super(TestStickyVentilator, self).__init__(
+            apps, ventilator(apps), overload_ratio=1.5)
+        self.previous = previous
+        self.disabled = set(disabled)
+
+    def load_previous(self):
+        return self.previous
+
+    def load_disabled(self):
+        return self.disabled
+
+
+class StickyVentilatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        conf.load_general_conf()
+        conf.appsGroupsByServer = {
+            "collect": {"Servers": ["sup1", "sup2"]},
+        }
+        self.apps = [DummyApp("nagios", "collect"),
+                     DummyApp("collector", "collect")]
+        self.previous = {}
+        for i in range(1, 7):
+            hostname = "host%d" % i
+            conf.hostsConf[hostname] = {"name": hostname,
+                                        "serverGroup": "Servers"}
+            # Ventilation précédente inversée par rapport
+            # à celle du ventilateur sous-jacent.
+            server = (i % 2) and "sup2" or "sup1"
+            for app in self.apps:
+                self.previous[(hostname, app.name)] = server
+
+    def tearDown(self):
+        conf.load_general_conf()
+
+    def _nominal(self, ventilation, server):
+        """Hôtes dont le serveur nominal pour Nagios est C{server}"""
+        return [ hostname for hostname in conf.hostsConf
+                 if ventilation.server_for(hostname, "nagios") == server ]
+
+    def test_keep(self):
+        """Ventilation incrémentale: les hôtes restent en place"""
+        ventilator = TestStickyVentilator(self.apps, self.previous)
+        ventilation = ventilator.ventilate()
+        for (hostname, appname), server in self.previous.iteritems():
+            self.assertEqual(ventilation.server_for(hostname, appname),
+                             server)
+        self.assertEqual(ventilator.moves, [])
+        self.assertEqual(ventilator.placed, 0)
+
+    def test_new_host(self):
+        """Ventilation incrémentale: placement d'un nouvel hôte"""
+        del self.previous[("host6", "nagios")]
+        del self.previous[("host6", "collector")]
+        del self.previous[("host4", "nagios")]
+        del self.previous[("host4", "collector")]
+        ventilator = TestStickyVentilator(self.apps, self.previous)
+        ventilation = ventilator.ventilate()
+        # Les deux nouveaux hôtes vont sur le serveur le moins chargé,
+        # toutes les applications du groupe sur le même serveur.
+        self.assertEqual(ventilation.server_for("host4", "nagios"), "sup1")
+        self.assertEqual(ventilation.server_for("host4", "collector"), "sup1")
+        self.assertEqual(ventilation.server_for("host6", "nagios"), "sup1")
+        self.assertEqual(ventilator.moves, [])
+        self.assertEqual(ventilator.placed, 2)
+
+    def test_disabled(self):
+        """Ventilation incrémentale: serveur désactivé"""
+        ventilator = TestStickyVentilator(self.apps, self.previous,
+                                          disabled=["sup2"])
+        ventilation = ventilator.ventilate()
+        self.assertEqual(ventilation.servers_for_app("nagios"),
+                         set(["sup1"]))
+        self.assertEqual(len(ventilator.moves), 3)
+
+    def test_backups(self):
+        """Ventilation incrémentale: serveurs de secours"""
+        ventilator = TestStickyVentilator(self.apps, self.previous,
+                                          ventilator=BackupVentilator)
+        ventilation = ventilator.ventilate()
+        # Le serveur nominal calculé par le ventilateur sous-jacent devient
+        # le secours de l'hôte maintenu sur l'autre serveur.
+        for (hostname, appname), server in self.previous.iteritems():
+            backup = server == "sup1" and "sup2" or "sup1"
+            self.assertEqual(ventilation.servers_for(hostname, appname),
+                             (server, backup))
+
+    def test_added_server(self):
+        """Ventilation incrémentale: rééquilibrage après ajout d'un serveur"""
+        conf.appsGroupsByServer["collect"]["Servers"].append("sup3")
+        ventilator = TestStickyVentilator(self.apps, self.previous)
+        ventilation = ventilator.ventilate()
+        for server in ("sup1", "sup2", "sup3"):
+            self.assertEqual(len(self._nominal(ventilation, server)), 2)
+        # Seuls les hôtes nécessaires au rééquilibrage sont déplacés.
+        self.assertEqual(len(ventilator.moves), 2)
+        for _hostname, _group, _old, new in ventilator.moves:
+            self.assertEqual(new, "sup3")
+
+    def test_overload(self):
+        """Ventilation incrémentale: rééquilibrage d'un serveur surchargé"""
+        for hostname, appname in self.previous:
+            if hostname == "host6":
+                self.previous[(hostname, appname)] = "sup2"
+            else:
+                self.previous[(hostname, appname)] = "sup1"
+        ventilator = TestStickyVentilator(self.apps, self.previous)
+        ventilation = ventilator.ventilate()
+        # 5 hôtes sur sup1 : au-delà de 1.5 fois la moyenne (3 hôtes).
+        self.assertEqual(len(self._nominal(ventilation, "sup1")), 4)
+        self.assertEqual(len(self._nominal(ventilation, "sup2")), 2)
+        self.assertEqual(len(ventilator.moves), 1)
@@ -0,0 +1,136 @@
+# vim: set fileencoding=utf-8 sw=4 ts=4 et :
+# pylint: disable-msg=C0111,W0212,R0904
+# Copyright (C) 2011-2020 CS GROUP - France
+# License: GNU GPL v2 <http://www.gnu.org/licenses/gpl-2.0.html>
+"""
+Tests de la ventilation pondérée par la charge des hôtes.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+import vigilo.vigiconf.conf as conf
+from vigilo.vigiconf.lib.ventilation.weighted import WeightedVentilator, \
+                                                     host_cost
+
+
+class DummyApp(object):
+    def __init__(self, name, group):
+        self.name = name
+        self.group = group
+
+
+def make_host(name, services=0, datasources=0, interval=None):
+    host = {
+        "name": name,
+        "serverGroup": "Servers",
+        "services": {},
+        "dataSources": {},
+        "SNMPJobs": {},
+        "nagiosDirectives": {"host": {}, "services": {}},
+        "nagiosSrvDirs": {},
+    }
+    for i in range(services):
+        host["services"]["svc%d" % i] = {"type": "active"}
+    for i in range(datasources):
+        host["dataSources"]["ds%d" % i] = {}
+    if interval is not None:
+        host["nagiosDirectives"]["services"]["check_interval"] = interval
+    conf.hostsConf[name] = host
+    return host
+
+
+class TestWeightedVentilator(WeightedVentilator):
+
+    def __init__(self, apps, disabled=()):
+        super(TestWeightedVentilator, self).__init__(apps)
+        self.disabled = set(disabled)
+
+    def load_disabled(self):
+        return self.disabled
+
+
+class HostCostTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        conf.load_general_conf()
+
+    def test_cost(self):
+        """Ventilation pondérée: coût d'un hôte"""
+        small = make_host("small", services=1)
+        big = make_host("big", services=10, datasources=100)
+        self.assertTrue(host_cost(big) > 10 * host_cost(small))
+
+    def test_interval(self):
+        """Ventilation pondérée: prise en compte de l'intervalle"""
+        normal = make_host("normal", services=10)
+        slow = make_host("slow", services=10, interval=10)
+        # Un service vérifié deux fois moins souvent coûte deux fois moins.
+        self.assertEqual(host_cost(normal) - host_cost(slow), 5)
+        slow["nagiosSrvDirs"]["svc0"] = {"check_interval": "1"}
+        self.assertEqual(host_cost(normal) - host_cost(slow), 0.5)
+
+
+class WeightedVentilatorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        conf.load_general_conf()
+        conf.appsGroupsByServer = {
+            "collect": {"Servers": ["sup1", "sup2"]},
+            "metrology": {"Servers": ["metro1"]},
+        }
+        conf.appsGroupsBackup = {
+            "metrology": {"Servers": ["metro2"]},
+        }
+        self.apps = [DummyApp("nagios", "collect"),
+                     DummyApp("collector", "collect"),
+                     DummyApp("connector-metro", "metrology")]
+
+    def tearDown(self):
+        conf.load_general_conf()
+
+    def test_balance(self):
+        """Ventilation pondérée: équilibrage de la charge"""
+        make_host("big", services=30)
+        for i in range(10):
+            make_host("small%d" % i, services=2)
+        ventilator = TestWeightedVentilator(self.apps)
+        ventilation = ventilator.ventilate()
+        # Le gros hôte est seul sur son serveur.
+        server = ventilation.server_for("big", "nagios")
+        self.assertEqual(ventilation.hosts_for("nagios", server),
+                         set(["big"]))
+        self.assertEqual(len(ventilation.hosts_for("collector", server)), 1)
+        loads = ventilator.loads["collect"]
+        self.assertTrue(abs(loads["sup1"] - loads["sup2"]) <
+                        host_cost(conf.hostsConf["small0"]) * 2)
+
+    def test_backup(self):
+        """Ventilation pondérée: serveurs de secours"""
+        make_host("host1")
+        ventilation = TestWeightedVentilator(self.apps).ventilate()
+        self.assertEqual(ventilation.servers_for("host1", "connector-metro"),
+                         ("metro1", "metro2"))
+
+    def test_community(self):
+        """Ventilation pondérée: édition Community"""
+        conf.appsGroupsByServer = {}
+        make_host("host1")
+        ventilation = TestWeightedVentilator(self.apps).ventilate()
+        self.assertEqual(ventilation["host1"],
+                         {"nagios": "localhost", "collector": "localhost",
+                          "connector-metro": "localhost"})
+
+    def test_disabled(self):
+        """Ventilation pondérée: serveurs désactivés"""
+        for i in range(4):
+            make_host("host%d" % i)
+        ventilation = TestWeightedVentilator(self.apps,
+                                             ["sup1"]).ventilate()
+        self.assertEqual(ventilation.hosts_for("nagios", "sup1"), set())
+        self.assertEqual(len(ventilation.hosts_for("nagios", "sup2")), 4)
+        # Serveur nominal désactivé : le serveur de secours le remplace.
+        ventilation = TestWeightedVentilator(self.apps,
+                                             ["metro1"]).ventilate()
+        self.assertEqual(ventilation.servers_for("host1", "connector-metro"),
+                         ("metro2", ))